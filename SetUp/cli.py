@@ -0,0 +1,313 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Headless entry point: build the simulator configuration without any window.
+
+A spec file is a JSON object with ``robot``, ``simulator`` and ``env`` sections, named
+after the fields of RobotConfig, SimulatorConfig and EnvConfig. When ``env`` has a
+``shapes`` list, it describes a drawn map instead: ``length``, ``width`` and the shapes
+accepted by ``OccupancyGrid.add_shape``. When it has an ``image``, the map is read from
+that site bitmap instead, ``scale`` metres per pixel, as described in
+``SetUp.raster_import``; ``length`` and ``width`` then default to the image's, and
+``classes``, ``mode`` and extra ``shapes`` may be given. Fields of more than
+``SetUp.quadtree.QUADTREE_MIN_TILES`` tiles are stored as quadtrees; set ``quadtree``
+to true or false to choose. For example::
+
+    {
+      "robot": {"type": "450X", "cutting_mode": "systematic - ping-pong"},
+      "simulator": {"dim_tassel": 0.2, "num_maps": 1, "repetitions": 1, "cycle": 60},
+      "env": {"length": 50, "width": 30, "shapes": [
+        {"kind": "circle", "x_center": 10, "y_center": 10, "radius": 2}
+      ]}
+    }
+
+Run ``python -m SetUp.cli --help`` for the options. Nothing here imports Tk or matplotlib.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from SetUp.data_classes import RobotConfig, EnvConfig, SimulatorConfig
+from SetUp.export import DATA_FILES, EXPORT_FORMATS, produce_json
+from SetUp.map_cache import MapCache, cache_key, default_cache
+from SetUp.robot_catalog import get_catalog
+from SetUp import tracing
+
+# numpy and the modules built on it are imported only when a map has to be rasterized,
+# so that generating configurations of plain EnvConfig ranges starts fast.
+
+# Values the wizard uses when the user leaves them out
+ROBOT_DEFAULTS = {"type": "", "cutting_mode": "", "guide_lines": 2, "algo": ""}
+
+
+def build_robot(section):
+    """Build a RobotConfig, filling speed, cut diameter and autonomy from the robot type."""
+    values = dict(ROBOT_DEFAULTS, **section)
+    if values["type"]:
+        robot_info = get_catalog().get(values["type"])
+        values.setdefault("speed", robot_info["speed"])
+        values.setdefault("cutting_diameter", robot_info["cut diameter"])
+        values.setdefault("autonomy", robot_info["autonomy"])
+    values["speed"] = float(values["speed"])
+    values["cutting_diameter"] = float(values["cutting_diameter"])
+    values["autonomy"] = int(values["autonomy"])
+    return RobotConfig(**values)
+
+
+def build_simulator(section):
+    """Build a SimulatorConfig."""
+    return SimulatorConfig(**section)
+
+
+def build_env(section, d_tassel, cache=None):
+    """
+    Build the environment: an EnvConfig of ranges, or an OccupancyGrid with the
+    listed shapes rasterized on it when the section has ``shapes``, either a list or
+    the path of a CSV, JSON or GeoJSON file read by ``SetUp.shape_import``, or read
+    from the site bitmap of its ``image``.
+
+    :param cache: The MapCache holding rasterized maps, by default ``default_cache()``.
+    """
+    if "shapes" not in section and "image" not in section:
+        return EnvConfig(**section)
+    from SetUp.occupancy import OccupancyGrid
+    from SetUp.quadtree import QuadGrid, use_quadtree
+    from SetUp.shape_import import load_shapes
+
+    image = None
+    if "image" in section:
+        from SetUp.raster_import import field_size, load_image_map
+
+        scale = float(section["scale"])
+        image_length, image_width = field_size(section["image"], scale)
+        stat = os.stat(section["image"])
+        # The file is identified by its size and modification time rather than hashed
+        image = {
+            "path": os.path.abspath(section["image"]), "size": stat.st_size,
+            "mtime": stat.st_mtime_ns, "scale": scale, "classes": section.get("classes"),
+            "mode": section.get("mode", "any"),
+        }
+    length = float(section["length"] if "length" in section or image is None else image_length)
+    width = float(section["width"] if "width" in section or image is None else image_width)
+    shapes = section.get("shapes", [])
+    if isinstance(shapes, str):
+        shapes = load_shapes(shapes, length, width)
+    quadtree = use_quadtree(length, width, d_tassel, section.get("quadtree"))
+    cache = cache or default_cache()
+    key = cache_key(
+        "drawn_map", length=length, width=width, d_tassel=d_tassel, shapes=shapes,
+        **({"image": image} if image else {}), **({"quadtree": True} if quadtree else {}),
+    )
+    entry = cache.get(key)
+    # Entries written without the shape index are rasterized again
+    if entry is not None and "shapes" in entry[1]:
+        if quadtree:
+            grid = QuadGrid.from_encoded(length, width, d_tassel, entry[0])
+        else:
+            grid = OccupancyGrid.from_packed(length, width, d_tassel, entry[0])
+        grid.shapes.insert_records(entry[1]["shapes"])
+        return grid
+
+    if image:
+        grid = load_image_map(
+            section["image"], scale, d_tassel, length, width, image["classes"], image["mode"], quadtree=quadtree,
+        )
+    else:
+        grid = QuadGrid(length, width, d_tassel) if quadtree else OccupancyGrid(length, width, d_tassel)
+    grid.add_shapes(shapes)
+    layers = grid.encoded() if quadtree else {name: grid.packed(name) for name in grid.layers}
+    cache.put(key, layers, {"shapes": grid.shapes.records()})
+    return grid
+
+
+def build_configs(spec, cache=None):
+    """Return the robot, simulator and environment configurations of a spec."""
+    simulator = build_simulator(spec["simulator"])
+    return [
+        build_robot(spec.get("robot", {})),
+        simulator,
+        build_env(spec["env"], simulator.dim_tassel, cache),
+    ]
+
+
+def estimate_spec(spec, cache=None):
+    """
+    Estimate the coverage time of the configuration of a spec.
+
+    :param cache: The MapCache holding rasterized maps, by default ``default_cache()``.
+    :return: The ``SetUp.estimator.Estimate``.
+    """
+    from SetUp.estimator import estimate, free_cells
+
+    robot, simulator, env = build_configs(spec, cache)
+    return estimate(robot, simulator, free_cells(env, simulator.dim_tassel))
+
+
+def generate_config(spec, export_format="json", path=None, maps=False, seed=0, workers=None,
+                    cache=None):
+    """
+    Build the configurations of a spec and write them with ``produce_json``.
+
+    :param spec: Spec dict, see the module docstring.
+    :param export_format: One of ``EXPORT_FORMATS``.
+    :param path: Output file, by default the one of ``export_format`` in the current
+        directory.
+    :param maps: Also generate the ``num_maps`` random maps of an EnvConfig, in
+        ``maps.npz`` next to the output file.
+    :param seed: Base seed of the random maps.
+    :param workers: Maximum worker processes generating the maps.
+    :param cache: The MapCache holding rasterized maps, by default ``default_cache()``.
+    :return: The path written.
+    """
+    cache = cache or default_cache()
+    configs = build_configs(spec, cache)
+    path = produce_json(configs, export_format, path)
+    robot, simulator, env = configs
+    if maps and isinstance(env, EnvConfig) and simulator.num_maps > 0:
+        from SetUp.mapgen import MAPS_FILE, generate_bundle
+
+        maps_path = os.path.join(os.path.dirname(path), MAPS_FILE)
+        generate_bundle(robot, simulator, env, maps_path, seed, workers, cache)
+    return path
+
+
+def parse_override(override):
+    """
+    Parse a ``section.key=value`` override; the value is read as JSON when possible.
+
+    :return: ``(target, value)`` where ``target`` is ``section.key``.
+    """
+    target, sep, raw_value = override.partition("=")
+    if not sep:
+        raise ValueError(f"Invalid override '{override}', expected section.key=value.")
+    try:
+        value = json.loads(raw_value)
+    except json.JSONDecodeError:
+        value = raw_value
+    return target, value
+
+
+def copy_spec(spec):
+    """Return a copy of ``spec`` whose sections can be modified independently."""
+    return {section: dict(values) for section, values in spec.items()}
+
+
+def set_value(spec, target, value):
+    """Set ``section.key`` of ``spec`` in place."""
+    section, dot, key = target.partition(".")
+    if not dot:
+        raise ValueError(f"Invalid spec key '{target}', expected section.key.")
+    spec.setdefault(section, {})[key] = value
+
+
+def apply_overrides(spec, overrides):
+    """Return a copy of ``spec`` with the ``section.key=value`` overrides applied."""
+    spec = copy_spec(spec)
+    for override in overrides:
+        set_value(spec, *parse_override(override))
+    return spec
+
+
+def load_spec(path):
+    with open(path, "r") as spec_file:
+        return json.load(spec_file)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m SetUp.cli",
+        description="Generate SMARTERS configuration files without the GUI.",
+    )
+    parser.add_argument(
+        "specs", nargs="*", metavar="SPEC",
+        help="JSON spec files; without any, the spec is built from --set only",
+    )
+    parser.add_argument(
+        "--set", dest="overrides", action="append", default=[], metavar="SECTION.KEY=VALUE",
+        help="set or override a spec value, e.g. --set robot.speed=0.5",
+    )
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="json", help="export format")
+    parser.add_argument(
+        "--maps", action="store_true",
+        help="also generate the num_maps random maps of the environment ranges in maps.npz",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="base seed of the random maps")
+    parser.add_argument("--workers", type=int, help="processes generating the random maps")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="rasterize every map even if it is cached"
+    )
+    parser.add_argument(
+        "--cache-stats", action="store_true", help="print the map cache statistics at the end"
+    )
+    parser.add_argument(
+        "--estimate", action="store_true",
+        help="print the estimated coverage time of each configuration, see SetUp.estimator",
+    )
+    parser.add_argument("--output", help="output file, for a single spec")
+    parser.add_argument(
+        "--output-dir",
+        help="write each spec to OUTPUT_DIR/<spec name>/ instead of the current directory",
+    )
+    parser.add_argument(
+        "--trace", metavar="FILE",
+        help="write a Chrome trace of the run to FILE and print a timing summary",
+    )
+    return parser
+
+
+def output_path(spec_path, args):
+    """Return where to write the configuration of ``spec_path``."""
+    if args.output:
+        return args.output
+    file_name = DATA_FILES[args.format]
+    if args.output_dir:
+        name = os.path.splitext(os.path.basename(spec_path))[0] if spec_path else "spec"
+        directory = os.path.join(args.output_dir, name)
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, file_name)
+    return file_name
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.output and len(args.specs) > 1:
+        parser.error("--output can only be used with a single spec; use --output-dir")
+
+    if args.trace:
+        tracing.enable(args.trace)
+
+    cache = MapCache(enabled=False) if args.no_cache else default_cache()
+    for spec_path in args.specs or [None]:
+        try:
+            spec = load_spec(spec_path) if spec_path else {}
+            spec = apply_overrides(spec, args.overrides)
+            if args.estimate:
+                print(f"{spec_path or 'spec'}: {estimate_spec(spec, cache).describe()}", file=sys.stderr)
+            path = generate_config(
+                spec, args.format, output_path(spec_path, args),
+                maps=args.maps, seed=args.seed, workers=args.workers, cache=cache,
+            )
+        except (KeyError, TypeError, ValueError, OSError) as e:
+            parser.error(f"{spec_path or 'spec'}: invalid configuration: {e!r}")
+        print(path)
+    if args.cache_stats:
+        print(json.dumps(cache.stats()), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Analytic estimate of the coverage time of a configuration, to screen it before running
+SMARTERS.
+
+The robot cuts a strip one ``cutting_diameter`` wide at ``speed``, so it sweeps
+``speed * cutting_diameter`` square metres per second:
+
+- In a systematic mode the free area is mowed in parallel strips. It takes at least the
+  free area over that rate, and at most ``SYSTEMATIC_OVERHEAD`` times as long for the
+  overlaps, turns and detours around obstacles.
+- In a random mode the strips fall anywhere. After sweeping ``k`` times the free area,
+  a fraction ``1 - exp(-k)`` of it is cut, so reaching ``coverage`` takes at least
+  ``-ln(1 - coverage)`` times the systematic time, and at most ``RANDOM_OVERHEAD`` times
+  that, as the robot bounces off borders and obstacles.
+
+The mode is the first word of ``cutting_mode``. The robot cuts ``autonomy`` minutes per
+charge, so a time ``t`` takes ``ceil(t / autonomy) - 1`` recharges, each costing
+``charge_time`` minutes. A configuration is infeasible when even the lower bound does
+not fit in the simulated ``cycle`` minutes, feasible when the upper bound does, and
+uncertain otherwise.
+
+Every function below takes arrays, so a whole sweep is scored at once.
+"""
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+
+# Time factors of the upper bounds over the ideal coverage
+SYSTEMATIC_OVERHEAD = 1.5
+RANDOM_OVERHEAD = 2.0
+# Fraction of the free area a random mode has to cut
+COVERAGE = 0.95
+# Minutes per recharge counted against the cycle, about what the Automowers of robots.json
+# take to charge; the robot configuration has no charging time of its own
+CHARGE_TIME = 60.0
+# Layers the robot cannot mow
+OBSTACLE_LAYERS = ("squares", "circles")
+STATUSES = ("feasible", "uncertain", "infeasible")
+
+
+def is_systematic(cutting_mode):
+    """Return True if ``cutting_mode``, e.g. ``"systematic - ping-pong"``, mows in strips."""
+    return cutting_mode.strip().lower().startswith("systematic")
+
+
+def grid_free_cells(grid):
+    """Return the number of tiles of an OccupancyGrid or QuadGrid not covered by obstacles."""
+    rows, cols = grid.shape
+    return rows * cols - grid.count(*OBSTACLE_LAYERS)
+
+
+def env_free_area(env):
+    """
+    Return the least and largest free area of the random maps of an EnvConfig, in square
+    metres: the field minus its obstacles, all of the largest or smallest size, assumed
+    not to overlap.
+    """
+    field = env.length * env.width
+
+    def blocked(width, height, ray):
+        return env.num_blocked_squares * width * height + env.num_blocked_circles * np.pi * ray ** 2
+
+    most = blocked(env.max_width_square, env.max_height_square, env.max_ray)
+    least = blocked(env.min_width_square, env.min_height_square, env.min_ray)
+    return max(field - most, 0.0), max(field - least, 0.0)
+
+
+def free_cells(env, d_tassel):
+    """
+    Return the least and largest number of free tiles of an environment.
+
+    :param env: An EnvConfig, OccupancyGrid or QuadGrid.
+    :param d_tassel: Side of a tile, in metres.
+    """
+    if hasattr(env, "count"):
+        cells = grid_free_cells(env)
+        return cells, cells
+    low, high = env_free_area(env)
+    return low / d_tassel ** 2, high / d_tassel ** 2
+
+
+def coverage_bounds(free_area, speed, cutting_diameter, systematic, coverage=COVERAGE):
+    """
+    Return the lower and upper bounds on the cutting time, in minutes.
+
+    :param free_area: Free area, in square metres, or ``(low, high)`` bounds on it.
+    :param speed: Speed, in metres per second.
+    :param cutting_diameter: Cutting diameter, in metres.
+    :param systematic: True for the systematic modes.
+    :param coverage: Fraction of the free area a random mode has to cut.
+    """
+    low, high = free_area if isinstance(free_area, tuple) else (free_area, free_area)
+    rate = np.asarray(speed, dtype=float) * np.asarray(cutting_diameter, dtype=float) * 60
+    systematic = np.asarray(systematic, dtype=bool)
+    passes = np.where(systematic, 1.0, -np.log1p(-coverage))
+    overhead = np.where(systematic, SYSTEMATIC_OVERHEAD, RANDOM_OVERHEAD)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lower = np.where(rate > 0, np.asarray(low, dtype=float) * passes / rate, np.inf)
+        upper = np.where(rate > 0, np.asarray(high, dtype=float) * passes * overhead / rate, np.inf)
+    return lower, upper
+
+
+def recharges(minutes, autonomy):
+    """Return the recharges needed to cut ``minutes`` with ``autonomy`` minutes per charge."""
+    autonomy = np.asarray(autonomy, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        runs = np.where(autonomy > 0, np.ceil(np.asarray(minutes) / autonomy - 1e-9), np.inf)
+    return np.maximum(runs - 1, 0)
+
+
+def estimate_arrays(free_area, speed, cutting_diameter, autonomy, cycle, systematic,
+                    coverage=COVERAGE, charge_time=CHARGE_TIME):
+    """
+    Estimate many configurations at once; the arguments broadcast together.
+
+    :param free_area: Free area, in square metres, or ``(low, high)`` bounds on it.
+    :param autonomy: Cutting minutes per charge.
+    :param cycle: Simulated cutting minutes.
+    :param charge_time: Minutes per recharge counted against the cycle.
+    :return: Dict of arrays: ``lower`` and ``upper`` minutes, ``min_recharges`` and
+        ``max_recharges``, and ``status``, an index into ``STATUSES``.
+    """
+    lower, upper = coverage_bounds(free_area, speed, cutting_diameter, systematic, coverage)
+    min_recharges, max_recharges = recharges(lower, autonomy), recharges(upper, autonomy)
+    cycle = np.asarray(cycle, dtype=float)
+    with np.errstate(invalid="ignore"):
+        fits_lower = lower + min_recharges * charge_time <= cycle
+        fits_upper = upper + max_recharges * charge_time <= cycle
+    status = np.where(fits_upper, 0, np.where(fits_lower, 1, 2))
+    return {
+        "lower": lower,
+        "upper": upper,
+        "min_recharges": min_recharges,
+        "max_recharges": max_recharges,
+        "status": status,
+    }
+
+
+@dataclass
+class Estimate:
+    """
+    Bounds on the coverage time of one configuration.
+    """
+    lower: float
+    upper: float
+    min_recharges: float
+    max_recharges: float
+    status: str
+    cycle: float
+
+    def describe(self):
+        """Return a one-line summary of the estimate."""
+        def rounded(value):
+            return f"{value:.0f}" if math.isfinite(value) else "inf"
+
+        return (
+            f"Estimated coverage {rounded(self.lower)}-{rounded(self.upper)} min with "
+            f"{rounded(self.min_recharges)}-{rounded(self.max_recharges)} recharges for a "
+            f"{self.cycle:g} min cycle: {self.status}"
+        )
+
+
+def estimate(robot, simulator, cells, coverage=COVERAGE, charge_time=CHARGE_TIME):
+    """
+    Estimate the coverage time of one configuration.
+
+    :param robot: The RobotConfig.
+    :param simulator: The SimulatorConfig.
+    :param cells: Number of free tiles, or ``(low, high)`` bounds on it, see ``free_cells``.
+    :return: An Estimate.
+    """
+    low, high = cells if isinstance(cells, tuple) else (cells, cells)
+    area = simulator.dim_tassel ** 2
+    result = estimate_arrays(
+        (low * area, high * area), robot.speed, robot.cutting_diameter, robot.autonomy,
+        simulator.cycle, is_systematic(robot.cutting_mode), coverage, charge_time,
+    )
+    return Estimate(
+        float(result["lower"]), float(result["upper"]), float(result["min_recharges"]),
+        float(result["max_recharges"]), STATUSES[int(result["status"])], simulator.cycle,
+    )
+
+
+def estimate_many(robots, simulators, cells, coverage=COVERAGE, charge_time=CHARGE_TIME):
+    """
+    Estimate a list of configurations, e.g. the candidates of a sweep, in one pass.
+
+    :param robots: List of RobotConfig.
+    :param simulators: List of SimulatorConfig, one per robot.
+    :param cells: List of free tile counts or ``(low, high)`` bounds, one per robot.
+    :return: Dict of arrays, see ``estimate_arrays``.
+    """
+    bounds = np.array([pair if isinstance(pair, tuple) else (pair, pair) for pair in cells],
+                      dtype=float).reshape(-1, 2)
+    area = np.array([simulator.dim_tassel for simulator in simulators], dtype=float) ** 2
+    return estimate_arrays(
+        (bounds[:, 0] * area, bounds[:, 1] * area),
+        [robot.speed for robot in robots],
+        [robot.cutting_diameter for robot in robots],
+        [robot.autonomy for robot in robots],
+        [simulator.cycle for simulator in simulators],
+        [is_systematic(robot.cutting_mode) for robot in robots],
+        coverage, charge_time,
+    )
@@ -0,0 +1,106 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import os
+import sys
+import warnings
+
+from SetUp.tracing import span
+
+# Output file of each export format
+DATA_FILES = {
+    "json": "data_file", "json-compact": "data_file", "json-vector": "data_file", "npz": "data_file.npz",
+}
+EXPORT_FORMATS = tuple(DATA_FILES)
+# Overlapping shapes listed in the export warning
+MAX_REPORTED_CONFLICTS = 20
+
+
+def resource_path(relative_path):
+    """
+    Locate a bundled resource: in the PyInstaller bundle, in the current directory, or
+    failing that in the project root next to the SetUp package.
+    """
+    base_path = getattr(sys, "_MEIPASS", os.path.abspath("."))
+    path = os.path.join(base_path, relative_path)
+    if not os.path.exists(path):
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        fallback = os.path.join(project_root, relative_path)
+        if os.path.exists(fallback):
+            return fallback
+    return path
+
+
+def conflict_messages(grid):
+    """Describe the shapes of ``grid`` that overlap where they must not, one line per pair."""
+    from SetUp.spatial_index import describe
+
+    return [f"{describe(a)} overlaps {describe(b)}" for a, b in grid.shapes.conflicts()]
+
+
+def produce_json(data, export_format="json", path=None, run=None):
+    """
+    Write the configuration collected by the wizard.
+
+    :param data: Robot, simulator and environment configurations, in this order. The
+        environment is either an EnvConfig or the OccupancyGrid (or QuadGrid, for large
+        fields) drawn in the map editor.
+    :param export_format: ``"json"`` for the plain ``data_file``, ``"json-compact"`` for
+        the same file without whitespace and with flattened cell arrays, ``"json-vector"``
+        for a compact ``data_file`` listing the shapes of a drawn map rather than their
+        tiles (see ``SetUp.vector_format``), ``"npz"`` for a JSON header plus bit-packed
+        layers in ``data_file.npz``; the layers of a QuadGrid are written as encoded
+        quadtrees there.
+    :param path: Output file, by default the one of ``export_format`` in the current
+        directory.
+    :param run: JSON-serializable value telling apart runs of the same configuration
+        that must not share results, e.g. the repetitions of a shard; part of the
+        fingerprint.
+    :return: The path written. Obstacles overlapping an isolated area or an opening are
+        reported with a warning; the configuration is written anyway. The fingerprint of
+        the configuration is written next to it, see ``SetUp.result_store``.
+    """
+    # Imported here so that loading this module does not pull in numpy
+    from SetUp.json_stream import write_config
+    from SetUp.map_format import write_npz
+    from SetUp.occupancy import OccupancyGrid
+    from SetUp.quadtree import QuadGrid
+    from SetUp.result_store import write_fingerprint
+    from SetUp.vector_format import vector_env
+
+    if export_format not in DATA_FILES:
+        raise ValueError(f"Unknown export format '{export_format}'.")
+    path = path or DATA_FILES[export_format]
+
+    env = data[2]
+    grid = env if isinstance(env, (OccupancyGrid, QuadGrid)) else None
+    if grid is not None:
+        conflicts = conflict_messages(grid)
+        if conflicts:
+            listed = "\n".join(conflicts[:MAX_REPORTED_CONFLICTS])
+            warnings.warn(f"{len(conflicts)} overlapping shape(s):\n{listed}", stacklevel=2)
+    with span("produce_json", format=export_format) as trace:
+        if export_format == "npz":
+            data_config = {"robot": data[0], "env": None if grid else env, "simulator": data[1]}
+            write_npz(data_config, grid, path)
+        else:
+            if export_format == "json-vector" and grid is not None:
+                env = vector_env(grid)
+            data_config = {"robot": data[0], "env": env, "simulator": data[1]}
+            with open(path, "w") as data_file:
+                write_config(data_file, data_config, compact=export_format != "json")
+        write_fingerprint(data, path, run)
+        if trace.active:
+            trace.count("bytes_written", os.path.getsize(path))
+    return path
@@ -0,0 +1,268 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import math
+
+import numpy as np
+from matplotlib.collections import Collection, LineCollection
+from matplotlib.image import AxesImage
+from matplotlib.patches import Rectangle
+
+# Grid lines are hidden when a tile is rendered smaller than this many pixels
+MIN_TILE_PIXELS = 4
+# Largest side of the image showing the marked tiles, in image pixels
+MAX_IMAGE_SIDE = 2048
+
+
+class GridRenderer:
+    """
+    Draw the tile grid of the map editor with a single LineCollection.
+
+    Only the grid lines inside the current view are generated, and they are hidden
+    entirely while tiles are too small to be told apart, so the cost of a redraw
+    depends on the screen size rather than on the number of tiles.
+
+    The field length runs along the x axis and its width along the y axis, as the rows
+    and columns of an OccupancyGrid and the image built by ``occupancy_image``.
+    """
+
+    def __init__(self, ax, length, width, tile_size, min_tile_pixels=MIN_TILE_PIXELS):
+        """
+        Initialize the GridRenderer.
+
+        :param ax: The axes the grid is drawn on.
+        :param length: Field extent along the x axis, in metres.
+        :param width: Field extent along the y axis, in metres.
+        :param tile_size: Side of a square tile, in metres.
+        :param min_tile_pixels: Smallest on-screen tile size for which lines are drawn.
+        """
+        self.ax = ax
+        self.tile_size = tile_size
+        self.min_tile_pixels = min_tile_pixels
+        # Tiles along x and y, as many as np.arange(0, length, tile_size) used for the tiles
+        self.x_tiles = len(np.arange(0, length, tile_size))
+        self.y_tiles = len(np.arange(0, width, tile_size))
+        self.length, self.width = length, width
+
+        self.lines = LineCollection([], colors="black", linewidths=0.5)
+        self.border = Rectangle(
+            (0, 0), self.x_tiles * tile_size, self.y_tiles * tile_size,
+            fill=None, edgecolor="black",
+        )
+        self._callbacks = []
+
+    def draw(self):
+        """Add the grid artists to the axes and follow view changes."""
+        self.ax.add_collection(self.lines, autolim=False)
+        self.ax.add_patch(self.border)
+        self.ax.set_xlim(0, self.length)
+        self.ax.set_ylim(0, self.width)
+        self.ax.set_aspect("equal")
+        self._callbacks = [
+            (self.ax.callbacks, self.ax.callbacks.connect("xlim_changed", self.update)),
+            (self.ax.callbacks, self.ax.callbacks.connect("ylim_changed", self.update)),
+            (
+                self.ax.figure.canvas,
+                self.ax.figure.canvas.mpl_connect("resize_event", self.update),
+            ),
+        ]
+        self.update()
+
+    def disconnect(self):
+        """Stop following view changes."""
+        for registry, cid in self._callbacks:
+            if hasattr(registry, "mpl_disconnect"):
+                registry.mpl_disconnect(cid)
+            else:
+                registry.disconnect(cid)
+        self._callbacks = []
+
+    def tile_pixels(self):
+        """Return the on-screen size of one tile, in pixels."""
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        bbox = self.ax.bbox
+        x_scale = bbox.width / max(abs(x_max - x_min), 1e-12)
+        y_scale = bbox.height / max(abs(y_max - y_min), 1e-12)
+        return self.tile_size * min(x_scale, y_scale)
+
+    def visible_range(self, low, high, count):
+        """Return the first and last grid line index within ``[low, high]``."""
+        low, high = min(low, high), max(low, high)
+        first = max(math.floor(low / self.tile_size), 0)
+        last = min(math.ceil(high / self.tile_size), count)
+        return first, last
+
+    def update(self, *_):
+        """Regenerate the visible grid lines for the current view."""
+        if self.tile_pixels() < self.min_tile_pixels:
+            self.lines.set_visible(False)
+            self.lines.set_segments([])
+            return
+
+        x_first, x_last = self.visible_range(*self.ax.get_xlim(), self.x_tiles)
+        y_first, y_last = self.visible_range(*self.ax.get_ylim(), self.y_tiles)
+        if x_first > x_last or y_first > y_last:
+            self.lines.set_visible(False)
+            self.lines.set_segments([])
+            return
+
+        xs = np.arange(x_first, x_last + 1) * self.tile_size
+        ys = np.arange(y_first, y_last + 1) * self.tile_size
+        bottom, top = ys[0], ys[-1]
+        left, right = xs[0], xs[-1]
+
+        vertical = np.empty((len(xs), 2, 2))
+        vertical[:, :, 0] = xs[:, None]
+        vertical[:, 0, 1], vertical[:, 1, 1] = bottom, top
+
+        horizontal = np.empty((len(ys), 2, 2))
+        horizontal[:, :, 1] = ys[:, None]
+        horizontal[:, 0, 0], horizontal[:, 1, 0] = left, right
+
+        self.lines.set_segments(np.concatenate((vertical, horizontal)))
+        self.lines.set_visible(True)
+
+
+def occupancy_image(ax, grid, colors, max_side=MAX_IMAGE_SIDE):
+    """
+    Build an image of the tiles marked in a grid, one color per layer.
+
+    Large fields are reduced by a power of two until the image fits in ``max_side``
+    pixels a side, a reduced tile being colored when any of its tiles is marked, so
+    the cost depends on the image size and, for a QuadGrid, on its number of nodes
+    rather than on the number of tiles.
+
+    The rows of the grid, along the field length, are drawn along the x axis and its
+    columns along the y axis, as by GridRenderer.
+
+    :param grid: An OccupancyGrid or a QuadGrid.
+    :param colors: Dict mapping layer names to RGBA colors as four bytes.
+    :return: The AxesImage, not added to the axes yet, or None if no tile is marked.
+    """
+    if not any(grid[layer].any() for layer in colors if layer in grid.layers):
+        return None
+    level = 0
+    while max(grid.shape) > max_side << level:
+        level += 1
+    step = 2 ** level
+    rows, cols = -(-grid.shape[0] // step), -(-grid.shape[1] // step)
+    # Row j of the image is column j of the grid, drawn from the bottom
+    pixels = np.zeros((cols, rows, 4), dtype=np.uint8)
+    for layer, color in colors.items():
+        if layer in grid.layers:
+            pixels[grid.raster(layer, level).T] = color
+    image = AxesImage(
+        ax, interpolation="nearest", origin="lower",
+        extent=(0, rows * step * grid.d_tassel, 0, cols * step * grid.d_tassel),
+    )
+    image.set_data(pixels)
+    return image
+
+
+class ShapeBlitter:
+    """
+    Add shape patches to the map editor without re-rendering the whole figure.
+
+    The rendered axes (grid, field border and the shapes already placed) are cached
+    after every full draw. A new patch is drawn on top of that background and blitted
+    to the screen, and the result becomes the new background, so the cost of adding a
+    shape does not depend on how many there already are. Patches added in quick
+    succession are flushed together on the next idle timer tick.
+    """
+
+    def __init__(self, ax):
+        """
+        Initialize the ShapeBlitter.
+
+        :param ax: The axes the shapes are drawn on.
+        """
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.background = None
+        self.pending = []
+        self._scheduled = False
+        self._timer = self.canvas.new_timer(interval=0)
+        self._timer.single_shot = True
+        self._timer.add_callback(self.flush)
+        self._draw_cid = self.canvas.mpl_connect("draw_event", self.on_draw)
+
+    def disconnect(self):
+        """Stop following full redraws."""
+        self.canvas.mpl_disconnect(self._draw_cid)
+        self._timer.stop()
+
+    def add(self, patch):
+        """
+        Add ``patch`` to the axes, schedule it to be drawn and return it.
+
+        :param patch: A Patch, a Collection of many shapes drawn as one artist, or an
+            AxesImage of tiles.
+        """
+        patch.set_animated(True)
+        if isinstance(patch, Collection):
+            self.ax.add_collection(patch, autolim=False)
+        elif isinstance(patch, AxesImage):
+            self.ax.add_image(patch)
+        else:
+            self.ax.add_patch(patch)
+        self.pending.append(patch)
+        if not self._scheduled:
+            self._scheduled = True
+            if self.background is None:
+                # Nothing cached yet: on_draw will draw the patch after the full redraw
+                self.canvas.draw_idle()
+            else:
+                self._timer.start()
+        return patch
+
+    def remove(self, patch):
+        """Take ``patch`` off the axes and schedule a full redraw."""
+        if patch in self.pending:
+            self.pending.remove(patch)
+        patch.remove()
+        # The cached background still shows the patch until the next full redraw
+        self.background = None
+        self.canvas.draw_idle()
+
+    def on_draw(self, event=None):
+        """Cache the axes rendered by a full redraw, then draw the pending patches on it."""
+        if not self.canvas.supports_blit:
+            # Nothing to cache: flush hands the pending patches to the next full redraw
+            self.flush()
+            return
+        # Animated patches are skipped by a full redraw, so the pending ones are not cached
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        self.flush()
+
+    def flush(self):
+        """Draw the pending patches on the cached background and blit the axes."""
+        self._scheduled = False
+        if not self.pending:
+            return
+        if self.background is None or not self.canvas.supports_blit:
+            for patch in self.pending:
+                patch.set_animated(False)
+            self.pending = []
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.background)
+        for patch in self.pending:
+            self.ax.draw_artist(patch)
+            # From now on, full redraws render the patch like any other artist
+            patch.set_animated(False)
+        self.pending = []
+        self.canvas.blit(self.ax.bbox)
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
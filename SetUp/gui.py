@@ -13,46 +13,40 @@
  See the License for the specific language governing permissions and
  limitations under the License."""
 
-import json
-import math
 import os
-import subprocess
-import sys
+import shutil
 import tkinter as tk
 from tkinter import Tk, ttk
-from tkinter import simpledialog, filedialog, colorchooser
+from tkinter import simpledialog, filedialog, colorchooser, messagebox, scrolledtext
 from tkinter.ttk import Button
 
-import numpy as np
-from future.moves.tkinter import simpledialog, colorchooser
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from SetUp.data_classes import RobotConfig, EnvConfig, SimulatorConfig
+from SetUp.export import DATA_FILES, EXPORT_FORMATS, produce_json
+from SetUp.launcher import SimulatorProcess
+from SetUp.robot_catalog import get_catalog
+from SetUp.tracing import traced
 
-from SetUp.data_classes import RobotConfig, EnvConfig, SimulatorConfig, ConfigEncoder
+# matplotlib, numpy and the modules built on them take seconds to import, so they are
+# imported inside the map editor and rasterization functions, the first time those run.
+
+# Colors of the imported shapes, by layer
+LAYER_COLORS = {"squares": "tab:red", "circles": "tab:red", "isolated_area": "black", "opening": "yellow"}
+SHAPE_FILE_TYPES = [("Shape files", "*.csv *.json *.geojson"), ("All files", "*")]
+IMAGE_FILE_TYPES = [("Site images", "*.png *.pgm *.ppm *.pnm *.npy"), ("All files", "*")]
+# Directory, under the one the tool was started from, where the wizard runs the simulator
+RUN_DIR = "smarters_run"
 
 # Global objects
+grid_renderer = None
+shape_blitter = None
 python_objects = []
 objects_data = {
     "length": 100.0,
     "width": 100.0,
-    "circles": [],
-    "squares": [],
-    "isolated_area": [],
-    "opening": [],
+    "grid": None,
+    "history": None,
 }
 
-
-def resource_path(relative_path):
-    base_path = getattr(sys, "_MEIPASS", os.path.abspath("."))
-    return os.path.join(base_path, relative_path)
-
-
-def produce_json(data):
-    data_config = {"robot": data[0], "env": data[2], "simulator": data[1]}
-    with open("data_file", "w") as data_file:
-        json.dump(data_config, data_file, cls=ConfigEncoder, indent=2)
-
-
 def from_dialogs():
     """Open the environment creation window using dialogs."""
     EnvironmentWindow()
@@ -60,7 +54,6 @@ def from_dialogs():
 
 def add_isolated_area():
     shape = simpledialog.askstring("Input", "Enter the isolated area shape:")
-    d_tassel = python_objects[1].dim_tassel
 
     if shape == "Square":
         x, y = get_coordinates("bottom-left corner")
@@ -68,10 +61,13 @@ def add_isolated_area():
         opening_x, opening_y = get_coordinates("openings' bottom-left corner")
         opening_width, opening_height = get_dimensions("opening")
 
-        draw_rectangle(x, y, width, height, "black")
-        draw_rectangle(opening_x, opening_y, opening_width, opening_height, "yellow")
+        # Rasterized first: if a dialog was cancelled, nothing is drawn or recorded
+        with objects_data["history"].record("Add isolated area") as edit:
+            update_area_coordinates(x, y, width, height, "isolated_area")
+            update_area_coordinates(opening_x, opening_y, opening_width, opening_height, "opening")
 
-        update_area_coordinates(x, y, width, height, d_tassel, "isolated_area")
+            edit.artists.append(draw_rectangle(x, y, width, height, "black"))
+            edit.artists.append(draw_rectangle(opening_x, opening_y, opening_width, opening_height, "yellow"))
     else:
         x_center, y_center, radius = get_circle_data()
         opening_x, opening_y = get_coordinates("openings' bottom-left corner")
@@ -80,12 +76,12 @@ def add_isolated_area():
         color = colorchooser.askcolor()[1]
         label = simpledialog.askstring("Input", "Enter the label:")
 
-        draw_circle(x_center, y_center, radius, color, label)
-        draw_rectangle(opening_x, opening_y, opening_width, opening_height, "yellow")
+        with objects_data["history"].record("Add isolated area") as edit:
+            update_area_coordinates_for_circle(x_center, y_center, radius, "isolated_area")
+            update_area_coordinates(opening_x, opening_y, opening_width, opening_height, "opening")
 
-        update_area_coordinates_for_circle(x_center, y_center, radius, d_tassel, "is_area")
-
-    update_area_coordinates(opening_x, opening_y, opening_width, opening_height, d_tassel, "opening")
+            edit.artists.append(draw_circle(x_center, y_center, radius, color, label))
+            edit.artists.append(draw_rectangle(opening_x, opening_y, opening_width, opening_height, "yellow"))
 
 
 def add_square():
@@ -94,8 +90,9 @@ def add_square():
     color = colorchooser.askcolor()[1]
     label = simpledialog.askstring("Input", "Enter the label:")
 
-    draw_rectangle(x, y, width, height, color, label)
-    update_area_coordinates(x, y, width, height, python_objects[1].dim_tassel, "squares")
+    with objects_data["history"].record("Add square") as edit:
+        update_area_coordinates(x, y, width, height, "squares")
+        edit.artists.append(draw_rectangle(x, y, width, height, color, label))
 
 
 def add_circle():
@@ -103,24 +100,108 @@ def add_circle():
     color = colorchooser.askcolor()[1]
     label = simpledialog.askstring("Input", "Enter the label:")
 
-    draw_circle(x_center, y_center, radius, color, label)
-    update_area_coordinates_for_circle(x_center, y_center, radius, python_objects[1].dim_tassel, "circles")
+    with objects_data["history"].record("Add circle") as edit:
+        update_area_coordinates_for_circle(x_center, y_center, radius, "circles")
+        edit.artists.append(draw_circle(x_center, y_center, radius, color, label))
+
+
+def import_shapes():
+    """Add all the shapes of a CSV, JSON or GeoJSON file to the map at once."""
+    from SetUp.export import MAX_REPORTED_CONFLICTS, conflict_messages
+    from SetUp.shape_import import load_shapes
+
+    file_path = filedialog.askopenfilename(filetypes=SHAPE_FILE_TYPES)
+    if not file_path:
+        return
+    grid = objects_data["grid"]
+    try:
+        shapes = load_shapes(file_path, grid.length, grid.width)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("SetUpSmarters", f"Could not import the shapes:\n{e}")
+        return
+
+    with objects_data["history"].record(f"Import {len(shapes)} shapes") as edit:
+        grid.add_shapes(shapes)
+        edit.artists.append(draw_shapes(shapes))
 
+    conflicts = conflict_messages(grid)
+    if conflicts:
+        lines = "\n".join(conflicts[:MAX_REPORTED_CONFLICTS])
+        messagebox.showwarning("Overlapping shapes", f"{len(conflicts)} overlapping shape(s):\n{lines}")
 
+
+def import_image():
+    """Mark the obstacles, isolated areas and openings of a site image on the map."""
+    from SetUp.raster_import import MODES, rasterize_image, read_image
+
+    file_path = filedialog.askopenfilename(filetypes=IMAGE_FILE_TYPES)
+    if not file_path:
+        return
+    grid = objects_data["grid"]
+    try:
+        pixels, maxval = read_image(file_path)
+    except (OSError, ValueError) as e:
+        messagebox.showerror("SetUpSmarters", f"Could not read the image:\n{e}")
+        return
+    scale = simpledialog.askfloat(
+        "Input", "Enter the size of a pixel, in metres:",
+        initialvalue=grid.length / pixels.shape[1], minvalue=1e-6,
+    )
+    if scale is None:
+        return
+    majority = messagebox.askyesno(
+        "Input", "Mark a tile only when most of its pixels are covered?\n"
+                 "(No: mark it when any of them is.)",
+    )
+    with objects_data["history"].record(f"Import {os.path.basename(file_path)}") as edit:
+        rasterize_image(grid, pixels, scale, mode=MODES[1] if majority else MODES[0], maxval=maxval)
+        edit.artists.append(draw_tiles(edit))
+
+
+def undo():
+    """Remove the last shape added in the map editor."""
+    edit = objects_data["history"].undo()
+    if edit is not None:
+        for artist in edit.artists:
+            shape_blitter.remove(artist)
+
+
+def redo():
+    """Add the last undone shape back."""
+    edit = objects_data["history"].redo()
+    if edit is not None:
+        for artist in edit.artists:
+            shape_blitter.add(artist)
+
+
+def reset_map():
+    """Forget the map being edited, so that it does not linger after leaving the editor."""
+    objects_data["grid"] = None
+    objects_data["history"] = None
+
+
+@traced()
 def draw_map():
+    global grid_renderer, shape_blitter
+    from SetUp.grid_renderer import GridRenderer, ShapeBlitter, occupancy_image
+
+    if grid_renderer is not None:
+        grid_renderer.disconnect()
+    if shape_blitter is not None:
+        shape_blitter.disconnect()
     ax.clear()
     width, length = objects_data["width"], objects_data["length"]
     tile_size = python_objects[1].dim_tassel
-    x_positions = np.arange(0, width, tile_size)
-    y_positions = np.arange(0, length, tile_size)
-
-    for x in x_positions:
-        for y in y_positions:
-            ax.add_patch(plt.Rectangle((x, y), tile_size, tile_size, fill=None, edgecolor='black'))
 
-    ax.set_xlim(0, width)
-    ax.set_ylim(0, length)
-    ax.set_aspect('equal')
+    # x runs along the length of the field and y along its width, as the tiles of the grid
+    grid_renderer = GridRenderer(ax, length, width, tile_size)
+    grid_renderer.draw()
+    if objects_data["grid"] is not None:
+        # Tiles marked without a shape patch, e.g. by a map loaded from a file
+        tiles = occupancy_image(ax, objects_data["grid"], layer_colors())
+        if tiles is not None:
+            ax.add_image(tiles)
+    shape_blitter = ShapeBlitter(ax)
     canv.draw()
 
 
@@ -134,14 +215,26 @@ def get_grid_dimensions():
 
 
 class HandFreeWindow(tk.Tk):
+    @traced()
     def __init__(self):
+        from SetUp.history import EditHistory
+        from SetUp.quadtree import make_grid
+
         super().__init__()
         get_grid_dimensions()
+        # Very large fields are stored as quadtrees
+        objects_data["grid"] = make_grid(
+            objects_data["length"], objects_data["width"], python_objects[1].dim_tassel
+        )
+        objects_data["history"] = EditHistory(objects_data["grid"])
         self.setup_map_editor()
 
     def setup_map_editor(self):
         """Setup the map editor window."""
         global ax, canv
+        from matplotlib import pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
         self.title("Map Editor")
         fig, ax = plt.subplots(figsize=(10, 10))
 
@@ -161,23 +254,36 @@ class HandFreeWindow(tk.Tk):
             ("Add Circle", add_circle),
             ("Add Square", add_square),
             ("Add Isolated Area", add_isolated_area),
+            ("Import Shapes", import_shapes),
+            ("Import Image", import_image),
+            ("Undo", undo),
+            ("Redo", redo),
             ("Back", self.click_back),
             ("Done", self.click_next),
         ]
-        for name, command in buttons[:3]:
+        for name, command in buttons[:7]:
             tk.Button(top_frame, text=name, command=command).pack(side=tk.LEFT)
-        for name, command in buttons[3:]:
+        for name, command in buttons[7:]:
             tk.Button(bottom_frame, text=name, command=command).pack(side=tk.RIGHT)
+        self.bind("<Control-z>", lambda event: undo())
+        self.bind("<Control-y>", lambda event: redo())
+
+        self.export_format = tk.StringVar(self, value="json")
+        ttk.OptionMenu(bottom_frame, self.export_format, "json", *EXPORT_FORMATS).pack(side=tk.RIGHT)
+        ttk.Label(bottom_frame, text="Export format: ").pack(side=tk.RIGHT)
 
     def click_back(self):
         """Handle the click event for the "Back" button."""
+        reset_map()
         self.destroy()
         ChooseWindow()
 
+    @traced()
     def click_next(self):
         """Handle the click event for the "Next" button."""
-        python_objects.append(objects_data)
-        produce_json(python_objects)
+        python_objects.append(objects_data["grid"])
+        produce_json(python_objects, self.export_format.get())
+        reset_map()
         self.destroy()
 
 
@@ -204,67 +310,110 @@ def get_circle_data():
 
 
 def draw_rectangle(x, y, width, height, color, label=None):
-    """Draw a rectangle on the map."""
-    ax.add_patch(plt.Rectangle((x, y), width, height, color=color, alpha=0.5, label=label))
-    plt.draw()
+    """Draw a rectangle on the map and return its patch."""
+    from matplotlib.patches import Rectangle
+
+    return shape_blitter.add(Rectangle((x, y), width, height, color=color, alpha=0.5, label=label))
+
+
+def draw_shapes(shapes):
+    """Draw many shapes as a single collection and return it."""
+    from matplotlib.collections import PatchCollection
+    from matplotlib.patches import Circle, Rectangle
+
+    from SetUp.occupancy import shape_parts
+
+    patches, colors = [], []
+    for shape in shapes:
+        for layer, kind, params in shape_parts(shape):
+            if kind == "rectangle":
+                x, y, width, height = params
+                patches.append(Rectangle((x, y), width, height))
+            else:
+                x_center, y_center, radius = params
+                patches.append(Circle((x_center, y_center), radius))
+            colors.append(LAYER_COLORS[layer])
+    collection = PatchCollection(patches, facecolors=colors, edgecolors=colors, alpha=0.5)
+    return shape_blitter.add(collection)
+
+
+def layer_colors():
+    """Return LAYER_COLORS as half transparent RGBA bytes."""
+    import numpy as np
+    from matplotlib.colors import to_rgba
+
+    return {layer: np.uint8(np.multiply(to_rgba(color, 0.5), 255)) for layer, color in LAYER_COLORS.items()}
+
+
+def draw_tiles(edit):
+    """Draw the tiles an edit turned on as a single image and return it."""
+    from SetUp.grid_renderer import occupancy_image
+    from SetUp.quadtree import QuadGrid, make_grid
+
+    grid = objects_data["grid"]
+    tiles = make_grid(grid.length, grid.width, grid.d_tassel, isinstance(grid, QuadGrid))
+    edit.apply(tiles)
+    return shape_blitter.add(occupancy_image(ax, tiles, layer_colors()))
 
 
 def draw_circle(x_center, y_center, radius, color, label=None):
-    """Draw a circle on the map."""
-    ax.add_patch(plt.Circle((x_center, y_center), radius, color=color, alpha=0.5, label=label))
-    plt.draw()
+    """Draw a circle on the map and return its patch."""
+    from matplotlib.patches import Circle
 
+    return shape_blitter.add(Circle((x_center, y_center), radius, color=color, alpha=0.5, label=label))
 
-def update_area_coordinates(x, y, width, height, d_tassel, area_type):
-    """Update the coordinates for a rectangular area."""
-    x, y = round(x / d_tassel), round(y / d_tassel)
-    end_x, end_y = x + round(width / d_tassel), y + round(height / d_tassel)
-    for i in range(x, end_x):
-        for j in range(y, end_y):
-            objects_data[area_type].append((i, j))
 
+def update_area_coordinates(x, y, width, height, area_type):
+    """Update the occupancy grid for a rectangular area."""
+    grid = objects_data["grid"]
+    conflicts = grid.shapes.conflicting(area_type, "rectangle", (x, y, width, height))
+    grid.fill_rectangle(area_type, x, y, width, height)
+    report_conflicts(conflicts)
 
-def update_area_coordinates_for_circle(x_center, y_center, radius, d_tassel, area_type):
-    """Update the coordinates for a circular area."""
-    x_center, y_center = math.floor(x_center / d_tassel), math.floor(y_center / d_tassel)
-    radius = round(radius / d_tassel)
 
-    for i in range(int(objects_data["length"] / d_tassel)):
-        for j in range(int(objects_data["width"] / d_tassel)):
-            dist = math.hypot(i - x_center, j - y_center)
-            if dist <= radius:
-                objects_data[area_type].append((i, j))
+def update_area_coordinates_for_circle(x_center, y_center, radius, area_type):
+    """Update the occupancy grid for a circular area."""
+    grid = objects_data["grid"]
+    conflicts = grid.shapes.conflicting(area_type, "circle", (x_center, y_center, radius))
+    grid.fill_circle(area_type, x_center, y_center, radius)
+    report_conflicts(conflicts)
 
 
+def report_conflicts(conflicts):
+    """Warn that the shape just added overlaps shapes it must not overlap."""
+    if not conflicts:
+        return
+    from SetUp.spatial_index import describe
 
-def from_handfree():
+    lines = "\n".join(describe(shape) for shape in conflicts)
+    messagebox.showwarning("Overlapping shapes", f"The new shape overlaps:\n{lines}")
+
+
+def confirm_estimate():
     """
-    Open the HandFreeWindow.
+    Estimate the coverage time of the configuration in python_objects and, when the
+    robot cannot cover the field in the simulated cycle, ask whether to launch anyway.
 
+    :return: The description of the estimate, or None if the user gives up.
     """
-    HandFreeWindow()
+    from SetUp.estimator import estimate, free_cells
 
+    robot, simulator, env = python_objects[:3]
+    result = estimate(robot, simulator, free_cells(env, simulator.dim_tassel))
+    description = result.describe()
+    if result.status == "infeasible" and not messagebox.askyesno(
+            "SetUpSmarters",
+            f"The robot cannot cover the field in the simulated cycle:\n{description}\n\nLaunch anyway?"):
+        return None
+    return description
 
-def run_second_program(path_smarters):
-    """
-    Run the second program using subprocess.
 
-    :param path_smarters: The path to the second program to run.
-    :type path_smarters: str
-    :raises FileNotFoundError: If the file at path_smarters does not exist or cannot be executed by python3.
+def from_handfree():
     """
-    # Check if the file exists
-    if not os.path.exists(path_smarters):
-        raise FileNotFoundError(f"The file '{path_smarters}' does not exist.")
-
-    # Make absolute path
-    abs_path = os.path.abspath(path_smarters)
+    Open the HandFreeWindow.
 
-    try:
-        # Attempt to execute the file with 'python3' interpreter
-        subprocess.run([sys.executable, abs_path], check=True)
-    except Exception as e:
-        raise FileNotFoundError(f"The file '{abs_path}' could not be executed by python3: \n{str(e)}") from None
+    """
+    HandFreeWindow()
 
 
 class ChooseWindow(Tk):
@@ -272,6 +421,7 @@ class ChooseWindow(Tk):
     Main window for choosing how to create the environment.
     """
 
+    @traced()
     def __init__(self):
         """
         Initialize the ChooseWindow.
@@ -315,6 +465,7 @@ class ChooseWindow(Tk):
         back_button = Button(self, text="Back", command=self.click_back)
         back_button.place(x=80, y=200)
 
+    @traced()
     def click_entry(self):
         """
         Handle the click event for the "By entries" button.
@@ -325,8 +476,11 @@ class ChooseWindow(Tk):
         """
         Handle the click event for the "Back" button.
         """
+        # SimulatorWindow appends the simulator configuration again
+        del python_objects[1:]
         self.clear_and_destroy(SimulatorWindow)
 
+    @traced()
     def click_handfree(self):
         """
         Handle the click event for the "By drawings" button.
@@ -351,6 +505,7 @@ class RobotWindow(Tk):
     Window for configuring robot features.
     """
 
+    @traced()
     def __init__(self):
         """
         Initialize the RobotWindow.
@@ -393,7 +548,7 @@ class RobotWindow(Tk):
         ttk.Label(frame, text="Robot type: ").grid(
             column=0, row=2, sticky="W", **options
         )
-        OptionList = ["", "450X", "430X", "405X", "415X"]
+        OptionList = [""] + get_catalog().ids()
         self.robot_type = tk.StringVar()
         self.robot_type.set(OptionList[0])
         robot_entry = tk.OptionMenu(frame, self.robot_type, *OptionList)
@@ -492,6 +647,7 @@ class RobotWindow(Tk):
         if selected_option in self.OptionCuttingList:
             self.cutting_mode.set(selected_option)
 
+    @traced()
     def click_next(self):
         """
         Handle the click event for the "Next" button.
@@ -524,21 +680,7 @@ class RobotWindow(Tk):
                 algo=algo,
             )
         else:
-            with open(resource_path("robots.json"), "r") as robots_file:
-                robots = json.load(robots_file)
-
-            robot_index = {"450X": 0, "430X": 1}.get(robot_type, 2)
-            robot_info = robots["robots"]["robot"][robot_index]
-
-            robot = RobotConfig(
-                type=robot_type,
-                cutting_mode=cutting_mo,
-                speed=float(robot_info["speed"]),
-                cutting_diameter=float(robot_info["cut diameter"]),
-                autonomy=int(robot_info["autonomy"]),
-                guide_lines=2,
-                algo=algo,
-            )
+            robot = get_catalog().robot_config(robot_type, cutting_mode=cutting_mo, algo=algo)
 
         python_objects.append(robot)
 
@@ -553,6 +695,7 @@ class EnvironmentWindow(Tk):
     Window for configuring environment features.
     """
 
+    @traced()
     def __init__(self):
         """
         Initialize the EnvironmentWindow.
@@ -561,6 +704,7 @@ class EnvironmentWindow(Tk):
 
         # Set window title
         self.absolute_path = None
+        self.imported_shapes = None
         self.title("SetUpSmarters")
 
         window_width = 1200
@@ -671,16 +815,45 @@ class EnvironmentWindow(Tk):
 
     def button_click(self):
         """
-        Open a file dialog to select a JSON file for extra data.
+        Open a file dialog to select a CSV, JSON or GeoJSON file of shapes, and check it.
+
+        When a file is loaded, its shapes make up the map instead of random obstacles.
 
         :param self: The instance of the EnvironmentWindow class.
         """
+        from SetUp.shape_import import load_shapes
+
         self.absolute_path = None
-        file_path = filedialog.askopenfilename(filetypes=[("JSON Files", "*.json")])
-        if file_path:
-            self.absolute_path = os.path.abspath(file_path)
-            print("File selected:", self.absolute_path)
-            self.button.config(text=os.path.basename(self.absolute_path))
+        self.imported_shapes = None
+        self.button.config(text="Open")
+        file_path = filedialog.askopenfilename(filetypes=SHAPE_FILE_TYPES)
+        if not file_path:
+            return
+        try:
+            self.imported_shapes = load_shapes(file_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("SetUpSmarters", f"Could not load the shapes:\n{e}")
+            return
+        self.absolute_path = os.path.abspath(file_path)
+        self.button.config(text=f"{os.path.basename(self.absolute_path)} ({len(self.imported_shapes)} shapes)")
+
+    def imported_map(self, length, width):
+        """
+        Rasterize the loaded shapes on a ``length`` x ``width`` field.
+
+        :return: The OccupancyGrid, or None if the shapes do not fit on the field.
+        """
+        from SetUp.occupancy import OccupancyGrid
+        from SetUp.shape_import import validate_shapes
+
+        try:
+            shapes = validate_shapes(self.imported_shapes, length, width)
+        except ValueError as e:
+            messagebox.showerror("SetUpSmarters", f"Could not place the shapes:\n{e}")
+            return None
+        grid = OccupancyGrid(length, width, python_objects[1].dim_tassel)
+        grid.add_shapes(shapes)
+        return grid
 
     def click_back(self):
         """
@@ -691,6 +864,7 @@ class EnvironmentWindow(Tk):
         self.destroy()
         ChooseWindow()
 
+    @traced()
     def click_next(self):
         """
         Handle the click event for the "Done" button.
@@ -698,6 +872,22 @@ class EnvironmentWindow(Tk):
 
         :param self: The instance of the EnvironmentWindow class.
         """
+        if self.imported_shapes is not None:
+            # The loaded shapes make up the map
+            grid = self.imported_map(float(self.length.get()), float(self.width.get()))
+            if grid is None:
+                return
+            python_objects.append(grid)
+            estimate = confirm_estimate()
+            if estimate is None:
+                python_objects.pop()
+                return
+            run_dir = prepare_run_dir()
+            produce_json(python_objects, path=os.path.join(run_dir, DATA_FILES["json"]))
+            self.destroy()
+            RunWindow("../smarters/main.py", estimate, run_dir)
+            return
+
         environment = EnvConfig(
             length=float(self.length.get()),
             width=float(self.width.get()),
@@ -718,10 +908,157 @@ class EnvironmentWindow(Tk):
             isolated_area_shape=self.shape.get(),
         )
         python_objects.append(environment)
+        estimate = confirm_estimate()
+        if estimate is None:
+            python_objects.pop()
+            return
+
+        run_dir = prepare_run_dir()
+        produce_json(python_objects, path=os.path.join(run_dir, DATA_FILES["json"]))
+        if python_objects[1].num_maps > 0:
+            from SetUp.mapgen import MAPS_FILE, generate_bundle
+
+            try:
+                generate_bundle(
+                    python_objects[0], python_objects[1], environment, os.path.join(run_dir, MAPS_FILE),
+                )
+            except ValueError as e:
+                python_objects.pop()
+                messagebox.showerror("SetUpSmarters", f"Could not generate the maps:\n{e}")
+                return
 
-        produce_json(python_objects)
-        run_second_program("../smarters/main.py")
+        self.destroy()
+        RunWindow("../smarters/main.py", estimate, run_dir)
+
+
+def prepare_run_dir():
+    """
+    Return the directory of the next wizard run, emptied of what an earlier run left
+    there if the setup tool created it.
+    """
+    from SetUp.result_store import is_run_dir, make_run_dir
+
+    run_dir = os.path.abspath(RUN_DIR)
+    if is_run_dir(run_dir):
+        shutil.rmtree(run_dir)
+    return make_run_dir(run_dir)
 
+
+class RunWindow(Tk):
+    """
+    Window following a simulator run without blocking the interface.
+    """
+
+    # Milliseconds between two refreshes of the log and status
+    POLL_INTERVAL = 200
+    # Milliseconds given to the simulator to stop before it is killed
+    KILL_DELAY = 5000
+
+    def __init__(self, path_smarters, estimate=None, cwd=None):
+        """
+        Initialize the RunWindow and start the simulator.
+
+        :param path_smarters: The path to the second program to run.
+        :param estimate: Description of the estimated coverage time, shown first in the log.
+        :param cwd: Working directory of the run, where it finds its ``data_file``.
+        """
+        super().__init__()
+
+        self.title("SetUpSmarters - Simulation")
+        window_width = 800
+        window_height = 600
+
+        # Get the screen dimensions and calculate center position
+        screen_width, screen_height = (
+            self.winfo_screenwidth(),
+            self.winfo_screenheight(),
+        )
+        center_x, center_y = (
+            screen_width // 2 - window_width // 2,
+            screen_height // 2 - window_height // 2,
+        )
+        self.geometry(f"{window_width}x{window_height}+{center_x}+{center_y}")
+
+        # Status line with elapsed time and resource usage
+        self.status = tk.StringVar(self, value="Starting...")
+        ttk.Label(self, textvariable=self.status, font=("Arial", 12)).pack(
+            side=tk.TOP, fill=tk.X, padx=8, pady=8
+        )
+
+        # Log pane, stderr lines are shown in red
+        self.log = scrolledtext.ScrolledText(self, state="disabled", wrap="none")
+        self.log.tag_config("stderr", foreground="red")
+        self.log.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=8)
+        if estimate:
+            self.append_log("stdout", f"{estimate}\n")
+
+        self.cancel_button = Button(self, text="Cancel", command=self.click_cancel)
+        self.cancel_button.pack(side=tk.RIGHT, padx=8, pady=8)
+
+        self.protocol("WM_DELETE_WINDOW", self.click_close)
+
+        self.simulator = SimulatorProcess(path_smarters, cwd)
+        try:
+            self.simulator.start()
+        except FileNotFoundError as e:
+            self.append_log("stderr", f"{e}\n")
+            self.finish("Could not start the simulator.")
+            return
+        self.after(self.POLL_INTERVAL, self.refresh)
+
+    def append_log(self, stream, text):
+        """Append text to the log pane and keep the end in view."""
+        self.log.configure(state="normal")
+        self.log.insert(tk.END, text, stream)
+        self.log.configure(state="disabled")
+        self.log.see(tk.END)
+
+    def refresh(self):
+        """Move new output to the log pane and update the status line."""
+        for stream, line in self.simulator.read_lines():
+            self.append_log(stream, line)
+
+        returncode = self.simulator.poll()
+        status = f"Elapsed: {self.simulator.elapsed:.0f} s"
+        if self.simulator.usage:
+            status += (
+                f"  CPU: {self.simulator.usage['cpu_seconds']:.1f} s"
+                f"  Memory: {self.simulator.usage['rss_mb']:.0f} MB"
+            )
+
+        if returncode is None:
+            self.status.set(f"Running...  {status}")
+            self.after(self.POLL_INTERVAL, self.refresh)
+        else:
+            for stream, line in self.simulator.read_lines():
+                self.append_log(stream, line)
+            if self.simulator.cancelled:
+                outcome = "Cancelled"
+            elif self.simulator.restored:
+                outcome = "Restored from an earlier run of the same configuration"
+            elif returncode == 0:
+                outcome = "Finished"
+            else:
+                outcome = f"Failed with exit code {returncode}"
+            self.finish(f"{outcome}.  {status}")
+
+    def finish(self, message):
+        """Show the final status and turn Cancel into Close."""
+        self.status.set(message)
+        self.cancel_button.config(text="Close", command=self.destroy, state="normal")
+
+    def click_cancel(self):
+        """Handle the click event for the "Cancel" button."""
+        self.status.set("Cancelling...")
+        self.cancel_button.config(state="disabled")
+        self.simulator.terminate()
+        # Kill the simulator if it ignores the request
+        self.after(self.KILL_DELAY, self.simulator.kill)
+
+    def click_close(self):
+        """Stop the simulator when the window is closed."""
+        if self.simulator.running:
+            self.simulator.cancel()
         self.destroy()
 
 
@@ -730,6 +1067,7 @@ class SimulatorWindow(Tk):
     Main window for the simulator application.
     """
 
+    @traced()
     def __init__(self):
         """
         Initialize the SimulatorWindow.
@@ -802,9 +1140,12 @@ class SimulatorWindow(Tk):
 
         :param self: The instance of the SimulatorWindow class.
         """
+        # RobotWindow appends the robot configuration again
+        python_objects.clear()
         self.destroy()
         RobotWindow()
 
+    @traced()
     def click_next(self):
         """
         Handle the click event for the "Next" button.
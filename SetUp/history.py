@@ -0,0 +1,156 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+# Limits of the undo history; the oldest edits are forgotten first
+MAX_EDITS = 10000
+MAX_BYTES = 64 * 2 ** 20
+
+
+class Edit:
+    """
+    One editing action on an OccupancyGrid or a QuadGrid, as the tiles and shapes it added.
+
+    Each delta keeps only the tiles the action turned on, bit-packed, inside the block
+    of the shape that set them, so undoing or redoing it costs time proportional to the
+    shape's footprint; a block turned on entirely is kept as its bounds alone.
+    ``artists`` holds whatever the editor drew for the action.
+    """
+
+    def __init__(self, label):
+        """
+        Initialize the Edit.
+
+        :param label: Description of the action, e.g. ``"Add square"``.
+        """
+        self.label = label
+        self.deltas = []
+        self.shapes = []
+        self.artists = []
+
+    def add_cells(self, layer, start_i, start_j, changed):
+        """
+        Record the tiles turned on in a block of ``layer``.
+
+        :param start_i: First row of the block.
+        :param start_j: First column of the block.
+        :param changed: Boolean array of the block, True where a tile was turned on.
+        """
+        if changed.any():
+            self.deltas.append((layer, start_i, start_j, changed.shape, np.packbits(changed, axis=None)))
+
+    def add_block(self, layer, start_i, end_i, start_j, end_j):
+        """Record that every tile of an index range of ``layer`` was turned on."""
+        if end_i > start_i and end_j > start_j:
+            self.deltas.append((layer, start_i, start_j, (end_i - start_i, end_j - start_j), None))
+
+    @property
+    def nbytes(self):
+        return sum(packed.nbytes for *_, packed in self.deltas if packed is not None)
+
+    def _write(self, grid, value):
+        for layer, start_i, start_j, (rows, cols), packed in self.deltas:
+            if packed is None:
+                grid.write_block(layer, start_i, start_i + rows, start_j, start_j + cols, value)
+            else:
+                mask = np.unpackbits(packed, count=rows * cols).reshape(rows, cols).view(bool)
+                grid.write_mask(layer, start_i, start_j, mask, value)
+
+    def revert(self, grid):
+        """Turn the recorded tiles off again and take the shapes out of the grid's index."""
+        self._write(grid, False)
+        for shape in reversed(self.shapes):
+            grid.shapes.remove(shape)
+
+    def apply(self, grid):
+        """Turn the recorded tiles back on and put the shapes back in the grid's index."""
+        self._write(grid, True)
+        for shape in self.shapes:
+            grid.shapes.add(shape)
+
+
+class EditHistory:
+    """
+    Undo and redo stacks of the edits made to an OccupancyGrid or a QuadGrid.
+
+    The undo stack holds at most ``max_edits`` edits and ``max_bytes`` of deltas.
+    """
+
+    def __init__(self, grid, max_edits=MAX_EDITS, max_bytes=MAX_BYTES):
+        """
+        Initialize the EditHistory.
+
+        :param grid: The OccupancyGrid or QuadGrid being edited.
+        """
+        self.grid = grid
+        self.max_edits = max_edits
+        self.max_bytes = max_bytes
+        self._done = deque()
+        self._undone = []
+        self._bytes = 0
+
+    @contextmanager
+    def record(self, label):
+        """
+        Record the tiles and shapes added to the grid inside the ``with`` block as one edit.
+
+        If the block raises, whatever it added is removed again and nothing is recorded.
+        """
+        edit = Edit(label)
+        self.grid.journal = edit
+        try:
+            yield edit
+        except BaseException:
+            edit.revert(self.grid)
+            raise
+        finally:
+            self.grid.journal = None
+        self._undone.clear()
+        self._push(edit)
+
+    def _push(self, edit):
+        """Put an edit on the undo stack, forgetting the oldest ones beyond the limits."""
+        self._done.append(edit)
+        self._bytes += edit.nbytes
+        while len(self._done) > self.max_edits or (self._bytes > self.max_bytes and len(self._done) > 1):
+            self._bytes -= self._done.popleft().nbytes
+
+    def can_undo(self):
+        return bool(self._done)
+
+    def can_redo(self):
+        return bool(self._undone)
+
+    def undo(self):
+        """Revert the last edit; return it, or None if there is nothing to undo."""
+        if not self._done:
+            return None
+        edit = self._done.pop()
+        self._bytes -= edit.nbytes
+        edit.revert(self.grid)
+        self._undone.append(edit)
+        return edit
+
+    def redo(self):
+        """Apply the last undone edit again; return it, or None if there is nothing to redo."""
+        if not self._undone:
+            return None
+        edit = self._undone.pop()
+        edit.apply(self.grid)
+        self._push(edit)
+        return edit
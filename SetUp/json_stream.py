@@ -0,0 +1,97 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import json
+
+from SetUp.data_classes import ConfigEncoder
+from SetUp.occupancy import OccupancyGrid
+from SetUp.quadtree import QuadGrid
+
+INDENT = "  "
+# Number of cells formatted and written at once
+CHUNK_SIZE = 65536
+
+
+def dump_value(value, level, compact):
+    """Encode a small value, indented as if nested ``level`` deep in the document."""
+    if compact:
+        return json.dumps(value, cls=ConfigEncoder, separators=(",", ":"))
+    encoded = json.dumps(value, cls=ConfigEncoder, indent=len(INDENT))
+    return encoded.replace("\n", "\n" + INDENT * level)
+
+
+def format_cells(cells, compact):
+    """Format a chunk of ``(i, j)`` cells as the items of a JSON array."""
+    if compact:
+        return ",".join(map(str, cells.ravel().tolist()))
+    cell = "[\n" + INDENT * 4 + "%d,\n" + INDENT * 4 + "%d\n" + INDENT * 3 + "]"
+    separator = ",\n" + INDENT * 3
+    return separator.join(cell % (i, j) for i, j in cells.tolist())
+
+
+def write_cells(fp, chunks, compact):
+    """Write a JSON array of cells from an iterable of non-empty ``(n, 2)`` chunks."""
+    opening = "" if compact else "\n" + INDENT * 3
+    separator = "," if compact else ",\n" + INDENT * 3
+    fp.write("[")
+    written = False
+    for chunk in chunks:
+        fp.write(separator if written else opening)
+        fp.write(format_cells(chunk, compact))
+        written = True
+    if written and not compact:
+        fp.write("\n" + INDENT * 2)
+    fp.write("]")
+
+
+def write_grid(fp, grid, compact, chunk_size):
+    """Write an OccupancyGrid or a QuadGrid as the ``env`` object, streaming each layer."""
+    newline = "" if compact else "\n" + INDENT * 2
+    separator = ":" if compact else ": "
+    fp.write("{")
+    items = [("length", grid.length), ("width", grid.width)]
+    for index, (key, value) in enumerate(items):
+        fp.write(("," if index else "") + newline + json.dumps(key) + separator)
+        fp.write(dump_value(value, 2, compact))
+    for name in grid.layers:
+        fp.write("," + newline + json.dumps(name) + separator)
+        write_cells(fp, grid.iter_cells(name, chunk_size), compact)
+    fp.write(("" if compact else "\n" + INDENT) + "}")
+
+
+def write_config(fp, data_config, compact=False, chunk_size=CHUNK_SIZE):
+    """
+    Stream a configuration to ``fp`` as JSON.
+
+    Robot and simulator sections are small and encoded directly; occupancy layers are
+    formatted chunk by chunk, so memory use does not grow with the field size. The
+    default layout is byte-for-byte what ``json.dump(..., indent=2)`` produces.
+
+    :param fp: Text file open for writing.
+    :param data_config: Dict with the ``robot``, ``env`` and ``simulator`` sections. The
+        environment may be an OccupancyGrid or a QuadGrid.
+    :param compact: Write without whitespace and with each layer flattened to
+        ``[i0, j0, i1, j1, ...]``.
+    :param chunk_size: Approximate number of cells formatted per write.
+    """
+    newline = "" if compact else "\n" + INDENT
+    separator = ":" if compact else ": "
+    fp.write("{")
+    for index, (key, value) in enumerate(data_config.items()):
+        fp.write(("," if index else "") + newline + json.dumps(key) + separator)
+        if isinstance(value, (OccupancyGrid, QuadGrid)):
+            write_grid(fp, value, compact, chunk_size)
+        else:
+            fp.write(dump_value(value, 1, compact))
+    fp.write(("" if compact else "\n") + "}")
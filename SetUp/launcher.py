@@ -0,0 +1,322 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import os
+import queue
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from SetUp.tracing import span, traced
+
+
+def available_cores():
+    """Return the number of CPU cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+@traced()
+def run_second_program(path_smarters, cwd=None, stdout=None, stderr=None, timeout=None):
+    """
+    Run the second program using subprocess.
+
+    :param path_smarters: The path to the second program to run.
+    :type path_smarters: str
+    :param cwd: Working directory of the run, where it finds its ``data_file``.
+    :param stdout: File receiving the standard output, inherited by default.
+    :param stderr: File receiving the standard error, inherited by default.
+    :param timeout: Seconds after which the run is killed, no limit by default.
+    :raises FileNotFoundError: If the file at path_smarters does not exist or cannot be executed by python3.
+    :raises ValueError: If the worker pool settings are invalid, see ``SetUp.worker_pool``.
+
+    In a run directory created by the setup tool, a configuration already run with the
+    same simulator is not run again: the files and output of the earlier run are restored
+    from the result store, see ``SetUp.result_store``.
+    """
+    # Imported here, the store and the pool (when $SETUP_WORKER_POOL enables it) only serve runs
+    from SetUp.result_store import default_store, replay_output
+    from SetUp.worker_pool import get_pool
+
+    # Check if the file exists
+    if not os.path.exists(path_smarters):
+        raise FileNotFoundError(f"The file '{path_smarters}' does not exist.")
+
+    # Make absolute path
+    abs_path = os.path.abspath(path_smarters)
+    run_dir = os.path.abspath(cwd or os.getcwd())
+
+    # Outside the try below: a configuration error is not a failure of the simulator
+    pool = get_pool()
+    store = default_store()
+    with span("result_store.restore") as trace:
+        result = store.restore(abs_path, run_dir)
+        if trace.active:
+            trace.count("result_hits", int(result is not None))
+    if result is not None:
+        output, errors = result
+        replay_output(output, stdout)
+        replay_output(errors, stdout if stderr == subprocess.STDOUT else stderr, sys.stderr)
+        return
+    # An inherited standard output is passed on through a pipe, to store it as well
+    tee = None
+    recording = store.record(abs_path, run_dir, subprocess.PIPE if stdout is None else stdout)
+    if recording is not None and stdout is None:
+        try:
+            tee = OutputTee(sys.stdout)
+        except (AttributeError, OSError, ValueError):
+            recording = None
+        else:
+            stdout = tee.fd
+
+    try:
+        if pool is not None:
+            # Run in a warm interpreter of the worker pool
+            returncode = pool.run(abs_path, cwd, stdout, stderr, timeout)
+            if returncode:
+                raise subprocess.CalledProcessError(returncode, [sys.executable, abs_path])
+        else:
+            # Attempt to execute the file with 'python3' interpreter
+            subprocess.run(
+                [sys.executable, abs_path], check=True, cwd=cwd,
+                stdout=stdout, stderr=stderr, timeout=timeout,
+            )
+    except Exception as e:
+        raise FileNotFoundError(f"The file '{abs_path}' could not be executed by python3: \n{str(e)}") from None
+    finally:
+        output = tee.close() if tee is not None else None
+    if recording is not None:
+        with span("result_store.record"):
+            recording.finish(output)
+
+
+class OutputTee:
+    """
+    Pipe standing in for one of this process's output streams: what a run writes to it
+    is passed on to the stream and kept.
+    """
+
+    def __init__(self, stream):
+        """
+        Initialize the OutputTee.
+
+        :param stream: The stream to pass the output on to, with a file descriptor.
+        :raises OSError: If the stream has no file descriptor.
+        """
+        stream.flush()
+        self._target = stream.fileno()
+        self._chunks = []
+        read_fd, self.fd = os.pipe()
+        self._reader = threading.Thread(target=self._copy, args=(read_fd,), daemon=True)
+        self._reader.start()
+
+    def _copy(self, read_fd):
+        for chunk in iter(lambda: os.read(read_fd, 2 ** 16), b""):
+            self._chunks.append(chunk)
+            os.write(self._target, chunk)
+        os.close(read_fd)
+
+    def close(self):
+        """Close the pipe once the run is over, and return everything written to it."""
+        os.close(self.fd)
+        self._reader.join()
+        return b"".join(self._chunks)
+
+
+def process_usage(pid):
+    """
+    Read the CPU time and resident memory of a running process from ``/proc``.
+
+    :return: ``{"cpu_seconds": float, "rss_mb": float}``, or None where ``/proc`` is not
+        available or the process is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat", "r") as stat_file:
+            # Fields after the command name, which may itself contain spaces
+            stat = stat_file.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/statm", "r") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu_seconds = (int(stat[11]) + int(stat[12])) / ticks
+    rss_mb = resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    return {"cpu_seconds": cpu_seconds, "rss_mb": rss_mb}
+
+
+class SimulatorProcess:
+    """
+    Run the second program in the background and stream its output.
+
+    The child runs in its own process group, so cancelling it also stops any process it
+    started. Output lines are collected by reader threads and handed out by
+    ``read_lines``, which never blocks, so the caller can poll from a Tk ``after`` loop.
+
+    In a run directory created by the setup tool, a configuration already run with the
+    same simulator is not started: ``start`` restores the files and output of the earlier
+    run from the result store, and ``restored`` is set. A run that succeeds is stored in
+    turn.
+    """
+
+    def __init__(self, path_smarters, cwd=None):
+        """
+        Initialize the SimulatorProcess.
+
+        :param path_smarters: The path to the second program to run.
+        :param cwd: Working directory of the run, where it finds its ``data_file``.
+        """
+        self.path_smarters = path_smarters
+        self.cwd = cwd
+        self.process = None
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.restored = False
+        self.returncode = None
+        self.usage = None
+        self._lines = queue.Queue()
+        self._readers = []
+        self._trace = None
+        self._recording = None
+        self._output = {"stdout": [], "stderr": []}
+
+    def start(self):
+        """
+        Start the program.
+
+        :raises FileNotFoundError: If the file at path_smarters does not exist or cannot be executed.
+        """
+        from SetUp.result_store import default_store
+
+        if not os.path.exists(self.path_smarters):
+            raise FileNotFoundError(f"The file '{self.path_smarters}' does not exist.")
+        abs_path = os.path.abspath(self.path_smarters)
+        run_dir = os.path.abspath(self.cwd or os.getcwd())
+        store = default_store()
+        with span("result_store.restore") as trace:
+            result = store.restore(abs_path, run_dir)
+            if trace.active:
+                trace.count("result_hits", int(result is not None))
+        if result is not None:
+            for name, output in zip(("stdout", "stderr"), result):
+                for line in output.decode("utf-8", errors="replace").splitlines(keepends=True):
+                    self._lines.put((name, line))
+            self.restored = True
+            self.returncode = 0
+            self.started_at = self.finished_at = time.monotonic()
+            return
+        self._recording = store.record(abs_path, run_dir, subprocess.PIPE)
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, "-u", abs_path], cwd=self.cwd,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                text=True, bufsize=1, start_new_session=os.name == "posix",
+            )
+        except OSError as e:
+            raise FileNotFoundError(f"The file '{abs_path}' could not be executed by python3: \n{str(e)}") from None
+        self.started_at = time.monotonic()
+        # Spans the whole run; it ends when poll first sees the exit code
+        self._trace = span("SimulatorProcess", path=abs_path).__enter__()
+        for name, stream in (("stdout", self.process.stdout), ("stderr", self.process.stderr)):
+            reader = threading.Thread(target=self._read, args=(name, stream), daemon=True)
+            reader.start()
+            self._readers.append(reader)
+
+    def _read(self, name, stream):
+        for line in iter(stream.readline, ""):
+            self._lines.put((name, line))
+            if self._recording is not None:
+                self._output[name].append(line)
+        stream.close()
+
+    def read_lines(self):
+        """Return the ``(stream, line)`` pairs received since the last call."""
+        lines = []
+        while True:
+            try:
+                lines.append(self._lines.get_nowait())
+            except queue.Empty:
+                return lines
+
+    def poll(self):
+        """Return the exit code, or None while the program is running."""
+        if self.process is None:
+            return self.returncode
+        returncode = self.process.poll()
+        if returncode is None:
+            self.usage = process_usage(self.process.pid) or self.usage
+        elif self.finished_at is None:
+            self.finished_at = time.monotonic()
+            self.returncode = returncode
+            for reader in self._readers:
+                reader.join(timeout=1)
+            if self._trace.active:
+                self._trace.args["returncode"] = returncode
+            self._trace.__exit__(None, None, None)
+            if returncode == 0 and not self.cancelled and self._recording is not None:
+                with span("result_store.record"):
+                    self._recording.finish(
+                        "".join(self._output["stdout"]).encode("utf-8"),
+                        "".join(self._output["stderr"]).encode("utf-8"),
+                    )
+        return returncode
+
+    @property
+    def running(self):
+        return self.process is not None and self.poll() is None
+
+    @property
+    def elapsed(self):
+        """Seconds since the program started, frozen once it exits."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def terminate(self):
+        """Ask the program to stop, without waiting for it."""
+        if self.running:
+            self.cancelled = True
+            self._signal(signal.SIGTERM)
+
+    def kill(self):
+        """Force the program to stop if it is still running."""
+        if self.running:
+            self.cancelled = True
+            self._signal(signal.SIGKILL if hasattr(signal, "SIGKILL") else signal.SIGTERM)
+
+    def cancel(self, timeout=5):
+        """
+        Stop the program: ask it to terminate, then kill it after ``timeout`` seconds.
+        """
+        if not self.running:
+            return
+        self.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.kill()
+            self.process.wait()
+        self.poll()
+
+    def _signal(self, signum):
+        if os.name == "posix":
+            try:
+                os.killpg(self.process.pid, signum)
+            except ProcessLookupError:
+                pass
+        else:
+            self.process.send_signal(signum)
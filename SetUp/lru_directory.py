@@ -0,0 +1,223 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Size-bounded directory of entry files, shared by the map cache and the result store.
+
+Entries are written through a temporary file, so readers never see a partial one, and
+are evicted least recently used first, by modification time, once the directory grows
+past its limit. Hit and miss totals of every process using the directory are kept in
+``stats.json``, updated under a file lock where ``fcntl`` is available.
+"""
+
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the statistics are still replaced atomically, but concurrent updates may be lost
+    fcntl = None
+
+STATS_FILE = "stats.json"
+LOCK_FILE = "stats.lock"
+
+
+class LRUDirectory:
+    """
+    On-disk LRU store of the files ending with ``suffix`` under a directory.
+    """
+    suffix = ""
+
+    def __init__(self, directory, max_bytes, enabled=True):
+        """
+        Initialize the LRUDirectory.
+
+        :param directory: Where the entries are stored.
+        :param max_bytes: Size above which the least recently used entries are evicted.
+        :param enabled: When False, every lookup misses and nothing is stored.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        # Bytes stored, counted on the first insert and kept up to date by this instance
+        self._size = None
+
+    def write_entry(self, path, write):
+        """
+        Store an entry, then evict old entries if the directory is over its limit.
+
+        :param path: Path of the entry, under the directory.
+        :param write: Function writing the entry to the binary file it is given.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as entry_file:
+                write(entry_file)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.grow(os.path.getsize(path) - replaced)
+
+    def grow(self, added):
+        """
+        Count ``added`` bytes stored, and evict old entries once the directory is over
+        its limit; it is only walked then and on the first insert.
+        """
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self.entries())
+        else:
+            self._size += added
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """Return ``(mtime, size, path)`` of every entry, least recently used first."""
+        found = []
+        if not os.path.isdir(self.directory):
+            return found
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    found.append((stat.st_mtime, stat.st_size, path))
+        return sorted(found)
+
+    def evict(self):
+        """Remove the least recently used entries until the directory fits its limit."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+        self._size = total
+
+    def remove(self, paths):
+        """Remove some entries."""
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        self._size = None
+
+    def clear(self):
+        """Remove every entry and reset the statistics."""
+        self.remove([path for _, _, path in self.entries()])
+        stats_path = os.path.join(self.directory, STATS_FILE)
+        if os.path.exists(stats_path):
+            os.unlink(stats_path)
+        self.hits = self.misses = 0
+
+    @contextmanager
+    def stats_lock(self):
+        """Hold the lock serializing the updates of the statistics file between processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_FILE), "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def count(self, hit):
+        """Count a lookup, in this instance and in the totals kept in the directory."""
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if not self.enabled:
+            return
+        try:
+            with self.stats_lock():
+                totals = self.totals()
+                totals["hits" if hit else "misses"] += 1
+                # Replaced whole, so that readers never see a truncated file
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "w") as stats_file:
+                        json.dump(totals, stats_file)
+                    os.replace(tmp_path, os.path.join(self.directory, STATS_FILE))
+                except BaseException:
+                    os.unlink(tmp_path)
+                    raise
+        except OSError:
+            pass
+
+    def totals(self):
+        """Return the hits and misses recorded by every process using this directory."""
+        try:
+            with open(os.path.join(self.directory, STATS_FILE), "r") as stats_file:
+                totals = json.load(stats_file)
+        except (OSError, ValueError):
+            totals = {}
+        return {"hits": int(totals.get("hits", 0)), "misses": int(totals.get("misses", 0))}
+
+    def stats(self):
+        """
+        Return the statistics.
+
+        :return: Dict with this instance's ``hits`` and ``misses``, the ``total_hits``
+            and ``total_misses`` of every process, and the ``entries`` and ``bytes`` stored.
+        """
+        entries = self.entries()
+        totals = self.totals()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals["hits"],
+            "total_misses": totals["misses"],
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+def env_settings(directory_var, size_var, default_directory, default_mb):
+    """
+    Return the ``(directory, max_bytes, enabled)`` configured by the environment.
+
+    :param directory_var: Variable giving the directory, or ``off`` to disable it.
+    :param size_var: Variable giving the limit, in megabytes.
+    """
+    directory = os.environ.get(directory_var, default_directory)
+    max_mb = float(os.environ.get(size_var, default_mb))
+    enabled = directory.lower() not in ("off", "0", "")
+    return directory, int(max_mb * 2 ** 20), enabled
+
+
+def main(store, argv, usage):
+    """Run the ``stats`` or ``clear`` command of a module's command line on ``store``."""
+    if argv == ["stats"]:
+        print(json.dumps(dict(store.stats(), directory=store.directory), indent=2))
+    elif argv == ["clear"]:
+        store.clear()
+    else:
+        print(f"usage: {usage}", file=sys.stderr)
+        return 2
+    return 0
@@ -0,0 +1,130 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Content-addressed on-disk cache of rasterized maps.
+
+Entries are keyed by a hash of everything the map depends on (field size, tile size,
+shapes or ranges and seed), hold the bit-packed layers of the map, and are evicted least
+recently used first once the cache grows past its size limit. The cache lives in
+``$SETUP_MAP_CACHE`` (``~/.cache/setupsmarters/maps`` by default, ``off`` disables it)
+and its limit is ``$SETUP_MAP_CACHE_MB`` megabytes.
+
+Run ``python -m SetUp.map_cache stats`` or ``python -m SetUp.map_cache clear``.
+"""
+
+import hashlib
+import json
+import os
+import sys
+
+from SetUp.data_classes import ConfigEncoder
+from SetUp.lru_directory import LRUDirectory, env_settings, main as lru_main
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "setupsmarters", "maps")
+DEFAULT_MAX_MB = 512
+META_KEY = "meta"
+LAYER_PREFIX = "layer/"
+
+
+def cache_key(kind, **inputs):
+    """
+    Return the stable hash identifying a map.
+
+    :param kind: What produced the map, e.g. ``"drawn_map"`` or ``"random_map"``.
+    :param inputs: Everything the map depends on; dataclasses are hashed by their fields.
+    """
+    canonical = json.dumps(
+        {"kind": kind, **inputs}, cls=ConfigEncoder, sort_keys=True, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class MapCache(LRUDirectory):
+    """
+    On-disk LRU cache of bit-packed map layers.
+    """
+    suffix = ".npz"
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_MB * 2 ** 20, enabled=True):
+        """
+        Initialize the MapCache.
+
+        :param directory: Where the entries are stored.
+        :param max_bytes: Size above which the least recently used entries are evicted.
+        :param enabled: When False, every lookup misses and nothing is stored.
+        """
+        super().__init__(directory, max_bytes, enabled)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def get(self, key):
+        """
+        Look up a map.
+
+        :return: ``(layers, meta)`` with the packed layers and the metadata stored with
+            them, or None on a miss.
+        """
+        import numpy as np
+
+        path = self.entry_path(key)
+        entry = None
+        if self.enabled:
+            try:
+                with np.load(path) as archive:
+                    meta = json.loads(archive[META_KEY].tobytes().decode("utf-8"))
+                    layers = {
+                        name[len(LAYER_PREFIX):]: archive[name]
+                        for name in archive.files if name.startswith(LAYER_PREFIX)
+                    }
+                entry = layers, meta
+                # Mark the entry as recently used
+                os.utime(path)
+            except (OSError, ValueError, KeyError):
+                entry = None
+        self.count(entry is not None)
+        return entry
+
+    def put(self, key, layers, meta):
+        """
+        Store a map, then evict old entries if the cache is over its limit.
+
+        :param layers: Dict of packed layers, as returned by ``OccupancyGrid.packed``.
+        :param meta: JSON-serializable metadata returned with the layers.
+        """
+        if not self.enabled:
+            return
+        import numpy as np
+
+        arrays = {LAYER_PREFIX + name: packed for name, packed in layers.items()}
+        encoded = json.dumps(meta, cls=ConfigEncoder).encode("utf-8")
+        arrays[META_KEY] = np.frombuffer(encoded, dtype=np.uint8)
+        self.write_entry(self.entry_path(key), lambda entry_file: np.savez_compressed(entry_file, **arrays))
+
+
+def default_cache():
+    """Return the cache configured by ``$SETUP_MAP_CACHE`` and ``$SETUP_MAP_CACHE_MB``."""
+    directory, max_bytes, enabled = env_settings(
+        "SETUP_MAP_CACHE", "SETUP_MAP_CACHE_MB", DEFAULT_DIRECTORY, DEFAULT_MAX_MB,
+    )
+    return MapCache(directory, max_bytes, enabled=enabled)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    return lru_main(default_cache(), argv, "python -m SetUp.map_cache {stats,clear}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,266 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import json
+
+import numpy as np
+
+from SetUp.data_classes import ConfigEncoder
+from SetUp.occupancy import OccupancyGrid, shape_parts, unpack_layer
+from SetUp.quadtree import QuadGrid, QuadTree
+from SetUp.vector_format import shape_record
+
+FORMAT_VERSION = 1
+# Version of the files holding quadtree layers, which older readers cannot decode
+QUADTREE_FORMAT_VERSION = 2
+HEADER_KEY = "header"
+LAYER_PREFIX = "layer/"
+
+
+def write_npz(data_config, grid, path):
+    """
+    Write a configuration as a compressed NPZ archive.
+
+    The archive holds a small JSON header with the robot, simulator and environment
+    sections, and one bit-packed array per occupancy layer, or for a QuadGrid the two
+    arrays of each encoded quadtree. The header also lists the shapes of the grid as
+    ``SetUp.vector_format`` records.
+
+    :param data_config: Dict with the ``robot``, ``env`` and ``simulator`` sections.
+    :param grid: The OccupancyGrid or QuadGrid of the field, or None when there are no
+        layers.
+    :param path: Destination file.
+    """
+    header = dict(data_config, format_version=FORMAT_VERSION, layers={})
+    arrays = {}
+    if grid is not None:
+        header["env"] = {
+            "length": grid.length,
+            "width": grid.width,
+            "d_tassel": grid.d_tassel,
+            "shapes": [shape_record(shape, grid.d_tassel) for shape in grid.shapes],
+        }
+        if isinstance(grid, QuadGrid):
+            header["format_version"] = QUADTREE_FORMAT_VERSION
+            for name in grid.layers:
+                header["layers"][name] = {
+                    "shape": list(grid.shape), "encoding": "quadtree", "leaf_size": grid.leaf_size,
+                }
+            for key, array in grid.encoded().items():
+                arrays[LAYER_PREFIX + key] = array
+        else:
+            for name in grid.layers:
+                header["layers"][name] = {"shape": list(grid.shape), "encoding": "packbits"}
+                arrays[LAYER_PREFIX + name] = grid.packed(name)
+
+    encoded = json.dumps(header, cls=ConfigEncoder).encode("utf-8")
+    arrays[HEADER_KEY] = np.frombuffer(encoded, dtype=np.uint8)
+    with open(path, "wb") as map_file:
+        np.savez_compressed(map_file, **arrays)
+
+
+class MapFile:
+    """
+    Lazy reader for configurations written by ``write_npz``.
+
+    Only the header is parsed on open; each layer is decompressed and unpacked the
+    first time it is requested.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the MapFile.
+
+        :param path: Path of the NPZ archive.
+        """
+        self.path = path
+        self._archive = np.load(path)
+        self.header = json.loads(self._archive[HEADER_KEY].tobytes().decode("utf-8"))
+        if self.header.get("format_version") not in (FORMAT_VERSION, QUADTREE_FORMAT_VERSION):
+            raise ValueError(f"Unsupported map format version in '{path}'.")
+        self._layers = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Release the underlying archive."""
+        self._archive.close()
+
+    @property
+    def robot(self):
+        return self.header["robot"]
+
+    @property
+    def simulator(self):
+        return self.header["simulator"]
+
+    @property
+    def env(self):
+        return self.header["env"]
+
+    @property
+    def layer_names(self):
+        return list(self.header["layers"])
+
+    def layer(self, name):
+        """Return the boolean mask of ``name``, decoding it on first access."""
+        if name not in self._layers:
+            info = self.header["layers"][name]
+            if info["encoding"] == "quadtree":
+                self._layers[name] = self.quadtree(name).to_array()
+            else:
+                self._layers[name] = unpack_layer(self._archive[LAYER_PREFIX + name], info["shape"])
+        return self._layers[name]
+
+    def quadtree(self, name):
+        """Return layer ``name`` as a QuadTree, without building the flat mask of a quadtree layer."""
+        info = self.header["layers"][name]
+        if info["encoding"] != "quadtree":
+            return QuadTree.from_array(self.layer(name))
+        return QuadTree.decode(
+            *info["shape"], self._archive[LAYER_PREFIX + name + "/nodes"],
+            self._archive[LAYER_PREFIX + name + "/leaves"], info["leaf_size"],
+        )
+
+    def cells(self, name):
+        """Return the ``(n, 2)`` array of ``(i, j)`` tiles marked in ``name``."""
+        return np.argwhere(self.layer(name))
+
+    def grid(self):
+        """
+        Return the field as it was written: an OccupancyGrid, or a QuadGrid for quadtree
+        layers, with its shapes in the shape index.
+
+        :raises ValueError: If the configuration has no drawn map.
+        """
+        env, layers = self.env, self.header["layers"]
+        if env is None or "shapes" not in env:
+            raise ValueError(f"'{self.path}' has no drawn map.")
+        quadtree = [info for info in layers.values() if info["encoding"] == "quadtree"]
+        if quadtree:
+            grid = QuadGrid(env["length"], env["width"], env["d_tassel"], layers=(), leaf_size=quadtree[0]["leaf_size"])
+            grid.layers.update((name, self.quadtree(name)) for name in layers)
+        else:
+            masks = {name: self.layer(name) for name in layers}
+            grid = OccupancyGrid.from_masks(env["length"], env["width"], env["d_tassel"], masks)
+        grid.shapes.insert_records(env["shapes"])
+        return grid
+
+
+def load_map(path):
+    """Open a configuration written by ``write_npz``."""
+    return MapFile(path)
+
+
+def map_prefix(index):
+    return f"map/{index:05d}/"
+
+
+def write_bundle(data_config, maps, grid_info, path):
+    """
+    Write several rasterized maps of the same field as one compressed NPZ archive.
+
+    :param data_config: Dict with the ``robot``, ``env`` and ``simulator`` sections.
+    :param maps: List of dicts with the ``seed`` and ``shapes`` of each map and its
+        ``layers``, a dict of arrays packed like ``OccupancyGrid.packed``.
+    :param grid_info: Dict with the ``length``, ``width``, ``d_tassel`` and ``shape``
+        shared by all the maps.
+    :param path: Destination file.
+    """
+    header = dict(
+        data_config,
+        format_version=FORMAT_VERSION,
+        grid={key: grid_info[key] for key in ("length", "width", "d_tassel")},
+        maps=[],
+    )
+    header["grid"]["shape"] = list(grid_info["shape"])
+    arrays = {}
+    for index, map_data in enumerate(maps):
+        header["maps"].append(
+            {"seed": map_data["seed"], "shapes": map_data["shapes"], "layers": list(map_data["layers"])}
+        )
+        for name, packed in map_data["layers"].items():
+            arrays[map_prefix(index) + LAYER_PREFIX + name] = packed
+
+    encoded = json.dumps(header, cls=ConfigEncoder).encode("utf-8")
+    arrays[HEADER_KEY] = np.frombuffer(encoded, dtype=np.uint8)
+    with open(path, "wb") as bundle_file:
+        np.savez_compressed(bundle_file, **arrays)
+
+
+class MapBundle:
+    """
+    Lazy reader for bundles written by ``write_bundle``.
+
+    Only the header is parsed on open; the layers of a map are decompressed when that
+    map is requested.
+    """
+
+    def __init__(self, path):
+        """
+        Initialize the MapBundle.
+
+        :param path: Path of the NPZ archive.
+        """
+        self.path = path
+        self._archive = np.load(path)
+        self.header = json.loads(self._archive[HEADER_KEY].tobytes().decode("utf-8"))
+        if self.header.get("format_version") != FORMAT_VERSION or "maps" not in self.header:
+            raise ValueError(f"'{path}' is not a map bundle of a supported version.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.header["maps"])
+
+    def close(self):
+        """Release the underlying archive."""
+        self._archive.close()
+
+    def seed(self, index):
+        return self.header["maps"][index]["seed"]
+
+    def shapes(self, index):
+        """Return the shapes placed on map ``index``, as accepted by ``OccupancyGrid.add_shape``."""
+        return self.header["maps"][index]["shapes"]
+
+    def layer(self, index, name):
+        """Return the boolean mask of layer ``name`` of map ``index``."""
+        packed = self._archive[map_prefix(index) + LAYER_PREFIX + name]
+        return unpack_layer(packed, self.header["grid"]["shape"])
+
+    def grid(self, index):
+        """Return map ``index`` as an OccupancyGrid, with its shapes in the shape index."""
+        grid_info = self.header["grid"]
+        masks = {name: self.layer(index, name) for name in self.header["maps"][index]["layers"]}
+        grid = OccupancyGrid.from_masks(
+            grid_info["length"], grid_info["width"], grid_info["d_tassel"], masks
+        )
+        for shape in self.shapes(index):
+            for layer, kind, params in shape_parts(shape):
+                grid.shapes.insert(layer, kind, params)
+        return grid
+
+
+def load_bundle(path):
+    """Open a bundle written by ``write_bundle``."""
+    return MapBundle(path)
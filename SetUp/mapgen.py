@@ -0,0 +1,279 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from SetUp.launcher import available_cores
+from SetUp.map_cache import cache_key, default_cache
+from SetUp.map_format import write_bundle
+from SetUp.occupancy import OccupancyGrid
+
+MAPS_FILE = "maps.npz"
+# Part of the cache key; bump it whenever generate_map places shapes differently
+GENERATOR_VERSION = 1
+# Candidates drawn per missing shape in each rejection round, up to MAX_BATCH
+OVERSAMPLING = 4
+MAX_BATCH = 2048
+# Consecutive rounds without any accepted candidate before giving up
+MAX_FAILED_ROUNDS = 20
+
+
+def map_seeds(seed, num_maps):
+    """Derive one independent seed per map from a base seed."""
+    return [int(s) for s in np.random.SeedSequence(seed).generate_state(num_maps)]
+
+
+def overlaps(boxes, others):
+    """
+    Test every box of ``boxes`` against every box of ``others``.
+
+    :param boxes: ``(k, 4)`` array of ``(x0, y0, x1, y1)`` bounding boxes.
+    :param others: ``(p, 4)`` array of bounding boxes.
+    :return: ``(k, p)`` boolean array, True where the interiors intersect.
+    """
+    return (
+        (boxes[:, None, 0] < others[None, :, 2]) & (others[None, :, 0] < boxes[:, None, 2])
+        & (boxes[:, None, 1] < others[None, :, 3]) & (others[None, :, 1] < boxes[:, None, 3])
+    )
+
+
+def accept(candidates, placed, count):
+    """
+    Greedily pick up to ``count`` candidates that overlap neither ``placed`` nor each other.
+
+    :return: Indices of the accepted candidates.
+    """
+    free = np.flatnonzero(~overlaps(candidates, placed).any(axis=1))
+    mutual = overlaps(candidates[free], candidates[free])
+    accepted = np.zeros(len(free), dtype=bool)
+    found = 0
+    for k in range(len(free)):
+        if found == count:
+            break
+        if not (mutual[k] & accepted).any():
+            accepted[k] = True
+            found += 1
+    return free[accepted]
+
+
+def rectangle_sampler(length, width, min_w, max_w, min_h, max_h):
+    """
+    Return a function drawing ``k`` random rectangles inside the field.
+
+    The sampler returns the ``(k, 4)`` bounding boxes and the ``(k, 4)`` parameters
+    ``(x, y, width, height)``.
+    """
+    if max_w > length or max_h > width:
+        raise ValueError("Blocked squares cannot be larger than the field.")
+
+    def sample(rng, k):
+        w = rng.uniform(min_w, max_w, k)
+        h = rng.uniform(min_h, max_h, k)
+        x = rng.random(k) * (length - w)
+        y = rng.random(k) * (width - h)
+        params = np.column_stack((x, y, w, h))
+        return np.column_stack((x, y, x + w, y + h)), params
+
+    return sample
+
+
+def circle_sampler(length, width, min_r, max_r):
+    """
+    Return a function drawing ``k`` random circles inside the field.
+
+    The sampler returns the ``(k, 4)`` bounding boxes and the ``(k, 3)`` parameters
+    ``(x_center, y_center, radius)``.
+    """
+    if 2 * max_r > min(length, width):
+        raise ValueError("Blocked circles cannot be larger than the field.")
+
+    def sample(rng, k):
+        r = rng.uniform(min_r, max_r, k)
+        x = r + rng.random(k) * (length - 2 * r)
+        y = r + rng.random(k) * (width - 2 * r)
+        params = np.column_stack((x, y, r))
+        return np.column_stack((x - r, y - r, x + r, y + r)), params
+
+    return sample
+
+
+def place(rng, sampler, count, placed):
+    """
+    Place ``count`` shapes by rejection sampling, in batches drawn by ``sampler``.
+
+    :param placed: ``(p, 4)`` bounding boxes of the shapes already on the map.
+    :return: The parameters of the new shapes and the updated bounding boxes.
+    :raises ValueError: If ``MAX_FAILED_ROUNDS`` batches in a row place nothing.
+    """
+    chosen = []
+    remaining = count
+    failed_rounds = 0
+    while remaining and failed_rounds < MAX_FAILED_ROUNDS:
+        boxes, params = sampler(rng, min(OVERSAMPLING * remaining, MAX_BATCH))
+        picked = accept(boxes, placed, remaining)
+        placed = np.concatenate((placed, boxes[picked]))
+        chosen.append(params[picked])
+        remaining -= len(picked)
+        failed_rounds = 0 if len(picked) else failed_rounds + 1
+    if remaining:
+        raise ValueError(f"Could not place {count} shapes without overlap; the field is too crowded.")
+    params = np.concatenate(chosen) if chosen else np.empty((0, 4))
+    return params, placed
+
+
+def isolated_area_shapes(rng, env, d_tassel, placed):
+    """
+    Place the isolated area of ``env``, if its ranges allow one, with its opening.
+
+    The opening is one tile deep, centred on the bottom side of the area.
+
+    :return: The list of shapes and the updated bounding boxes.
+    """
+    if env.isolated_area_shape == "Square":
+        if env.isolated_area_max_length <= 0 or env.isolated_area_max_width <= 0:
+            return [], placed
+        sampler = rectangle_sampler(
+            env.length, env.width,
+            env.isolated_area_min_length, env.isolated_area_max_length,
+            env.isolated_area_min_width, env.isolated_area_max_width,
+        )
+        params, placed = place(rng, sampler, 1, placed)
+        x, y, w, h = params[0].tolist()
+        shape = {"kind": "isolated_area", "shape": "Square", "x": x, "y": y, "width": w, "height": h}
+        opening_width, opening_x, opening_y = w / 4, x + 3 * w / 8, y
+    else:
+        if env.max_radius <= 0:
+            return [], placed
+        sampler = circle_sampler(env.length, env.width, env.min_radius, env.max_radius)
+        params, placed = place(rng, sampler, 1, placed)
+        x, y, r = params[0].tolist()
+        shape = {"kind": "isolated_area", "shape": "Circle", "x_center": x, "y_center": y, "radius": r}
+        opening_width, opening_x, opening_y = r / 2, x - r / 4, y - r
+
+    shape["opening"] = {"x": opening_x, "y": opening_y, "width": opening_width, "height": d_tassel}
+    return [shape], placed
+
+
+def generate_map(env, d_tassel, seed):
+    """
+    Generate one random map from the ranges of ``env``.
+
+    The isolated area is placed first, then the blocked squares and circles, none of
+    them overlapping. The same seed always gives the same map.
+
+    :return: Dict with the ``seed``, the ``shapes`` placed and the bit-packed ``layers``.
+    """
+    rng = np.random.default_rng(seed)
+    placed = np.empty((0, 4))
+    shapes, placed = isolated_area_shapes(rng, env, d_tassel, placed)
+
+    if env.num_blocked_squares:
+        sampler = rectangle_sampler(
+            env.length, env.width,
+            env.min_width_square, env.max_width_square,
+            env.min_height_square, env.max_height_square,
+        )
+        params, placed = place(rng, sampler, int(env.num_blocked_squares), placed)
+        shapes += [
+            {"kind": "square", "x": x, "y": y, "width": w, "height": h}
+            for x, y, w, h in params.tolist()
+        ]
+
+    if env.num_blocked_circles:
+        sampler = circle_sampler(env.length, env.width, env.min_ray, env.max_ray)
+        params, placed = place(rng, sampler, int(env.num_blocked_circles), placed)
+        shapes += [
+            {"kind": "circle", "x_center": x, "y_center": y, "radius": r}
+            for x, y, r in params.tolist()
+        ]
+
+    grid = OccupancyGrid(env.length, env.width, d_tassel)
+    for shape in shapes:
+        grid.add_shape(shape)
+    return {
+        "seed": seed,
+        "shapes": shapes,
+        "layers": {name: grid.packed(name) for name in grid.layers},
+    }
+
+
+def generate_maps(env, d_tassel, num_maps, seed=0, workers=None, cache=None, first_map=0):
+    """
+    Generate ``num_maps`` random maps, spread over worker processes.
+
+    Each map has its own seed derived from ``seed``, so the result does not depend on
+    the number of workers. Maps already in the cache are not generated again.
+
+    :param workers: Maximum worker processes, by default the number of available cores.
+    :param cache: The MapCache to use, by default ``default_cache()``.
+    :param first_map: Index of the first map, to generate the maps ``first_map`` to
+        ``first_map + num_maps - 1`` of a larger set.
+    :return: List of the dicts returned by ``generate_map``, in map order.
+    """
+    cache = cache or default_cache()
+    seeds = map_seeds(seed, first_map + num_maps)[first_map:]
+    keys = [
+        cache_key("random_map", version=GENERATOR_VERSION, env=env, d_tassel=d_tassel, seed=map_seed)
+        for map_seed in seeds
+    ]
+    maps = []
+    for map_seed, key in zip(seeds, keys):
+        entry = cache.get(key)
+        if entry is not None:
+            layers, meta = entry
+            entry = {"seed": map_seed, "shapes": meta["shapes"], "layers": layers}
+        maps.append(entry)
+
+    missing = [index for index, map_data in enumerate(maps) if map_data is None]
+    workers = max(1, min(workers or available_cores(), len(missing)))
+    if workers == 1:
+        generated = [generate_map(env, d_tassel, seeds[index]) for index in missing]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            generated = list(pool.map(
+                generate_map, [env] * len(missing), [d_tassel] * len(missing),
+                [seeds[index] for index in missing],
+            ))
+    for index, map_data in zip(missing, generated):
+        maps[index] = map_data
+        cache.put(keys[index], map_data["layers"], {"shapes": map_data["shapes"]})
+    return maps
+
+
+def generate_bundle(robot, simulator, env, path=MAPS_FILE, seed=0, workers=None, cache=None,
+                    first_map=0):
+    """
+    Generate the ``simulator.num_maps`` maps of ``env`` and write them as a bundle.
+
+    :param robot: The RobotConfig, stored in the bundle header.
+    :param simulator: The SimulatorConfig, giving the number of maps and the tile size.
+    :param env: The EnvConfig with the ranges of the obstacles.
+    :param cache: The MapCache to use, by default ``default_cache()``.
+    :param first_map: Index of the first map in the whole set, see ``generate_maps``;
+        stored in the header when not zero.
+    :return: The path written.
+    """
+    maps = generate_maps(env, simulator.dim_tassel, simulator.num_maps, seed, workers, cache, first_map)
+    rows, cols = int(env.length / simulator.dim_tassel), int(env.width / simulator.dim_tassel)
+    grid_info = {
+        "length": env.length, "width": env.width,
+        "d_tassel": simulator.dim_tassel, "shape": (rows, cols),
+    }
+    data_config = {"robot": robot, "env": env, "simulator": simulator, "seed": seed}
+    if first_map:
+        data_config["first_map"] = first_map
+    write_bundle(data_config, maps, grid_info, path)
+    return path
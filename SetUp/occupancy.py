@@ -0,0 +1,319 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import numpy as np
+
+from SetUp.rasterize import (
+    rectangle_bounds, circle_bounds, circle_mask, cells_to_tuples, rectangles_mask, circles_mask,
+)
+from SetUp.spatial_index import ShapeIndex
+from SetUp.tracing import span
+
+# Layers of objects_data, in the order they are exported
+LAYERS = ("circles", "squares", "isolated_area", "opening")
+
+
+def unpack_layer(packed, shape):
+    """Unpack a layer packed by ``OccupancyGrid.packed`` into a boolean array of ``shape``."""
+    rows, cols = shape
+    return np.unpackbits(packed, count=rows * cols).reshape(rows, cols).view(bool)
+
+
+def shape_parts(shape):
+    """
+    Split a shape dict, as listed in a spec file, into the primitives it is drawn with.
+
+    :param shape: ``{"kind": "square", "x", "y", "width", "height"}``,
+        ``{"kind": "circle", "x_center", "y_center", "radius"}``,
+        ``{"kind": "opening", "x", "y", "width", "height"}`` or
+        ``{"kind": "isolated_area", "shape": "Square" | "Circle", ...}`` with the
+        geometry of that shape and an optional ``"opening"`` rectangle.
+    :return: List of ``(layer, kind, params)`` with ``kind`` ``"rectangle"`` and
+        ``params`` ``(x, y, width, height)``, or ``"circle"`` and ``(x_center, y_center, radius)``.
+    :raises ValueError: If the kind of shape is unknown.
+    """
+    def rectangle(layer, geometry):
+        return layer, "rectangle", (geometry["x"], geometry["y"], geometry["width"], geometry["height"])
+
+    def circle(layer, geometry):
+        return layer, "circle", (geometry["x_center"], geometry["y_center"], geometry["radius"])
+
+    kind = shape["kind"]
+    if kind == "square":
+        return [rectangle("squares", shape)]
+    if kind == "circle":
+        return [circle("circles", shape)]
+    if kind == "opening":
+        return [rectangle("opening", shape)]
+    if kind == "isolated_area":
+        if shape.get("shape", "Square") == "Square":
+            parts = [rectangle("isolated_area", shape)]
+        else:
+            parts = [circle("isolated_area", shape)]
+        if shape.get("opening"):
+            parts.append(rectangle("opening", shape["opening"]))
+        return parts
+    raise ValueError(f"Unknown shape kind '{kind}'.")
+
+
+class OccupancyGrid:
+    """
+    Layered occupancy grid of the field, one byte per tile per layer.
+
+    Tile ``(i, j)`` covers ``[i * d_tassel, (i + 1) * d_tassel)`` along the field length,
+    the x axis of the shapes and of the map editor, and ``[j * d_tassel, (j + 1) * d_tassel)``
+    along its width, the y axis. Cells falling outside the field are dropped, and a cell
+    covered by several shapes is stored once. The shapes filled are also kept in
+    ``shapes``, a ShapeIndex used to detect overlaps. While ``journal`` is set to an
+    ``SetUp.history.Edit``, the tiles and shapes each fill adds are recorded in it.
+    """
+
+    def __init__(self, length, width, d_tassel, layers=LAYERS):
+        """
+        Initialize the OccupancyGrid.
+
+        :param length: Length of the field, in metres.
+        :param width: Width of the field, in metres.
+        :param d_tassel: Side of a square tile, in metres.
+        :param layers: Names of the layers to allocate.
+        """
+        self.length = length
+        self.width = width
+        self.d_tassel = d_tassel
+        self.shape = (int(length / d_tassel), int(width / d_tassel))
+        self.layers = {name: np.zeros(self.shape, dtype=bool) for name in layers}
+        self.shapes = ShapeIndex.for_field(length, width)
+        self.journal = None
+
+    @classmethod
+    def from_masks(cls, length, width, d_tassel, masks):
+        """
+        Build a grid around existing layer masks.
+
+        :param masks: Dict mapping layer names to boolean arrays of the grid's shape.
+        :raises ValueError: If a mask does not match the size of the field.
+        """
+        grid = cls(length, width, d_tassel, layers=())
+        for name, mask in masks.items():
+            if mask.shape != grid.shape:
+                raise ValueError(f"Layer '{name}' has shape {mask.shape}, expected {grid.shape}.")
+            grid.layers[name] = mask
+        return grid
+
+    @classmethod
+    def from_packed(cls, length, width, d_tassel, layers):
+        """Build a grid from a dict of layers packed by ``packed``."""
+        shape = (int(length / d_tassel), int(width / d_tassel))
+        masks = {name: unpack_layer(packed, shape) for name, packed in layers.items()}
+        return cls.from_masks(length, width, d_tassel, masks)
+
+    def __getitem__(self, layer):
+        return self.layers[layer]
+
+    @property
+    def nbytes(self):
+        """Memory used by all layers, in bytes."""
+        return sum(mask.nbytes for mask in self.layers.values())
+
+    def clip(self, start_i, end_i, start_j, end_j):
+        """Clip an index range with exclusive ends to the grid."""
+        rows, cols = self.shape
+        return (
+            min(max(start_i, 0), rows), min(max(end_i, 0), rows),
+            min(max(start_j, 0), cols), min(max(end_j, 0), cols),
+        )
+
+    def fill_rectangle(self, layer, x, y, width, height):
+        """
+        Mark the tiles of a rectangle given by its bottom-left corner and size in metres.
+
+        :return: The index range ``(start_i, end_i, start_j, end_j)`` that was written.
+        """
+        shape = self.shapes.insert(layer, "rectangle", (x, y, width, height))
+        if self.journal is not None:
+            self.journal.shapes.append(shape)
+        with span("fill_rectangle", layer=layer) as trace:
+            bounds = self.clip(*rectangle_bounds(x, y, width, height, self.d_tassel))
+            start_i, end_i, start_j, end_j = bounds
+            block = self.layers[layer][start_i:end_i, start_j:end_j]
+            if self.journal is not None:
+                self.journal.add_cells(layer, start_i, start_j, ~block)
+            block[...] = True
+            trace.count("cells", max(end_i - start_i, 0) * max(end_j - start_j, 0))
+        return bounds
+
+    def fill_circle(self, layer, x_center, y_center, radius):
+        """
+        Mark the tiles of a circle given by its centre and radius in metres.
+
+        :return: The index range ``(start_i, end_i, start_j, end_j)`` that was written.
+        """
+        shape = self.shapes.insert(layer, "circle", (x_center, y_center, radius))
+        if self.journal is not None:
+            self.journal.shapes.append(shape)
+        with span("fill_circle", layer=layer) as trace:
+            center_i, center_j, radius, *bounds = circle_bounds(
+                x_center, y_center, radius, self.d_tassel, *self.shape
+            )
+            start_i, end_i, start_j, end_j = bounds
+            if end_i > start_i and end_j > start_j:
+                mask = circle_mask(center_i, center_j, radius, *bounds)
+                block = self.layers[layer][start_i:end_i, start_j:end_j]
+                if self.journal is not None:
+                    self.journal.add_cells(layer, start_i, start_j, mask & ~block)
+                block |= mask
+                if trace.active:
+                    trace.count("cells", int(np.count_nonzero(mask)))
+        return tuple(bounds)
+
+    def add_shape(self, shape):
+        """
+        Mark the tiles of a shape described by a dict, as listed in a spec file.
+
+        :param shape: See ``shape_parts``.
+        :raises ValueError: If the kind of shape is unknown.
+        """
+        for layer, kind, params in shape_parts(shape):
+            if kind == "rectangle":
+                self.fill_rectangle(layer, *params)
+            else:
+                self.fill_circle(layer, *params)
+
+    def add_shapes(self, shapes):
+        """
+        Mark the tiles of many shapes at once, as ``add_shape`` would one by one.
+
+        The rectangles and the circles of each layer are rasterized in a single
+        vectorized pass over the grid.
+
+        :param shapes: Iterable of shape dicts, see ``shape_parts``.
+        :raises ValueError: If the kind of a shape is unknown.
+        """
+        groups = {}
+        for shape in shapes:
+            for layer, kind, params in shape_parts(shape):
+                indexed = self.shapes.insert(layer, kind, params)
+                if self.journal is not None:
+                    self.journal.shapes.append(indexed)
+                groups.setdefault((layer, kind), []).append(params)
+
+        rows, cols = self.shape
+        for (layer, kind), params in groups.items():
+            with span("add_shapes", layer=layer, kind=kind, shapes=len(params)) as trace:
+                params = np.asarray(params, dtype=float) / self.d_tassel
+                if kind == "rectangle":
+                    # Same rounding as rectangle_bounds
+                    start_i, start_j = np.round(params[:, 0]), np.round(params[:, 1])
+                    end_i, end_j = start_i + np.round(params[:, 2]), start_j + np.round(params[:, 3])
+                    mask = rectangles_mask(
+                        *(a.astype(np.int64) for a in (start_i, end_i, start_j, end_j)), rows, cols
+                    )
+                else:
+                    # Same rounding as circle_bounds
+                    mask = circles_mask(
+                        np.floor(params[:, 0]), np.floor(params[:, 1]), np.round(params[:, 2]),
+                        rows, cols,
+                    )
+                target = self.layers[layer]
+                if self.journal is not None:
+                    self.journal.add_cells(layer, 0, 0, mask & ~target)
+                target |= mask
+                if trace.active:
+                    trace.count("cells", int(np.count_nonzero(mask)))
+
+    def block(self, layer, start_i, end_i, start_j, end_j):
+        """Return the tiles of ``layer`` in an index range with exclusive ends, as a view."""
+        return self.layers[layer][start_i:end_i, start_j:end_j]
+
+    def write_block(self, layer, start_i, end_i, start_j, end_j, value=True):
+        """Set every tile of an index range of ``layer`` to ``value``."""
+        self.layers[layer][start_i:end_i, start_j:end_j] = value
+
+    def write_mask(self, layer, start_i, start_j, mask, value=True):
+        """Set the tiles of ``layer`` where ``mask``, placed at ``(start_i, start_j)``, is True."""
+        block = self.layers[layer][start_i:start_i + mask.shape[0], start_j:start_j + mask.shape[1]]
+        block[mask[:block.shape[0], :block.shape[1]]] = value
+
+    def raster(self, layer, level):
+        """
+        Return ``layer`` reduced ``2 ** level`` times along each axis, a reduced tile
+        being marked when any of its tiles is.
+        """
+        mask = self.layers[layer]
+        if level == 0:
+            return mask
+        step = 2 ** level
+        counts = np.add.reduceat(mask.view(np.uint8), np.arange(0, mask.shape[0], step), axis=0, dtype=np.uint32)
+        return np.add.reduceat(counts, np.arange(0, mask.shape[1], step), axis=1) > 0
+
+    def add_cells(self, layer, cells):
+        """Mark an ``(n, 2)`` array of ``(i, j)`` tile indices, ignoring those off the field."""
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        rows, cols = self.shape
+        inside = (
+            (cells[:, 0] >= 0) & (cells[:, 0] < rows)
+            & (cells[:, 1] >= 0) & (cells[:, 1] < cols)
+        )
+        cells = cells[inside]
+        self.layers[layer][cells[:, 0], cells[:, 1]] = True
+
+    def contains(self, layer, i, j):
+        """Return True if tile ``(i, j)`` is marked in ``layer``."""
+        rows, cols = self.shape
+        return 0 <= i < rows and 0 <= j < cols and bool(self.layers[layer][i, j])
+
+    def count(self, *layers):
+        """Return the number of tiles marked in any of ``layers`` (all layers by default)."""
+        return int(np.count_nonzero(self.union(*layers)))
+
+    def union(self, *layers):
+        """Return the boolean mask of tiles marked in any of ``layers`` (all layers by default)."""
+        masks = [self.layers[name] for name in (layers or self.layers)]
+        if len(masks) == 1:
+            return masks[0].copy()
+        return np.logical_or.reduce(masks)
+
+    def cells(self, layer):
+        """Return the ``(n, 2)`` array of ``(i, j)`` tiles marked in ``layer``."""
+        return np.argwhere(self.layers[layer])
+
+    def iter_cells(self, layer, chunk_size=65536):
+        """
+        Yield the tiles marked in ``layer`` as ``(n, 2)`` arrays, in row-major order.
+
+        Each chunk covers whole rows and about ``chunk_size`` tiles, so the cells of a
+        large layer never have to be materialized at once.
+        """
+        mask = self.layers[layer]
+        step = max(1, chunk_size // max(self.shape[1], 1))
+        for start in range(0, self.shape[0], step):
+            cells = np.argwhere(mask[start:start + step])
+            if len(cells):
+                cells[:, 0] += start
+                yield cells
+
+    def packed(self, layer):
+        """Return ``layer`` packed to one bit per tile, row-major."""
+        return np.packbits(self.layers[layer], axis=None)
+
+    def to_dict(self):
+        """
+        Return the field as the ``objects_data`` dict written to ``data_file``.
+
+        :return: ``length`` and ``width`` plus one list of ``(i, j)`` tuples per layer.
+        """
+        data = {"length": self.length, "width": self.width}
+        for name in self.layers:
+            data[name] = cells_to_tuples(self.cells(name))
+        return data
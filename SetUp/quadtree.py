@@ -0,0 +1,624 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Quadtree representation of the occupancy grid, for fields too large for a flat array.
+
+A QuadTree covers one layer with square nodes that are either uniform (all tiles free or
+all marked), split in four, or, at ``LEAF_SIZE`` tiles a side, a dense boolean block.
+Uniform regions of any size cost a single node, so the memory used grows with the length
+of the shape borders rather than with the area of the field. QuadGrid offers the
+OccupancyGrid interface used by the map editor, the exporter and the CLI on top of one
+QuadTree per layer.
+"""
+
+import math
+
+import numpy as np
+
+from SetUp.occupancy import LAYERS, OccupancyGrid, shape_parts
+from SetUp.rasterize import rectangle_bounds, circle_bounds, circle_mask
+from SetUp.spatial_index import ShapeIndex
+from SetUp.tracing import span
+
+# Side of the dense blocks at the bottom of the tree, in tiles; a power of two
+LEAF_SIZE = 64
+# Fields with at least this many tiles use a QuadGrid by default (268 MB as flat layers)
+QUADTREE_MIN_TILES = 2 ** 26
+
+# Codes of the nodes in the preorder encoding of a tree
+FREE, MARKED, SPLIT, DENSE = 0, 1, 2, 3
+# Coverage of a node by a painter
+NONE, SOME, ALL = 0, 1, 2
+
+
+class RectanglePainter:
+    """Covers the tiles of an index range with exclusive ends."""
+
+    def __init__(self, start_i, end_i, start_j, end_j):
+        self.bounds = (start_i, end_i, start_j, end_j)
+
+    def cover(self, i0, i1, j0, j1):
+        start_i, end_i, start_j, end_j = self.bounds
+        if i1 <= start_i or i0 >= end_i or j1 <= start_j or j0 >= end_j:
+            return NONE
+        if start_i <= i0 and i1 <= end_i and start_j <= j0 and j1 <= end_j:
+            return ALL
+        return SOME
+
+    def mask(self, i0, i1, j0, j1):
+        start_i, end_i, start_j, end_j = self.bounds
+        rows = (np.arange(i0, i1) >= start_i) & (np.arange(i0, i1) < end_i)
+        cols = (np.arange(j0, j1) >= start_j) & (np.arange(j0, j1) < end_j)
+        return rows[:, None] & cols[None, :]
+
+
+class CirclePainter(RectanglePainter):
+    """Covers the tiles of a circle, as ``circle_mask``, within an index range."""
+
+    def __init__(self, center_i, center_j, radius, start_i, end_i, start_j, end_j):
+        super().__init__(start_i, end_i, start_j, end_j)
+        self.center_i, self.center_j, self.radius = center_i, center_j, radius
+
+    def cover(self, i0, i1, j0, j1):
+        cover = super().cover(i0, i1, j0, j1)
+        if cover == NONE:
+            return NONE
+        near_i = max(i0 - self.center_i, 0, self.center_i - (i1 - 1))
+        near_j = max(j0 - self.center_j, 0, self.center_j - (j1 - 1))
+        if near_i ** 2 + near_j ** 2 > self.radius ** 2:
+            return NONE
+        far_i = max(abs(i0 - self.center_i), abs(i1 - 1 - self.center_i))
+        far_j = max(abs(j0 - self.center_j), abs(j1 - 1 - self.center_j))
+        if cover == ALL and far_i ** 2 + far_j ** 2 <= self.radius ** 2:
+            return ALL
+        return SOME
+
+    def mask(self, i0, i1, j0, j1):
+        return super().mask(i0, i1, j0, j1) & circle_mask(self.center_i, self.center_j, self.radius, i0, i1, j0, j1)
+
+
+class MaskPainter:
+    """Covers the tiles set in a boolean mask placed at ``(start_i, start_j)``."""
+
+    def __init__(self, start_i, start_j, mask):
+        self.start_i, self.start_j = start_i, start_j
+        self.mask_array = mask
+
+    def _window(self, i0, i1, j0, j1):
+        rows, cols = self.mask_array.shape
+        a0, a1 = max(i0 - self.start_i, 0), min(i1 - self.start_i, rows)
+        b0, b1 = max(j0 - self.start_j, 0), min(j1 - self.start_j, cols)
+        return a0, a1, b0, b1
+
+    def cover(self, i0, i1, j0, j1):
+        a0, a1, b0, b1 = self._window(i0, i1, j0, j1)
+        if a1 <= a0 or b1 <= b0:
+            return NONE
+        window = self.mask_array[a0:a1, b0:b1]
+        if not window.any():
+            return NONE
+        if window.shape == (i1 - i0, j1 - j0) and window.all():
+            return ALL
+        return SOME
+
+    def mask(self, i0, i1, j0, j1):
+        a0, a1, b0, b1 = self._window(i0, i1, j0, j1)
+        mask = np.zeros((i1 - i0, j1 - j0), dtype=bool)
+        if a1 > a0 and b1 > b0:
+            offset_i, offset_j = self.start_i + a0 - i0, self.start_j + b0 - j0
+            mask[offset_i:offset_i + a1 - a0, offset_j:offset_j + b1 - b0] = self.mask_array[a0:a1, b0:b1]
+        return mask
+
+
+def collapse(block):
+    """Return a dense block, or the uniform value it holds."""
+    if not block.any():
+        return False
+    if block.all():
+        return True
+    return block
+
+
+class QuadTree:
+    """
+    Region quadtree of one boolean layer of ``rows x cols`` tiles.
+
+    A node is ``False`` or ``True`` when uniform, a list of its four quadrants (low i and
+    low j first, then low i high j, high i low j and high i high j) when split, or a
+    dense ``leaf_size x leaf_size`` array. The root is the smallest such square covering
+    the layer; tiles past ``rows`` and ``cols`` are always free.
+    """
+
+    def __init__(self, rows, cols, leaf_size=LEAF_SIZE):
+        """
+        Initialize an empty QuadTree.
+
+        :param rows: Tiles along the first axis.
+        :param cols: Tiles along the second axis.
+        :param leaf_size: Side of the dense blocks, a power of two.
+        """
+        self.rows, self.cols = rows, cols
+        self.leaf_size = leaf_size
+        size = leaf_size
+        while size < max(rows, cols):
+            size *= 2
+        self.size = size
+        self.root = False
+
+    @classmethod
+    def from_array(cls, mask, leaf_size=LEAF_SIZE):
+        """Build the tree of a boolean array."""
+        tree = cls(*mask.shape, leaf_size=leaf_size)
+        rows, cols = mask.shape
+        if not rows or not cols:
+            return tree
+        # Marked tiles of every leaf block, counted without padding the array
+        counts = np.add.reduceat(mask.view(np.uint8), np.arange(0, rows, leaf_size), axis=0, dtype=np.uint32)
+        counts = np.add.reduceat(counts, np.arange(0, cols, leaf_size), axis=1)
+        blocks = tree.size // leaf_size
+        states = np.zeros((blocks, blocks), dtype=np.uint8)
+        states[:counts.shape[0], :counts.shape[1]] = np.where(
+            counts == 0, FREE, np.where(counts == leaf_size * leaf_size, MARKED, DENSE)
+        )
+
+        # Pyramid of node states, from the leaf blocks up to the root
+        pyramid = [states]
+        while pyramid[-1].shape[0] > 1:
+            level = pyramid[-1]
+            quadrants = (level[0::2, 0::2], level[0::2, 1::2], level[1::2, 0::2], level[1::2, 1::2])
+            uniform = (quadrants[0] != DENSE) & (quadrants[0] != SPLIT)
+            for quadrant in quadrants[1:]:
+                uniform &= quadrant == quadrants[0]
+            pyramid.append(np.where(uniform, quadrants[0], SPLIT).astype(np.uint8))
+
+        def build(depth, bi, bj):
+            state = pyramid[depth][bi, bj]
+            if state == FREE:
+                return False
+            if state == MARKED:
+                return True
+            if state == DENSE:
+                i0, j0 = bi * leaf_size, bj * leaf_size
+                block = np.zeros((leaf_size, leaf_size), dtype=bool)
+                part = mask[i0:i0 + leaf_size, j0:j0 + leaf_size]
+                block[:part.shape[0], :part.shape[1]] = part
+                return block
+            return [build(depth - 1, 2 * bi + di, 2 * bj + dj) for di in (0, 1) for dj in (0, 1)]
+
+        tree.root = build(len(pyramid) - 1, 0, 0)
+        return tree
+
+    def to_array(self):
+        """Return the layer as a boolean array of ``(rows, cols)``."""
+        return self.block(0, self.rows, 0, self.cols)
+
+    def _children(self, node, i0, j0, size):
+        half = size // 2
+        for k, (di, dj) in enumerate(((0, 0), (0, half), (half, 0), (half, half))):
+            yield node[k], i0 + di, j0 + dj, half
+
+    def _nodes(self, i0, i1, j0, j1):
+        """Yield ``(node, i0, j0, size)`` for the non-split nodes meeting an index range."""
+        stack = [(self.root, 0, 0, self.size)]
+        while stack:
+            node, a, b, size = stack.pop()
+            if a >= i1 or a + size <= i0 or b >= j1 or b + size <= j0:
+                continue
+            if isinstance(node, list):
+                stack.extend(self._children(node, a, b, size))
+            else:
+                yield node, a, b, size
+
+    def block(self, start_i, end_i, start_j, end_j):
+        """Return a dense copy of the tiles of an index range with exclusive ends."""
+        out = np.zeros((max(end_i - start_i, 0), max(end_j - start_j, 0)), dtype=bool)
+        for node, i0, j0, size in self._nodes(start_i, end_i, start_j, end_j):
+            if node is False:
+                continue
+            a0, a1 = max(i0, start_i), min(i0 + size, end_i)
+            b0, b1 = max(j0, start_j), min(j0 + size, end_j)
+            target = out[a0 - start_i:a1 - start_i, b0 - start_j:b1 - start_j]
+            target[...] = True if node is True else node[a0 - i0:a1 - i0, b0 - j0:b1 - j0]
+        return out
+
+    def get(self, i, j):
+        """Return True if tile ``(i, j)`` is marked."""
+        if not (0 <= i < self.rows and 0 <= j < self.cols):
+            return False
+        node, i0, j0, size = self.root, 0, 0, self.size
+        while isinstance(node, list):
+            size //= 2
+            k = 2 * (i >= i0 + size) + (j >= j0 + size)
+            i0, j0, node = i0 + size * (k >> 1), j0 + size * (k & 1), node[k]
+        if isinstance(node, np.ndarray):
+            return bool(node[i - i0, j - j0])
+        return node
+
+    def get_many(self, cells):
+        """Return the states of an ``(n, 2)`` array of ``(i, j)`` tiles, as a boolean array."""
+        cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+        states = np.zeros(len(cells), dtype=bool)
+        inside = (
+            (cells[:, 0] >= 0) & (cells[:, 0] < self.rows)
+            & (cells[:, 1] >= 0) & (cells[:, 1] < self.cols)
+        )
+        stack = [(self.root, 0, 0, self.size, np.flatnonzero(inside))]
+        while stack:
+            node, i0, j0, size, index = stack.pop()
+            if not len(index):
+                continue
+            if isinstance(node, list):
+                half = size // 2
+                quadrant = 2 * (cells[index, 0] >= i0 + half) + (cells[index, 1] >= j0 + half)
+                for k, (child, a, b, child_size) in enumerate(self._children(node, i0, j0, size)):
+                    stack.append((child, a, b, child_size, index[quadrant == k]))
+            elif isinstance(node, np.ndarray):
+                states[index] = node[cells[index, 0] - i0, cells[index, 1] - j0]
+            elif node:
+                states[index] = True
+        return states
+
+    def any(self):
+        return self.root is not False
+
+    def count(self):
+        """Return the number of marked tiles."""
+        total = 0
+        for node, _, _, size in self._nodes(0, self.size, 0, self.size):
+            if node is True:
+                total += size * size
+            elif node is not False:
+                total += int(np.count_nonzero(node))
+        return total
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the nodes, in bytes."""
+        total, stack = 0, [self.root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                total += 88
+                stack.extend(node)
+            elif isinstance(node, np.ndarray):
+                total += node.nbytes
+        return total
+
+    def paint(self, painter, value=True, changes=None):
+        """
+        Set the tiles covered by a painter to ``value``.
+
+        :param painter: RectanglePainter, CirclePainter or MaskPainter, clipped to the layer.
+        :param changes: List receiving the tiles that changed, as ``("block", i0, j0,
+            size)`` for a whole square and ``("mask", i0, j0, mask)`` for a dense one.
+        """
+        self.root = self._paint(self.root, 0, 0, self.size, painter, value, changes)
+
+    def _paint(self, node, i0, j0, size, painter, value, changes):
+        if node is value:
+            return node
+        cover = painter.cover(i0, i0 + size, j0, j0 + size)
+        if cover == NONE:
+            return node
+        if cover == ALL:
+            if changes is not None:
+                self._record(node, i0, j0, size, value, changes)
+            return value
+        if size == self.leaf_size:
+            block = node if isinstance(node, np.ndarray) else np.full((size, size), node)
+            mask = painter.mask(i0, i0 + size, j0, j0 + size)
+            if changes is not None:
+                changes.append(("mask", i0, j0, mask & (block != value)))
+            block[mask] = value
+            return collapse(block)
+        children = [
+            self._paint(child, a, b, half, painter, value, changes)
+            for child, a, b, half in self._children(node if isinstance(node, list) else [node] * 4, i0, j0, size)
+        ]
+        if all(child is True for child in children):
+            return True
+        if all(child is False for child in children):
+            return False
+        return children
+
+    def _record(self, node, i0, j0, size, value, changes):
+        """Add the tiles of a node that differ from ``value`` to ``changes``."""
+        if isinstance(node, list):
+            for child, a, b, half in self._children(node, i0, j0, size):
+                self._record(child, a, b, half, value, changes)
+        elif isinstance(node, np.ndarray):
+            changes.append(("mask", i0, j0, node != value))
+        elif node is not value:
+            changes.append(("block", i0, j0, size))
+
+    def raster(self, level):
+        """
+        Return the layer reduced ``2 ** level`` times along each axis, a reduced tile
+        being marked when any of its tiles is.
+        """
+        step = 2 ** level
+        out = np.zeros((-(-self.rows // step), -(-self.cols // step)), dtype=bool)
+        for node, i0, j0, size in self._nodes(0, self.size, 0, self.size):
+            if node is False:
+                continue
+            if node is True or size <= step:
+                out[i0 // step:-(-(i0 + size) // step), j0 // step:-(-(j0 + size) // step)] |= (
+                    True if node is True else node.any()
+                )
+            else:
+                blocks = node.reshape(size // step, step, size // step, step).any(axis=(1, 3))
+                target = out[i0 // step:i0 // step + size // step, j0 // step:j0 // step + size // step]
+                target |= blocks[:target.shape[0], :target.shape[1]]
+        return out
+
+    def encode(self):
+        """
+        Return the tree as two uint8 arrays: the preorder codes of its nodes and the
+        bit-packed dense blocks, in the same order.
+        """
+        codes, leaves, stack = [], [], [self.root]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, list):
+                codes.append(SPLIT)
+                stack.extend(reversed(node))
+            elif isinstance(node, np.ndarray):
+                codes.append(DENSE)
+                leaves.append(np.packbits(node, axis=None))
+            else:
+                codes.append(MARKED if node else FREE)
+        leaves = np.concatenate(leaves) if leaves else np.zeros(0, dtype=np.uint8)
+        return np.array(codes, dtype=np.uint8), leaves
+
+    @classmethod
+    def decode(cls, rows, cols, codes, leaves, leaf_size=LEAF_SIZE):
+        """Rebuild a tree from the arrays returned by ``encode``."""
+        tree = cls(rows, cols, leaf_size)
+        codes = iter(codes.tolist())
+        leaf_bytes = leaf_size * leaf_size // 8
+        offset = 0
+
+        def build():
+            nonlocal offset
+            code = next(codes)
+            if code == SPLIT:
+                return [build() for _ in range(4)]
+            if code == DENSE:
+                packed = leaves[offset:offset + leaf_bytes]
+                offset += leaf_bytes
+                return np.unpackbits(packed).reshape(leaf_size, leaf_size).astype(bool)
+            return code == MARKED
+
+        tree.root = build()
+        return tree
+
+
+class QuadGrid:
+    """
+    Layered occupancy grid of the field stored as one QuadTree per layer.
+
+    It offers the parts of the OccupancyGrid interface used to draw, edit, export and
+    cache maps, with the same tile layout and rasterization, so both can be used
+    interchangeably there.
+    """
+
+    def __init__(self, length, width, d_tassel, layers=LAYERS, leaf_size=LEAF_SIZE):
+        """
+        Initialize the QuadGrid.
+
+        :param length: Length of the field, in metres.
+        :param width: Width of the field, in metres.
+        :param d_tassel: Side of a square tile, in metres.
+        :param layers: Names of the layers to create.
+        :param leaf_size: Side of the dense blocks of the trees, a power of two.
+        """
+        self.length = length
+        self.width = width
+        self.d_tassel = d_tassel
+        self.shape = (int(length / d_tassel), int(width / d_tassel))
+        self.leaf_size = leaf_size
+        self.layers = {name: QuadTree(*self.shape, leaf_size) for name in layers}
+        self.shapes = ShapeIndex.for_field(length, width)
+        self.journal = None
+
+    @classmethod
+    def from_grid(cls, grid, leaf_size=LEAF_SIZE):
+        """Convert an OccupancyGrid, keeping its shape index."""
+        quad = cls(grid.length, grid.width, grid.d_tassel, layers=(), leaf_size=leaf_size)
+        for name, mask in grid.layers.items():
+            quad.layers[name] = QuadTree.from_array(mask, leaf_size)
+        quad.shapes = grid.shapes
+        return quad
+
+    def to_grid(self):
+        """Convert to an OccupancyGrid, keeping the shape index."""
+        masks = {name: tree.to_array() for name, tree in self.layers.items()}
+        grid = OccupancyGrid.from_masks(self.length, self.width, self.d_tassel, masks)
+        grid.shapes = self.shapes
+        return grid
+
+    @classmethod
+    def from_encoded(cls, length, width, d_tassel, arrays, leaf_size=LEAF_SIZE):
+        """Build a grid from the arrays returned by ``encoded``."""
+        quad = cls(length, width, d_tassel, layers=(), leaf_size=leaf_size)
+        names = [key[:-len("/nodes")] for key in arrays if key.endswith("/nodes")]
+        for name in names:
+            quad.layers[name] = QuadTree.decode(
+                *quad.shape, arrays[name + "/nodes"], arrays[name + "/leaves"], leaf_size
+            )
+        return quad
+
+    def encoded(self):
+        """Return the ``<layer>/nodes`` and ``<layer>/leaves`` arrays of every layer."""
+        arrays = {}
+        for name, tree in self.layers.items():
+            arrays[name + "/nodes"], arrays[name + "/leaves"] = tree.encode()
+        return arrays
+
+    def __getitem__(self, layer):
+        return self.layers[layer]
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by all layers, in bytes."""
+        return sum(tree.nbytes for tree in self.layers.values())
+
+    clip = OccupancyGrid.clip
+
+    def _paint(self, layer, painter, value=True, record=True):
+        changes = [] if record and self.journal is not None else None
+        self.layers[layer].paint(painter, value, changes)
+        for kind, i0, j0, change in changes or ():
+            if kind == "block":
+                self.journal.add_block(layer, i0, i0 + change, j0, j0 + change)
+            else:
+                self.journal.add_cells(layer, i0, j0, change)
+
+    def fill_rectangle(self, layer, x, y, width, height):
+        """
+        Mark the tiles of a rectangle given by its bottom-left corner and size in metres.
+
+        :return: The index range ``(start_i, end_i, start_j, end_j)`` that was written.
+        """
+        shape = self.shapes.insert(layer, "rectangle", (x, y, width, height))
+        if self.journal is not None:
+            self.journal.shapes.append(shape)
+        with span("fill_rectangle", layer=layer) as trace:
+            bounds = self.clip(*rectangle_bounds(x, y, width, height, self.d_tassel))
+            start_i, end_i, start_j, end_j = bounds
+            if end_i > start_i and end_j > start_j:
+                self._paint(layer, RectanglePainter(*bounds))
+            trace.count("cells", max(end_i - start_i, 0) * max(end_j - start_j, 0))
+        return bounds
+
+    def fill_circle(self, layer, x_center, y_center, radius):
+        """
+        Mark the tiles of a circle given by its centre and radius in metres.
+
+        :return: The index range ``(start_i, end_i, start_j, end_j)`` that was written.
+        """
+        shape = self.shapes.insert(layer, "circle", (x_center, y_center, radius))
+        if self.journal is not None:
+            self.journal.shapes.append(shape)
+        with span("fill_circle", layer=layer):
+            center_i, center_j, radius, *bounds = circle_bounds(
+                x_center, y_center, radius, self.d_tassel, *self.shape
+            )
+            start_i, end_i, start_j, end_j = bounds
+            if end_i > start_i and end_j > start_j:
+                self._paint(layer, CirclePainter(center_i, center_j, radius, *bounds))
+        return tuple(bounds)
+
+    def add_shape(self, shape):
+        """
+        Mark the tiles of a shape described by a dict, as listed in a spec file.
+
+        :param shape: See ``shape_parts``.
+        :raises ValueError: If the kind of shape is unknown.
+        """
+        for layer, kind, params in shape_parts(shape):
+            if kind == "rectangle":
+                self.fill_rectangle(layer, *params)
+            else:
+                self.fill_circle(layer, *params)
+
+    def add_shapes(self, shapes):
+        """Mark the tiles of many shapes; each costs time along its border only."""
+        for shape in shapes:
+            self.add_shape(shape)
+
+    def block(self, layer, start_i, end_i, start_j, end_j):
+        """Return a dense copy of the tiles of ``layer`` in an index range."""
+        return self.layers[layer].block(start_i, end_i, start_j, end_j)
+
+    def write_block(self, layer, start_i, end_i, start_j, end_j, value=True):
+        """Set every tile of an index range of ``layer`` to ``value``, without journaling it."""
+        self._paint(layer, RectanglePainter(*self.clip(start_i, end_i, start_j, end_j)), value, False)
+
+    def write_mask(self, layer, start_i, start_j, mask, value=True):
+        """
+        Set the tiles of ``layer`` where ``mask``, placed at ``(start_i, start_j)``, is
+        True to ``value``, without journaling them.
+        """
+        rows, cols = self.shape
+        mask = mask[:max(rows - start_i, 0), :max(cols - start_j, 0)]
+        self._paint(layer, MaskPainter(start_i, start_j, mask), value, False)
+
+    def contains(self, layer, i, j):
+        """Return True if tile ``(i, j)`` is marked in ``layer``."""
+        return self.layers[layer].get(i, j)
+
+    def contains_many(self, layer, cells):
+        """Return the states of an ``(n, 2)`` array of ``(i, j)`` tiles of ``layer``."""
+        return self.layers[layer].get_many(cells)
+
+    def count(self, *layers):
+        """Return the number of tiles marked in any of ``layers`` (all layers by default)."""
+        layers = layers or tuple(self.layers)
+        if len(layers) == 1:
+            return self.layers[layers[0]].count()
+        total = 0
+        for start in range(0, self.shape[0], self.leaf_size):
+            end = min(start + self.leaf_size, self.shape[0])
+            total += int(np.count_nonzero(np.logical_or.reduce(
+                [self.block(name, start, end, 0, self.shape[1]) for name in layers]
+            )))
+        return total
+
+    def raster(self, layer, level):
+        """Return ``layer`` reduced ``2 ** level`` times along each axis, see ``QuadTree.raster``."""
+        return self.layers[layer].raster(level)
+
+    def iter_cells(self, layer, chunk_size=65536):
+        """
+        Yield the tiles marked in ``layer`` as ``(n, 2)`` arrays, in row-major order,
+        decoding about ``chunk_size`` tiles at a time.
+        """
+        tree = self.layers[layer]
+        step = max(1, chunk_size // max(self.shape[1], 1))
+        for start in range(0, self.shape[0], step):
+            if not tree.any():
+                return
+            cells = np.argwhere(tree.block(start, min(start + step, self.shape[0]), 0, self.shape[1]))
+            if len(cells):
+                cells[:, 0] += start
+                yield cells
+
+    def cells(self, layer):
+        """Return the ``(n, 2)`` array of ``(i, j)`` tiles marked in ``layer``."""
+        chunks = list(self.iter_cells(layer))
+        return np.concatenate(chunks) if chunks else np.zeros((0, 2), dtype=np.int64)
+
+    def to_dict(self):
+        """Return the field as the ``objects_data`` dict written to ``data_file``."""
+        return self.to_grid().to_dict()
+
+
+def use_quadtree(length, width, d_tassel, quadtree=None):
+    """
+    Return True if a field should be stored as a QuadGrid.
+
+    :param quadtree: Force one representation; by default a QuadGrid is used from
+        ``QUADTREE_MIN_TILES`` tiles.
+    """
+    if quadtree is None:
+        return math.floor(length / d_tassel) * math.floor(width / d_tassel) >= QUADTREE_MIN_TILES
+    return bool(quadtree)
+
+
+def make_grid(length, width, d_tassel, quadtree=None):
+    """Return an empty grid of the field: a QuadGrid for large fields, else an OccupancyGrid."""
+    if use_quadtree(length, width, d_tassel, quadtree):
+        return QuadGrid(length, width, d_tassel)
+    return OccupancyGrid(length, width, d_tassel)
@@ -0,0 +1,279 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Build the occupancy grid of a field from a site bitmap.
+
+The image is laid on the field with its bottom-left pixel at the origin, ``scale``
+metres per pixel. Every pixel is classified by colour into a layer (by default black is
+an obstacle, red an isolated area and blue an opening, see ``DEFAULT_CLASSES``), and the
+classes are reduced onto the tiles: with ``mode="any"`` a tile is marked when any of its
+pixels is of the class, with ``mode="majority"`` when more than half of them are.
+
+The image is processed in bands of whole tile rows of at most ``chunk_pixels`` pixels,
+so the memory used on top of the grid does not depend on the size of the image. PGM/PPM
+and NPY files are memory-mapped and only the band being processed is read; PNG files
+are decoded by Pillow, which has to be installed, in one piece.
+"""
+
+import math
+import os
+
+import numpy as np
+
+from SetUp.tracing import span
+
+IMAGE_EXTENSIONS = (".png", ".pgm", ".ppm", ".pnm", ".npy")
+# Colours of each layer, as "#rrggbb" strings, grey levels or [r, g, b] lists; a grey
+# image matches a colour through its grey level on all three channels
+DEFAULT_CLASSES = {
+    "squares": ["#000000"],
+    "isolated_area": ["#ff0000", "#808080"],
+    "opening": ["#0000ff", "#c0c0c0"],
+}
+MODES = ("any", "majority")
+# Largest difference on any channel for a pixel to match a colour
+TOLERANCE = 32
+# Pixels classified at once
+CHUNK_PIXELS = 2 ** 20
+
+
+def read_netpbm(path):
+    """
+    Memory-map a binary PGM (P5) or PPM (P6) file.
+
+    :return: Array of shape ``(height, width)`` or ``(height, width, 3)``, with the
+        maximum value of the file.
+    :raises ValueError: If the file is not a binary PGM or PPM.
+    """
+    with open(path, "rb") as image_file:
+        header = image_file.read(512)
+    tokens, position = [], 0
+    while len(tokens) < 4:
+        while position < len(header) and header[position:position + 1].isspace():
+            position += 1
+        if header[position:position + 1] == b"#":
+            position = header.index(b"\n", position) + 1
+            continue
+        end = position
+        while end < len(header) and not header[end:end + 1].isspace():
+            end += 1
+        if end == position or end >= len(header):
+            raise ValueError(f"'{path}' has no valid PGM/PPM header.")
+        tokens.append(header[position:end])
+        position = end
+    magic, width, height, maxval = tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3])
+    if magic not in (b"P5", b"P6") or not 0 < maxval < 65536:
+        raise ValueError(f"'{path}' is not a binary PGM or PPM file.")
+    # A single whitespace character separates the header from the pixels
+    shape = (height, width) if magic == b"P5" else (height, width, 3)
+    dtype = np.uint8 if maxval < 256 else np.dtype(">u2")
+    return np.memmap(path, dtype=dtype, mode="r", offset=position + 1, shape=shape), maxval
+
+
+def read_image(path):
+    """
+    Open a PNG, PGM/PPM or NPY image without decoding more than needed.
+
+    :return: ``(pixels, maxval)`` where ``pixels`` has shape ``(height, width)`` for a
+        grey image or ``(height, width, 3)`` for a colour one.
+    :raises ValueError: If the image cannot be read.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".npy":
+        pixels = np.load(path, mmap_mode="r")
+        if pixels.ndim == 3 and pixels.shape[2] in (3, 4):
+            pixels = pixels[:, :, :3]
+        elif pixels.ndim != 2:
+            raise ValueError(f"'{path}' holds an array of shape {pixels.shape}, not an image.")
+        if pixels.dtype != np.uint8:
+            raise ValueError(f"'{path}' holds {pixels.dtype} values, expected uint8.")
+        return pixels, 255
+    if extension in (".pgm", ".ppm", ".pnm"):
+        return read_netpbm(path)
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ValueError(
+            "Reading PNG images requires Pillow (pip install Pillow); PGM and NPY images do not."
+        ) from None
+    with Image.open(path) as image:
+        image = image.convert("L" if image.mode in ("1", "L", "LA") else "RGB")
+        return np.asarray(image), 255
+
+
+def parse_color(color):
+    """Convert a ``"#rrggbb"`` string, a grey level or an ``[r, g, b]`` list to a tuple."""
+    if isinstance(color, str):
+        value = color.lstrip("#")
+        if len(value) != 6:
+            raise ValueError(f"Invalid colour '{color}', expected #rrggbb.")
+        return tuple(int(value[k:k + 2], 16) for k in (0, 2, 4))
+    if isinstance(color, (int, np.integer)):
+        return (int(color),) * 3
+    color = tuple(int(value) for value in color)
+    if len(color) != 3:
+        raise ValueError(f"Invalid colour {color}, expected three channels.")
+    return color
+
+
+def parse_classes(classes, layers):
+    """
+    Return the colour classes as a list of ``(layer, (r, g, b))``, in matching order.
+
+    :param classes: Dict mapping layer names to a colour or a list of colours.
+    :param layers: Names of the layers of the grid.
+    :raises ValueError: If a layer is unknown or a colour invalid.
+    """
+    parsed = []
+    for layer, colors in classes.items():
+        if layer not in layers:
+            raise ValueError(f"Unknown layer '{layer}', expected one of {', '.join(layers)}.")
+        if isinstance(colors, (str, int)) or (
+                len(colors) == 3 and all(isinstance(value, int) for value in colors)):
+            colors = [colors]
+        parsed.extend((layer, parse_color(color)) for color in colors)
+    return parsed
+
+
+def field_size(path, scale):
+    """Return the ``(length, width)`` in metres of the field covered by an image."""
+    pixels, _ = read_image(path)
+    return pixels.shape[1] * scale, pixels.shape[0] * scale
+
+
+def tile_edges(tiles, pixels_per_tile, size):
+    """
+    Return the first pixel of every tile lying on the image, and the pixels of each.
+
+    Tiles smaller than a pixel get one pixel each, the one under their corner.
+    """
+    starts = np.floor(np.arange(tiles + 1) * pixels_per_tile + 1e-9).astype(np.int64)
+    starts = starts[:np.searchsorted(starts, size)]
+    ends = np.minimum(np.floor((np.arange(len(starts)) + 1) * pixels_per_tile + 1e-9), size)
+    counts = np.maximum(ends.astype(np.int64) - starts, 1)
+    return starts[:tiles], counts[:tiles]
+
+
+def classify(band, colors, maxval, tolerance):
+    """
+    Return one boolean mask per layer of a band of pixels; each pixel goes to the first
+    class it matches.
+    """
+    if maxval != 255:
+        band = (band.astype(np.uint32) * 255 // maxval).astype(np.uint8)
+    band = np.asarray(band, dtype=np.int16)
+    unassigned = np.ones(band.shape[:2], dtype=bool)
+    masks = {}
+    for layer, color in colors:
+        if band.ndim == 2:
+            # Grey pixels only match colours that are near grey on every channel
+            match = np.abs(band - min(color)) <= tolerance
+            match &= np.abs(band - max(color)) <= tolerance
+        else:
+            match = (np.abs(band - np.array(color, dtype=np.int16)) <= tolerance).all(axis=2)
+        match &= unassigned
+        unassigned &= ~match
+        if layer in masks:
+            masks[layer] |= match
+        else:
+            masks[layer] = match
+    return masks
+
+
+def rasterize_image(grid, pixels, scale, classes=None, mode="any", maxval=255,
+                    tolerance=TOLERANCE, chunk_pixels=CHUNK_PIXELS):
+    """
+    Mark the tiles of ``grid`` covered by the colour classes of an image.
+
+    Parts of the image off the field are ignored. While ``grid.journal`` is set, the
+    tiles marked are recorded in it as for the other fills.
+
+    :param grid: The OccupancyGrid or QuadGrid to mark.
+    :param pixels: Image array, as returned by ``read_image``.
+    :param scale: Metres per pixel.
+    :param classes: Colours of each layer, ``DEFAULT_CLASSES`` by default.
+    :param mode: ``"any"`` or ``"majority"``, see the module docstring.
+    :param maxval: Value of a fully lit channel.
+    :param tolerance: Largest difference on any channel for a pixel to match a colour.
+    :param chunk_pixels: Pixels classified at once, which bounds the memory used.
+    :return: Number of tiles of each layer's classes.
+    :raises ValueError: If the scale, mode or classes are invalid.
+    """
+    if not scale > 0:
+        raise ValueError("The scale must be positive.")
+    if mode not in MODES:
+        raise ValueError(f"Unknown mode '{mode}', expected one of {', '.join(MODES)}.")
+    colors = parse_classes(DEFAULT_CLASSES if classes is None else classes, grid.layers)
+    height, width = pixels.shape[:2]
+    pixels_per_tile = grid.d_tassel / scale
+    column_starts, column_counts = tile_edges(grid.shape[0], pixels_per_tile, width)
+    row_starts, row_counts = tile_edges(grid.shape[1], pixels_per_tile, height)
+    marked = {layer: 0 for layer, _ in colors}
+    if not len(column_starts) or not len(row_starts):
+        return marked
+
+    column_end = column_starts[-1] + column_counts[-1]
+    band_tiles = max(1, int(chunk_pixels // (width * max(pixels_per_tile, 1))))
+    with span("rasterize_image", mode=mode, pixels=height * width) as trace:
+        for first in range(0, len(row_starts), band_tiles):
+            last = min(first + band_tiles, len(row_starts))
+            # Image rows run top to bottom, tiles bottom to top
+            bottom = row_starts[first]
+            top = row_starts[last - 1] + row_counts[last - 1]
+            band = pixels[height - top:height - bottom, :column_end][::-1]
+            for layer, mask in classify(band, colors, maxval, tolerance).items():
+                counts = np.add.reduceat(mask.view(np.uint8), row_starts[first:last] - bottom,
+                                         axis=0, dtype=np.uint32)
+                counts = np.add.reduceat(counts, column_starts, axis=1)
+                if mode == "any":
+                    tiles = counts > 0
+                else:
+                    tiles = counts * 2 > row_counts[first:last, None] * column_counts[None, :]
+                tiles = tiles.T
+                if grid.journal is not None:
+                    block = grid.block(layer, 0, len(column_starts), first, last)
+                    grid.journal.add_cells(layer, 0, first, tiles & ~block)
+                grid.write_mask(layer, 0, first, tiles)
+                marked[layer] += int(np.count_nonzero(tiles))
+        trace.count("cells", sum(marked.values()))
+    return marked
+
+
+def load_image_map(path, scale, d_tassel, length=None, width=None, classes=None, mode="any",
+                   tolerance=TOLERANCE, quadtree=None):
+    """
+    Build the grid of a field from an image file.
+
+    :param path: PNG, PGM/PPM or NPY image.
+    :param scale: Metres per pixel.
+    :param length: Length of the field, in metres; by default the image's.
+    :param width: Width of the field, in metres; by default the image's.
+    :param quadtree: Force a QuadGrid or an OccupancyGrid, see ``SetUp.quadtree.make_grid``.
+    :raises ValueError: If the image or the parameters are invalid.
+    :raises OSError: If the file cannot be read.
+    """
+    from SetUp.quadtree import make_grid
+
+    if not scale > 0:
+        raise ValueError("The scale must be positive.")
+    pixels, maxval = read_image(path)
+    if length is None:
+        length = pixels.shape[1] * scale
+    if width is None:
+        width = pixels.shape[0] * scale
+    if not (math.isfinite(length) and math.isfinite(width)) or length <= 0 or width <= 0:
+        raise ValueError("The field must have a positive size.")
+    grid = make_grid(length, width, d_tassel, quadtree)
+    rasterize_image(grid, pixels, scale, classes, mode, maxval, tolerance)
+    return grid
@@ -0,0 +1,189 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import math
+
+import numpy as np
+
+
+def rectangle_bounds(x, y, width, height, d_tassel):
+    """
+    Compute the tile index range covered by a rectangular area.
+
+    :return: ``(start_i, end_i, start_j, end_j)`` with exclusive ends.
+    """
+    start_i, start_j = round(x / d_tassel), round(y / d_tassel)
+    end_i, end_j = start_i + round(width / d_tassel), start_j + round(height / d_tassel)
+    return start_i, end_i, start_j, end_j
+
+
+def circle_bounds(x_center, y_center, radius, d_tassel, rows, cols):
+    """
+    Compute the tile index range covered by a circular area, clipped to the grid.
+
+    :return: ``(center_i, center_j, radius, start_i, end_i, start_j, end_j)`` in tiles,
+        with exclusive ends.
+    """
+    center_i, center_j = math.floor(x_center / d_tassel), math.floor(y_center / d_tassel)
+    radius = round(radius / d_tassel)
+    start_i, end_i = max(center_i - radius, 0), min(center_i + radius + 1, rows)
+    start_j, end_j = max(center_j - radius, 0), min(center_j + radius + 1, cols)
+    return center_i, center_j, radius, start_i, end_i, start_j, end_j
+
+
+def circle_mask(center_i, center_j, radius, start_i, end_i, start_j, end_j):
+    """
+    Build the boolean mask of a circle restricted to its bounding box.
+
+    :return: Array of shape ``(end_i - start_i, end_j - start_j)``.
+    """
+    di = np.arange(start_i, end_i) - center_i
+    dj = np.arange(start_j, end_j) - center_j
+    return di[:, None] ** 2 + dj[None, :] ** 2 <= radius * radius
+
+
+def rectangles_mask(start_i, end_i, start_j, end_j, rows, cols):
+    """
+    Rasterize many rectangles at once, given their tile index ranges.
+
+    The ranges are clipped to the grid, marked as corners of a 2D difference array
+    and accumulated, so the cost is one pass over the grid whatever the number of
+    rectangles.
+
+    :return: Boolean array of shape ``(rows, cols)``.
+    """
+    start_i, end_i = np.clip(start_i, 0, rows), np.clip(end_i, 0, rows)
+    start_j, end_j = np.clip(start_j, 0, cols), np.clip(end_j, 0, cols)
+    keep = (end_i > start_i) & (end_j > start_j)
+    start_i, end_i, start_j, end_j = start_i[keep], end_i[keep], start_j[keep], end_j[keep]
+    corners = np.concatenate((
+        start_i * (cols + 1) + start_j, start_i * (cols + 1) + end_j,
+        end_i * (cols + 1) + start_j, end_i * (cols + 1) + end_j,
+    ))
+    signs = np.repeat(np.array([1, -1, -1, 1], dtype=np.int32), len(start_i))
+    diff = np.bincount(corners, weights=signs, minlength=(rows + 1) * (cols + 1))
+    diff = diff.astype(np.int32).reshape(rows + 1, cols + 1)
+    return np.cumsum(np.cumsum(diff, axis=0), axis=1)[:rows, :cols] > 0
+
+
+def circles_mask(center_i, center_j, radius, rows, cols):
+    """
+    Rasterize many circles at once, with the same tiles as ``circle_mask``.
+
+    Each circle is split into one span of tiles per row; the spans are marked in a
+    row-wise difference array and accumulated.
+
+    :param center_i: Centre rows, in tiles.
+    :param center_j: Centre columns, in tiles.
+    :param radius: Radii, in tiles.
+    :return: Boolean array of shape ``(rows, cols)``.
+    """
+    center_i, center_j, radius = (np.asarray(a, dtype=np.int64) for a in (center_i, center_j, radius))
+    start_i = np.maximum(center_i - radius, 0)
+    end_i = np.minimum(center_i + radius + 1, rows)
+    counts = np.maximum(end_i - start_i, 0)
+    owner = np.repeat(np.arange(len(counts)), counts)
+    # Row of every span: start_i of its circle plus its position within the circle
+    offsets = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+    i = start_i[owner] + offsets
+    remaining = radius[owner] ** 2 - (i - center_i[owner]) ** 2
+    # Largest half-width h with h * h <= remaining, corrected for float rounding
+    half = np.floor(np.sqrt(remaining)).astype(np.int64)
+    half += (half + 1) ** 2 <= remaining
+    half -= half ** 2 > remaining
+    start_j = np.clip(center_j[owner] - half, 0, cols)
+    end_j = np.clip(center_j[owner] + half + 1, 0, cols)
+    keep = end_j > start_j
+    i, start_j, end_j = i[keep], start_j[keep], end_j[keep]
+    ends = np.concatenate((i * (cols + 1) + start_j, i * (cols + 1) + end_j))
+    signs = np.repeat(np.array([1, -1], dtype=np.int32), len(i))
+    diff = np.bincount(ends, weights=signs, minlength=rows * (cols + 1))
+    diff = diff.astype(np.int32).reshape(rows, cols + 1)
+    return np.cumsum(diff, axis=1)[:, :cols] > 0
+
+
+def rectangle_spans(start_i, end_i, start_j, end_j, rows, cols):
+    """
+    Scanline rasterizer of a rectangle given by its tile index range, clipped to the grid.
+
+    :return: Generator of ``(i, start_j, end_j)``, one span with an exclusive end per row.
+    """
+    start_j, end_j = max(start_j, 0), min(end_j, cols)
+    if end_j <= start_j:
+        return
+    for i in range(max(start_i, 0), min(end_i, rows)):
+        yield i, start_j, end_j
+
+
+def circle_spans(center_i, center_j, radius, rows, cols):
+    """
+    Scanline rasterizer of a circle given in tiles, with the same tiles as ``circle_mask``.
+
+    :return: Generator of ``(i, start_j, end_j)``, one span with an exclusive end per row.
+    """
+    for i in range(max(center_i - radius, 0), min(center_i + radius + 1, rows)):
+        half = math.isqrt(radius * radius - (i - center_i) ** 2)
+        start_j, end_j = max(center_j - half, 0), min(center_j + half + 1, cols)
+        if end_j > start_j:
+            yield i, start_j, end_j
+
+
+def mask_to_cells(mask, start_i=0, start_j=0):
+    """
+    Convert a boolean mask into an ``(n, 2)`` array of ``(i, j)`` tile indices.
+
+    Cells are returned in row-major order, ``i`` first, like the original nested loops.
+    """
+    cells = np.argwhere(mask)
+    cells[:, 0] += start_i
+    cells[:, 1] += start_j
+    return cells
+
+
+def rasterize_rectangle(x, y, width, height, d_tassel):
+    """
+    Rasterize a rectangular area given by its bottom-left corner and size in metres.
+
+    :return: ``(n, 2)`` integer array of ``(i, j)`` tile indices.
+    """
+    start_i, end_i, start_j, end_j = rectangle_bounds(x, y, width, height, d_tassel)
+    if end_i <= start_i or end_j <= start_j:
+        return np.empty((0, 2), dtype=np.int64)
+    i, j = np.meshgrid(
+        np.arange(start_i, end_i), np.arange(start_j, end_j), indexing="ij"
+    )
+    return np.column_stack((i.ravel(), j.ravel()))
+
+
+def rasterize_circle(x_center, y_center, radius, d_tassel, length, width):
+    """
+    Rasterize a circular area on a ``length`` x ``width`` field.
+
+    Only the tiles inside the circle's bounding box are tested.
+
+    :return: ``(n, 2)`` integer array of ``(i, j)`` tile indices.
+    """
+    rows, cols = int(length / d_tassel), int(width / d_tassel)
+    center_i, center_j, radius, start_i, end_i, start_j, end_j = circle_bounds(
+        x_center, y_center, radius, d_tassel, rows, cols
+    )
+    if end_i <= start_i or end_j <= start_j:
+        return np.empty((0, 2), dtype=np.int64)
+    mask = circle_mask(center_i, center_j, radius, start_i, end_i, start_j, end_j)
+    return mask_to_cells(mask, start_i, start_j)
+
+
+def cells_to_tuples(cells):
+    """Convert an ``(n, 2)`` cell array into the list of tuples stored in ``objects_data``."""
+    return list(map(tuple, cells.tolist()))
@@ -0,0 +1,366 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Store of simulator results, so that a configuration already simulated is not run again.
+
+``produce_json`` writes the fingerprint of the configuration next to the ``data_file``:
+a hash of the robot, simulator and environment sections in canonical form (the layers
+of a drawn map rather than the way they were exported), of the content of the ``algo``
+plugin file, if any, and of what tells the run apart from others of the same
+configuration, such as the repetitions of a shard. When a run succeeds in a directory
+the setup tool created for it (see ``make_run_dir``), the files it
+wrote in its directory and the output it logged, whether to a log file or to the caller
+reading it, as the wizard's run window does, are stored under that fingerprint, the
+simulator's entry point and the ``maps.npz`` generated for the run, if any; the next
+run of the same configuration with the same simulator restores them instead of running
+it. A data file changed after it was written has no valid fingerprint and is always
+run, and so is a run in any other directory, such as the one the tool was started from.
+
+The store lives in ``$SETUP_RESULT_STORE`` (``~/.cache/setupsmarters/results`` by
+default, ``off`` disables it), is limited to ``$SETUP_RESULT_STORE_MB`` megabytes with
+least-recently-used eviction, and only the simulator's entry script is hashed: after
+changing its other modules, run ``python -m SetUp.result_store clear``, or
+``invalidate FINGERPRINT`` for a single configuration.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import zipfile
+
+from SetUp.data_classes import ConfigEncoder
+from SetUp.lru_directory import LRUDirectory, env_settings, main as lru_main
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser("~"), ".cache", "setupsmarters", "results")
+DEFAULT_MAX_MB = 1024
+FINGERPRINT_FILE = "data_file.fingerprint"
+# Random maps generated next to the data file, an input of the run as well
+MAPS_FILE = "maps.npz"
+# Marks a run directory created by the setup tool, the only ones whose results are stored
+RUN_DIR_FILE = ".setupsmarters_run"
+OUTPUT_NAME = "output"
+ERRORS_NAME = "errors"
+FILES_PREFIX = "files/"
+
+
+def canonical(value):
+    """Return ``value`` with integral floats turned into ints, so ``60.0`` hashes as ``60``."""
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {key: canonical(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+def file_digest(path):
+    """Return the SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as hashed_file:
+        for block in iter(lambda: hashed_file.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def config_fingerprint(data, run=None):
+    """
+    Return the fingerprint of a configuration.
+
+    :param data: Robot, simulator and environment configurations, as for ``produce_json``.
+    :param run: What tells this run apart from others of the same configuration, if anything.
+    """
+    robot, simulator, env = data
+    digest = hashlib.sha256()
+    sections = json.loads(json.dumps({"robot": robot, "simulator": simulator, "run": run}, cls=ConfigEncoder))
+    if hasattr(env, "layers"):
+        sections["env"] = {
+            "length": env.length, "width": env.width, "d_tassel": env.d_tassel,
+            "shape": list(env.shape), "layers": sorted(env.layers),
+        }
+    else:
+        sections["env"] = json.loads(json.dumps(env, cls=ConfigEncoder))
+    if robot.algo and os.path.isfile(robot.algo):
+        sections["algo_sha256"] = file_digest(robot.algo)
+    digest.update(json.dumps(canonical(sections), sort_keys=True, separators=(",", ":")).encode("utf-8"))
+    if hasattr(env, "layers"):
+        arrays = env.encoded() if hasattr(env, "encoded") else {name: env.packed(name) for name in env.layers}
+        for name in sorted(arrays):
+            digest.update(name.encode("utf-8"))
+            digest.update(arrays[name].tobytes())
+    return digest.hexdigest()
+
+
+def write_fingerprint(data, data_path, run=None):
+    """Write the fingerprint of ``data`` and ``run`` next to the data file it was written to."""
+    stat = os.stat(data_path)
+    record = {
+        "fingerprint": config_fingerprint(data, run),
+        "data_file": os.path.basename(data_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+    with open(os.path.join(os.path.dirname(data_path), FINGERPRINT_FILE), "w") as fingerprint_file:
+        json.dump(record, fingerprint_file)
+    return record["fingerprint"]
+
+
+def read_fingerprint(run_dir):
+    """Return the fingerprint of the data file of ``run_dir``, or None if it has none or changed since."""
+    try:
+        with open(os.path.join(run_dir, FINGERPRINT_FILE), "r") as fingerprint_file:
+            record = json.load(fingerprint_file)
+        stat = os.stat(os.path.join(run_dir, record["data_file"]))
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    if (stat.st_size, stat.st_mtime_ns) != (record["size"], record["mtime_ns"]):
+        return None
+    return record["fingerprint"]
+
+
+def make_run_dir(run_dir):
+    """
+    Create a run directory and mark it as created by the setup tool, so that its results
+    are stored; an existing directory is only marked if it is empty.
+
+    :return: The path of the directory.
+    """
+    if not os.path.isdir(run_dir) or not os.listdir(run_dir):
+        os.makedirs(run_dir, exist_ok=True)
+        open(os.path.join(run_dir, RUN_DIR_FILE), "a").close()
+    return run_dir
+
+
+def is_run_dir(run_dir):
+    """Return whether ``run_dir`` was created by ``make_run_dir``."""
+    return os.path.isfile(os.path.join(run_dir, RUN_DIR_FILE))
+
+
+def snapshot(run_dir):
+    """
+    Return the size and modification time of every file under ``run_dir``, by relative
+    path; hidden files and directories, such as those of version control, are left out.
+    """
+    files = {}
+    for directory, subdirectories, names in os.walk(run_dir):
+        subdirectories[:] = [name for name in subdirectories if not name.startswith(".")]
+        for name in names:
+            if name.startswith("."):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[os.path.relpath(path, run_dir)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def output_file(stream):
+    """
+    Return the path of the file a run's standard output goes to, ``os.devnull`` when it
+    is discarded, or None when it cannot be read back.
+
+    :param stream: Standard output of the run, as ``subprocess.run`` takes it.
+    """
+    if stream == subprocess.DEVNULL:
+        return os.devnull
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return os.path.abspath(name)
+    return None
+
+
+def replay_output(output, stream, inherited=None):
+    """
+    Write the stored output of a run to where it would have gone.
+
+    :param stream: Standard output or error of the run, as ``subprocess.run`` takes it.
+    :param inherited: This process's stream used when ``stream`` is None, ``sys.stdout``
+        by default.
+    """
+    if stream == subprocess.DEVNULL or not output:
+        return
+    if stream is None:
+        inherited = inherited or sys.stdout
+        inherited.flush()
+        fd = inherited.fileno()
+    elif isinstance(stream, int):
+        fd = stream
+    else:
+        stream.flush()
+        fd = stream.fileno()
+    os.write(fd, output)
+
+
+class Recording:
+    """
+    A run being watched, to store what it writes once it succeeds.
+    """
+
+    def __init__(self, store, entry_path, run_dir, output_path):
+        self.store = store
+        self.entry_path = entry_path
+        self.run_dir = run_dir
+        # None when the caller reads the output and passes it to finish
+        self.output_path = output_path
+        self.output_start = os.path.getsize(output_path) if output_path not in (None, os.devnull) else 0
+        self.before = snapshot(run_dir)
+
+    def output(self):
+        """Return what the run appended to its standard output file."""
+        if self.output_path in (None, os.devnull):
+            return b""
+        with open(self.output_path, "rb") as output_file:
+            output_file.seek(self.output_start)
+            return output_file.read()
+
+    def finish(self, output=None, errors=b""):
+        """
+        Store the files the run created or changed and its output, unless they do not fit
+        in the store.
+
+        :param output: Standard output of the run, when the caller read it; by default it
+            is read back from the file it went to.
+        :param errors: Standard error of the run, when the caller read it separately.
+        """
+        output = self.output() if output is None else output
+        skipped = {FINGERPRINT_FILE}
+        if self.output_path is not None:
+            skipped.add(os.path.relpath(self.output_path, self.run_dir))
+        changed = [
+            relative for relative, state in snapshot(self.run_dir).items()
+            if self.before.get(relative) != state and relative not in skipped
+        ]
+        size = len(output) + len(errors)
+        size += sum(os.path.getsize(os.path.join(self.run_dir, path)) for path in changed)
+        if size > self.store.max_bytes:
+            return
+
+        def write(entry_file):
+            with zipfile.ZipFile(entry_file, "w", zipfile.ZIP_DEFLATED) as entry:
+                entry.writestr(OUTPUT_NAME, output)
+                if errors:
+                    entry.writestr(ERRORS_NAME, errors)
+                for relative in changed:
+                    entry.write(os.path.join(self.run_dir, relative), FILES_PREFIX + relative)
+
+        self.store.write_entry(self.entry_path, write)
+
+
+class ResultStore(LRUDirectory):
+    """
+    On-disk LRU store of simulator results, keyed by configuration fingerprint.
+    """
+    suffix = ".zip"
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=DEFAULT_MAX_MB * 2 ** 20, enabled=True):
+        """
+        Initialize the ResultStore.
+
+        :param directory: Where the results are stored.
+        :param max_bytes: Size above which the least recently used results are evicted.
+        :param enabled: When False, every lookup misses and nothing is stored.
+        """
+        super().__init__(directory, max_bytes, enabled)
+
+    def entry_path(self, path_smarters, run_dir):
+        """Return where the result of running ``path_smarters`` in ``run_dir`` is stored, or None."""
+        if not self.enabled or not os.path.isfile(path_smarters) or not is_run_dir(run_dir):
+            return None
+        fingerprint = read_fingerprint(run_dir)
+        if fingerprint is None:
+            return None
+        inputs = [os.path.abspath(path_smarters), file_digest(path_smarters)]
+        maps_path = os.path.join(run_dir, MAPS_FILE)
+        if os.path.isfile(maps_path):
+            inputs.append(file_digest(maps_path))
+        key = hashlib.sha256("\n".join(inputs).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, fingerprint, key + ".zip")
+
+    def restore(self, path_smarters, run_dir):
+        """
+        Restore the stored result of running ``path_smarters`` in ``run_dir``.
+
+        :return: ``(output, errors)``, the standard output logged by the run and its
+            standard error when it was stored apart, or None on a miss.
+        """
+        path = self.entry_path(path_smarters, run_dir)
+        if path is None:
+            return None
+        try:
+            with zipfile.ZipFile(path) as entry:
+                output = entry.read(OUTPUT_NAME)
+                errors = entry.read(ERRORS_NAME) if ERRORS_NAME in entry.namelist() else b""
+                for name in entry.namelist():
+                    if name.startswith(FILES_PREFIX):
+                        target = os.path.join(run_dir, name[len(FILES_PREFIX):])
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        with entry.open(name) as source, open(target, "wb") as copy:
+                            copy.write(source.read())
+            # Mark the result as recently used
+            os.utime(path)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            return None
+        self.count(hit=True)
+        return output, errors
+
+    def record(self, path_smarters, run_dir, stdout=None):
+        """
+        Start watching a run of ``path_smarters`` in ``run_dir``.
+
+        :param stdout: Standard output of the run, as ``subprocess.run`` takes it; only a
+            named file, ``subprocess.DEVNULL`` or ``subprocess.PIPE``, when the caller
+            passes what it read to ``Recording.finish``, can be stored.
+        :return: A Recording to ``finish`` once the run succeeded, or None if the run
+            cannot be stored.
+        """
+        output_path = None if stdout == subprocess.PIPE else output_file(stdout)
+        if output_path is None and stdout != subprocess.PIPE:
+            return None
+        path = self.entry_path(path_smarters, run_dir)
+        if path is None:
+            return None
+        self.count(hit=False)
+        return Recording(self, path, run_dir, output_path)
+
+    def invalidate(self, fingerprint):
+        """Remove the stored results of one configuration, with any simulator."""
+        directory = os.path.join(self.directory, fingerprint)
+        self.remove([path for _, _, path in self.entries() if os.path.dirname(path) == directory])
+        if os.path.isdir(directory) and not os.listdir(directory):
+            os.rmdir(directory)
+
+
+def default_store():
+    """Return the store configured by ``$SETUP_RESULT_STORE`` and ``$SETUP_RESULT_STORE_MB``."""
+    directory, max_bytes, enabled = env_settings(
+        "SETUP_RESULT_STORE", "SETUP_RESULT_STORE_MB", DEFAULT_DIRECTORY, DEFAULT_MAX_MB,
+    )
+    return ResultStore(directory, max_bytes, enabled=enabled)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    store = default_store()
+    if len(argv) == 2 and argv[0] == "invalidate":
+        store.invalidate(argv[1])
+        return 0
+    return lru_main(store, argv, "python -m SetUp.result_store {stats,clear,invalidate FINGERPRINT}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import bisect
+import json
+import os
+
+from SetUp.data_classes import RobotConfig
+from SetUp.export import resource_path
+
+ROBOTS_FILE = "robots.json"
+# Numeric attributes of a robot that can be queried by range, and their robots.json keys
+ATTRIBUTES = {"speed": "speed", "cut_diameter": "cut diameter", "autonomy": "autonomy"}
+
+
+class RobotCatalog:
+    """
+    Predefined robots of ``robots.json``, indexed by id and by numeric attribute.
+
+    The file is parsed once and parsed again only when its modification time changes.
+    """
+
+    def __init__(self, path=None):
+        """
+        Initialize the RobotCatalog.
+
+        :param path: Path of the robots file, ``robots.json`` of the project by default.
+        """
+        self.path = path or resource_path(ROBOTS_FILE)
+        self._mtime = None
+        self._robots = []
+        self._by_id = {}
+        self._sorted = {}
+
+    def refresh(self):
+        """Parse the robots file again if it changed since it was last read."""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with open(self.path, "r") as robots_file:
+            robots = json.load(robots_file)["robots"]["robot"]
+        self._robots = robots
+        self._by_id = {robot["id"]: robot for robot in robots}
+        # For each attribute, the (value, position) pairs sorted by value
+        self._sorted = {
+            name: sorted((float(robot[key]), index) for index, robot in enumerate(robots))
+            for name, key in ATTRIBUTES.items()
+        }
+        self._mtime = mtime
+
+    def ids(self):
+        """Return the robot ids, in file order."""
+        self.refresh()
+        return [robot["id"] for robot in self._robots]
+
+    def get(self, robot_id):
+        """
+        Return the robots.json entry of a robot.
+
+        :raises ValueError: If there is no robot with this id.
+        """
+        self.refresh()
+        try:
+            return self._by_id[robot_id]
+        except KeyError:
+            raise ValueError(f"Unknown robot type '{robot_id}'.") from None
+
+    def query(self, **ranges):
+        """
+        Return the robots whose attributes fall in the given inclusive ranges.
+
+        :param ranges: ``speed``, ``cut_diameter`` and/or ``autonomy`` as ``(low, high)``
+            pairs; either bound may be None.
+        :return: The matching robots.json entries, in file order.
+        :raises ValueError: If an attribute cannot be queried.
+        """
+        self.refresh()
+        matches = None
+        for name, (low, high) in ranges.items():
+            if name not in ATTRIBUTES:
+                raise ValueError(f"Robots cannot be queried by '{name}'.")
+            values = self._sorted[name]
+            start = 0 if low is None else bisect.bisect_left(values, (float(low), -1))
+            end = len(values) if high is None else bisect.bisect_right(values, (float(high), len(values)))
+            found = {index for _, index in values[start:end]}
+            matches = found if matches is None else matches & found
+        if matches is None:
+            return list(self._robots)
+        return [self._robots[index] for index in sorted(matches)]
+
+    def robot_config(self, robot_id, cutting_mode="", algo="", guide_lines=2):
+        """Build the RobotConfig of a predefined robot."""
+        robot_info = self.get(robot_id)
+        return RobotConfig(
+            type=robot_id,
+            cutting_mode=cutting_mode,
+            speed=float(robot_info["speed"]),
+            cutting_diameter=float(robot_info["cut diameter"]),
+            autonomy=int(robot_info["autonomy"]),
+            guide_lines=guide_lines,
+            algo=algo,
+        )
+
+
+_catalogs = {}
+
+
+def get_catalog(path=None):
+    """Return the shared RobotCatalog of a robots file, ``robots.json`` by default."""
+    path = path or resource_path(ROBOTS_FILE)
+    if path not in _catalogs:
+        _catalogs[path] = RobotCatalog(path)
+    return _catalogs[path]
@@ -0,0 +1,210 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Bulk import of obstacles, isolated areas and openings.
+
+Three file formats are read, all in metres:
+
+- CSV with a header row: a ``kind`` column (``square``, ``circle``, ``isolated_area`` or
+  ``opening``) and the geometry columns ``x, y, width, height`` for rectangles or
+  ``x_center, y_center, radius`` for circles. Isolated areas also take a ``shape``
+  column, ``Square`` (the default) or ``Circle``.
+- JSON: a list of shape dicts as accepted by ``OccupancyGrid.add_shape``, or an object
+  with such a ``shapes`` list, e.g. the ``env`` section of a ``SetUp.cli`` spec.
+- GeoJSON-like feature collections: ``Point`` features with a ``radius`` property
+  become circles, axis-aligned rectangular ``Polygon`` features become rectangles, and
+  the ``kind`` property tells what they are (``circle`` and ``square`` by default).
+"""
+
+import csv
+import json
+import math
+import os
+
+from SetUp.occupancy import shape_parts
+
+KINDS = ("square", "circle", "isolated_area", "opening")
+RECTANGLE_FIELDS = ("x", "y", "width", "height")
+CIRCLE_FIELDS = ("x_center", "y_center", "radius")
+# Number of problems listed in the error raised by validate_shapes
+MAX_REPORTED = 20
+
+
+def read_csv(path):
+    """Read the shapes of a CSV file, as dicts of strings keyed by column name."""
+    with open(path, "r", newline="") as shapes_file:
+        return [
+            {key.strip(): value.strip() for key, value in row.items() if key and value and value.strip()}
+            for row in csv.DictReader(shapes_file)
+        ]
+
+
+def polygon_rectangle(coordinates):
+    """
+    Return ``(x, y, width, height)`` of a polygon ring that is an axis-aligned rectangle.
+
+    :raises ValueError: If the ring is any other polygon.
+    """
+    ring = [tuple(map(float, point[:2])) for point in coordinates[0]]
+    xs, ys = sorted({x for x, _ in ring}), sorted({y for _, y in ring})
+    corners = {(x, y) for x in xs for y in ys}
+    if len(xs) != 2 or len(ys) != 2 or set(ring) != corners:
+        raise ValueError("only axis-aligned rectangular polygons are supported")
+    return xs[0], ys[0], xs[1] - xs[0], ys[1] - ys[0]
+
+
+def feature_shape(feature):
+    """Convert a GeoJSON-like feature into a shape dict."""
+    geometry = feature.get("geometry") or {}
+    properties = dict(feature.get("properties") or {})
+    kind = properties.pop("kind", None)
+    if geometry.get("type") == "Point":
+        x_center, y_center = geometry["coordinates"][:2]
+        shape = dict(properties, kind=kind or "circle", x_center=x_center, y_center=y_center)
+        if shape["kind"] == "isolated_area":
+            shape["shape"] = "Circle"
+        return shape
+    if geometry.get("type") == "Polygon":
+        x, y, width, height = polygon_rectangle(geometry["coordinates"])
+        shape = dict(properties, kind=kind or "square", x=x, y=y, width=width, height=height)
+        if shape["kind"] == "isolated_area":
+            shape["shape"] = "Square"
+        return shape
+    raise ValueError(f"unsupported geometry type {geometry.get('type')!r}")
+
+
+def read_json(path):
+    """Read the shapes of a JSON or GeoJSON-like file."""
+    with open(path, "r") as shapes_file:
+        data = json.load(shapes_file)
+    if isinstance(data, dict) and data.get("type") == "FeatureCollection":
+        # Features that cannot be converted are passed on, to be reported by validate_shapes
+        shapes = []
+        for feature in data.get("features", []):
+            try:
+                shapes.append(feature_shape(feature))
+            except (KeyError, TypeError, ValueError) as e:
+                shapes.append({"kind": "invalid", "error": str(e)})
+        return shapes
+    if isinstance(data, dict):
+        data = data.get("shapes")
+    if not isinstance(data, list):
+        raise ValueError(f"'{path}' has no list of shapes.")
+    return data
+
+
+def read_shapes(path):
+    """
+    Read the shape definitions of a file, choosing the format by extension.
+
+    :return: List of shape dicts, not validated yet.
+    """
+    if os.path.splitext(path)[1].lower() == ".csv":
+        return read_csv(path)
+    return read_json(path)
+
+
+def normalize_shape(raw):
+    """
+    Check one shape definition and convert its numbers.
+
+    :return: The shape dict accepted by ``OccupancyGrid.add_shape``.
+    :raises ValueError: Describing the first problem found.
+    """
+    if not isinstance(raw, dict):
+        raise ValueError("not an object")
+    if "error" in raw:
+        raise ValueError(raw["error"])
+    kind = raw.get("kind")
+    if kind not in KINDS:
+        raise ValueError(f"unknown kind {kind!r}, expected one of {', '.join(KINDS)}")
+    if kind == "isolated_area":
+        area_shape = raw.get("shape", "Square")
+        if area_shape not in ("Square", "Circle"):
+            raise ValueError(f"unknown isolated area shape {area_shape!r}")
+    else:
+        area_shape = None
+    is_circle = kind == "circle" or area_shape == "Circle"
+
+    shape = {"kind": kind}
+    if area_shape:
+        shape["shape"] = area_shape
+    for name in CIRCLE_FIELDS if is_circle else RECTANGLE_FIELDS:
+        if name not in raw:
+            raise ValueError(f"missing {name}")
+        try:
+            value = float(raw[name])
+        except (TypeError, ValueError):
+            raise ValueError(f"{name} is not a number: {raw[name]!r}") from None
+        if not math.isfinite(value):
+            raise ValueError(f"{name} is not finite")
+        shape[name] = value
+    for name in ("radius",) if is_circle else ("width", "height"):
+        if shape[name] <= 0:
+            raise ValueError(f"{name} must be positive")
+    if kind == "isolated_area" and raw.get("opening"):
+        if not isinstance(raw["opening"], dict):
+            raise ValueError("opening is not an object")
+        opening = normalize_shape(dict(raw["opening"], kind="opening"))
+        del opening["kind"]
+        shape["opening"] = opening
+    return shape
+
+
+def validate_shapes(shapes, length=None, width=None):
+    """
+    Check every shape definition, so that all the problems are reported at once.
+
+    :param length: Length of the field; when given with ``width``, shapes must lie on it.
+    :return: The list of normalized shape dicts.
+    :raises ValueError: Listing the first ``MAX_REPORTED`` problems, by shape number.
+    """
+    valid, errors = [], []
+    for number, raw in enumerate(shapes, start=1):
+        try:
+            shape = normalize_shape(raw)
+            if length is not None and width is not None:
+                for _, kind, params in shape_parts(shape):
+                    x0, y0, x1, y1 = (
+                        (params[0], params[1], params[0] + params[2], params[1] + params[3])
+                        if kind == "rectangle" else
+                        (params[0] - params[2], params[1] - params[2], params[0] + params[2], params[1] + params[2])
+                    )
+                    if x0 < 0 or y0 < 0 or x1 > length or y1 > width:
+                        raise ValueError(f"lies outside the {length:g} x {width:g} field")
+        except ValueError as e:
+            errors.append(f"shape {number}: {e}")
+        else:
+            valid.append(shape)
+    if errors:
+        more = f"\n... and {len(errors) - MAX_REPORTED} more" if len(errors) > MAX_REPORTED else ""
+        raise ValueError(
+            f"{len(errors)} invalid shape(s):\n" + "\n".join(errors[:MAX_REPORTED]) + more
+        )
+    return valid
+
+
+def load_shapes(path, length=None, width=None):
+    """
+    Read and validate the shapes of a CSV, JSON or GeoJSON-like file.
+
+    :return: The list of shape dicts, ready for ``OccupancyGrid.add_shapes``.
+    :raises ValueError: If the file or any shape is invalid.
+    :raises OSError: If the file cannot be read.
+    """
+    try:
+        shapes = read_shapes(path)
+    except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError(f"Could not read '{path}': {e}") from None
+    return validate_shapes(shapes, length, width)
@@ -0,0 +1,440 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Sharded runs: spread the maps and repetitions of one configuration over concurrent
+SMARTERS processes.
+
+The ``num_maps`` x ``repetitions`` space is split into at most ``shards`` blocks, by
+maps first and then by repetitions when there are more shards than maps. Each shard
+gets its own directory under the output directory with a ``data_file`` whose
+SimulatorConfig only counts its maps and repetitions and, for the ranges of an
+EnvConfig, a ``maps.npz`` with its maps. Map seeds are derived from the same base seed
+as an unsharded run, so together the shards run exactly the same maps.
+
+The state of every shard is kept in ``shards.json``; running the same job again in the
+same directory only launches the shards that have not finished. Once all are done,
+the files the simulator wrote in the shard directories are merged into ``results/``:
+
+- CSV files with the same header in every shard are concatenated,
+- JSON files holding a list are concatenated into one list,
+- any other file is copied to ``results/shard_<index>/``.
+
+Merged rows and records are prefixed with the ``shard``, ``first_map`` and
+``first_repetition`` they come from, so that shard-relative map and repetition numbers
+can be made global. ``results/index.json`` lists the shards and what was merged.
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, replace
+
+from SetUp.cli import apply_overrides, build_configs, load_spec
+from SetUp.data_classes import EnvConfig
+from SetUp.export import DATA_FILES, EXPORT_FORMATS, produce_json
+from SetUp.launcher import available_cores, run_second_program
+from SetUp.map_cache import cache_key
+from SetUp.result_store import FINGERPRINT_FILE, RUN_DIR_FILE, make_run_dir
+from SetUp.worker_pool import pool_settings
+
+MANIFEST = "shards.json"
+LOG_FILE = "smarters.log"
+MAPS_FILE = "maps.npz"
+RESULTS_DIR = "results"
+# Columns and keys added to the merged rows and records
+ORIGIN_FIELDS = ("shard", "first_map", "first_repetition")
+
+
+@dataclass
+class Shard:
+    """
+    One process of a sharded run: ``num_maps`` maps from ``first_map``, each repeated
+    ``repetitions`` times from ``first_repetition``.
+    """
+    index: int
+    first_map: int
+    num_maps: int
+    first_repetition: int
+    repetitions: int
+    run_dir: str
+    status: str = "pending"
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: str = ""
+
+
+def split(total, parts):
+    """Split ``range(total)`` into ``parts`` contiguous ``(start, count)`` blocks of near equal size."""
+    if total <= 0:
+        return [(0, total)]
+    parts = max(1, min(parts, total))
+    size, extra = divmod(total, parts)
+    blocks, start = [], 0
+    for part in range(parts):
+        count = size + (part < extra)
+        blocks.append((start, count))
+        start += count
+    return blocks
+
+
+def plan_shards(num_maps, repetitions, output_dir, shards=None):
+    """
+    Split the maps and repetitions of a run into shards.
+
+    :param num_maps: Maps of the run; when zero, as for a drawn map, only the
+        repetitions are split.
+    :param shards: Maximum number of shards, by default the number of available cores.
+    :return: List of Shard, each in its own directory under ``output_dir``.
+    """
+    shards = max(1, shards or available_cores())
+    map_blocks = split(num_maps, shards)
+    repetition_blocks = split(repetitions, max(1, shards // len(map_blocks)))
+    return [
+        Shard(index, first_map, maps, first_repetition, count,
+              os.path.join(output_dir, f"shard_{index:04d}"))
+        for index, ((first_map, maps), (first_repetition, count)) in enumerate(
+            (maps, reps) for maps in map_blocks for reps in repetition_blocks
+        )
+    ]
+
+
+def input_files(export_format):
+    """Return the files of a shard directory written by the setup tool rather than the simulator."""
+    return {DATA_FILES[export_format], FINGERPRINT_FILE, MAPS_FILE, LOG_FILE, RUN_DIR_FILE}
+
+
+def shard_outputs(shard, export_format):
+    """Return the paths, relative to the shard directory, of the files the simulator wrote."""
+    inputs = input_files(export_format)
+    outputs = []
+    for directory, _, names in os.walk(shard.run_dir):
+        for name in names:
+            relative = os.path.relpath(os.path.join(directory, name), shard.run_dir)
+            if relative not in inputs:
+                outputs.append(relative)
+    return sorted(outputs)
+
+
+def clear_outputs(shard, export_format):
+    """Remove what an interrupted run of a shard left behind."""
+    for relative in shard_outputs(shard, export_format):
+        os.remove(os.path.join(shard.run_dir, relative))
+    log_path = os.path.join(shard.run_dir, LOG_FILE)
+    if os.path.exists(log_path):
+        os.remove(log_path)
+
+
+def write_shard(configs, shard, export_format="json", seed=0, workers=None):
+    """
+    Write the configuration of a shard in its directory.
+
+    :param configs: Robot, simulator and environment configurations of the whole run.
+    :param seed: Base seed of the random maps.
+    :param workers: Maximum worker processes generating the maps.
+    """
+    from SetUp.mapgen import generate_bundle
+
+    robot, simulator, env = configs
+    make_run_dir(shard.run_dir)
+    if isinstance(env, EnvConfig):
+        simulator = replace(simulator, num_maps=shard.num_maps)
+    simulator = replace(simulator, repetitions=shard.repetitions)
+    # The repetitions of a shard are runs of their own, not to be reused for another shard's
+    run = {"first_map": shard.first_map, "first_repetition": shard.first_repetition}
+    produce_json(
+        [robot, simulator, env], export_format, os.path.join(shard.run_dir, DATA_FILES[export_format]), run=run,
+    )
+    if isinstance(env, EnvConfig) and shard.num_maps > 0:
+        generate_bundle(
+            robot, simulator, env, os.path.join(shard.run_dir, MAPS_FILE), seed, workers,
+            first_map=shard.first_map,
+        )
+
+
+def execute_shard(shard, path_smarters, export_format="json", retries=1, timeout=None):
+    """
+    Run SMARTERS in the directory of a shard, retrying a failed or timed out run up to
+    ``retries`` more times.
+
+    :return: The shard, with its status, attempts, elapsed time and last error.
+    """
+    start = time.perf_counter()
+    shard.status = "failed"
+    for _ in range(retries + 1):
+        shard.attempts += 1
+        clear_outputs(shard, export_format)
+        with open(os.path.join(shard.run_dir, LOG_FILE), "a") as log:
+            try:
+                run_second_program(
+                    path_smarters, cwd=shard.run_dir,
+                    stdout=log, stderr=subprocess.STDOUT, timeout=timeout,
+                )
+            except FileNotFoundError as e:
+                shard.error = str(e)
+                continue
+        shard.status, shard.error = "done", ""
+        break
+    shard.elapsed += time.perf_counter() - start
+    return shard
+
+
+def job_key(spec, shards, export_format, seed):
+    """Return the hash identifying a sharded job, checked when it is resumed."""
+    return cache_key("shards", spec=spec, shards=shards, export_format=export_format, seed=seed)
+
+
+def write_manifest(output_dir, key, shards):
+    """Record the state of every shard in ``shards.json``, replacing it atomically."""
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w") as manifest:
+        json.dump({"key": key, "shards": [asdict(shard) for shard in shards]}, manifest, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(output_dir, key):
+    """
+    Return the shards recorded in ``shards.json``, or None if there is none.
+
+    :raises ValueError: If the manifest belongs to another job.
+    """
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as manifest:
+        state = json.load(manifest)
+    if state.get("key") != key:
+        raise ValueError(
+            f"'{output_dir}' holds the shards of another job; use another output directory."
+        )
+    return [Shard(**shard) for shard in state["shards"]]
+
+
+def run_shards(spec, path_smarters, output_dir, shards=None, workers=None, retries=1,
+               export_format="json", timeout=None, seed=0):
+    """
+    Run SMARTERS over the maps and repetitions of a spec, split into concurrent shards.
+
+    Shards recorded as done in ``output_dir`` by an earlier, interrupted call are not
+    run again. The results are merged once every shard is done.
+
+    :param spec: Spec dict, see ``SetUp.cli``.
+    :param path_smarters: Simulator entry point, or None to only write the configs.
+    :param shards: Maximum number of shards, by default the number of available cores.
+    :param workers: Maximum concurrent runs, by default the number of available cores.
+    :param retries: Extra attempts for a failed run.
+    :param timeout: Seconds after which a run is killed and counted as failed.
+    :param seed: Base seed of the random maps.
+    :return: The list of Shard.
+    :raises ValueError: If the spec or the worker pool settings are invalid, or
+        ``output_dir`` holds another job.
+    """
+    if path_smarters is not None:
+        if not os.path.exists(path_smarters):
+            raise FileNotFoundError(f"The file '{path_smarters}' does not exist.")
+        path_smarters = os.path.abspath(path_smarters)
+        # Reject invalid worker pool settings once, before any run is attempted
+        pool_settings()
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    shards = max(1, shards or available_cores())
+    key = job_key(spec, shards, export_format, seed)
+
+    configs = build_configs(spec)
+    planned = read_manifest(output_dir, key)
+    if planned is None:
+        simulator = configs[1]
+        num_maps = simulator.num_maps if isinstance(configs[2], EnvConfig) else 0
+        planned = plan_shards(num_maps, simulator.repetitions, output_dir, shards)
+    pending = [shard for shard in planned if shard.status != "done"]
+    for shard in pending:
+        shard.status = "pending"
+        write_shard(configs, shard, export_format, seed, workers)
+    write_manifest(output_dir, key, planned)
+    if path_smarters is None:
+        for shard in pending:
+            shard.status = "configured"
+        write_manifest(output_dir, key, planned)
+        return planned
+
+    if pending:
+        workers = max(1, min(workers or available_cores(), len(pending)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(execute_shard, shard, path_smarters, export_format, retries, timeout)
+                for shard in pending
+            ]
+            for future in as_completed(futures):
+                future.result()
+                write_manifest(output_dir, key, planned)
+    if all(shard.status == "done" for shard in planned):
+        merge_results(output_dir, planned, export_format)
+    return planned
+
+
+def merge_csv(paths, origins, destination):
+    """
+    Concatenate CSV files sharing the same header, prefixing every row with its origin.
+
+    :return: False, writing nothing, if the headers differ.
+    """
+    headers = []
+    for path in paths:
+        with open(path, "r", newline="") as csv_file:
+            headers.append(next(csv.reader(csv_file), []))
+    if any(header != headers[0] for header in headers):
+        return False
+    with open(destination, "w", newline="") as merged:
+        writer = csv.writer(merged)
+        writer.writerow(list(ORIGIN_FIELDS) + headers[0])
+        for path, origin in zip(paths, origins):
+            with open(path, "r", newline="") as csv_file:
+                reader = csv.reader(csv_file)
+                next(reader, None)
+                for row in reader:
+                    writer.writerow(list(origin) + row)
+    return True
+
+
+def merge_json(paths, origins, destination):
+    """
+    Concatenate JSON files holding lists; object records get their origin keys added.
+
+    :return: False, writing nothing, if any file holds something else than a list.
+    """
+    records = []
+    for path, origin in zip(paths, origins):
+        try:
+            with open(path, "r") as json_file:
+                data = json.load(json_file)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return False
+        if not isinstance(data, list):
+            return False
+        for record in data:
+            if isinstance(record, dict):
+                record = {**dict(zip(ORIGIN_FIELDS, origin)), **record}
+            records.append(record)
+    with open(destination, "w") as merged:
+        json.dump(records, merged)
+    return True
+
+
+def merge_results(output_dir, shards, export_format="json"):
+    """
+    Merge the files the simulator wrote in the shard directories into ``results/``,
+    see the module docstring.
+
+    :return: Dict mapping each relative path to how it was merged, ``"concatenated"``
+        or ``"copied"``.
+    """
+    results = os.path.join(output_dir, RESULTS_DIR)
+    if os.path.isdir(results):
+        shutil.rmtree(results)
+    os.makedirs(results)
+    outputs = {shard.index: shard_outputs(shard, export_format) for shard in shards}
+    found = {}
+    for shard in shards:
+        for relative in outputs[shard.index]:
+            found.setdefault(relative, []).append(shard)
+
+    merged = {}
+    for relative, sources in sorted(found.items()):
+        paths = [os.path.join(shard.run_dir, relative) for shard in sources]
+        origins = [(shard.index, shard.first_map, shard.first_repetition) for shard in sources]
+        destination = os.path.join(results, relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        extension = os.path.splitext(relative)[1].lower()
+        if extension == ".csv" and merge_csv(paths, origins, destination):
+            merged[relative] = "concatenated"
+        elif extension == ".json" and merge_json(paths, origins, destination):
+            merged[relative] = "concatenated"
+        else:
+            for shard, path in zip(sources, paths):
+                copy = os.path.join(results, f"shard_{shard.index:04d}", relative)
+                os.makedirs(os.path.dirname(copy), exist_ok=True)
+                shutil.copy2(path, copy)
+            merged[relative] = "copied"
+
+    index = {
+        "shards": [
+            dict(asdict(shard), outputs=outputs[shard.index]) for shard in shards
+        ],
+        "merged": merged,
+    }
+    with open(os.path.join(results, "index.json"), "w") as index_file:
+        json.dump(index, index_file, indent=2)
+    return merged
+
+
+def describe_range(name, first, count):
+    """Describe ``count`` items from ``first``, e.g. ``"maps 0-4"``; none means all of them."""
+    if count <= 0:
+        return f"all {name}s"
+    if count == 1:
+        return f"{name} {first}"
+    return f"{name}s {first}-{first + count - 1}"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m SetUp.shards",
+        description="Run the maps and repetitions of one configuration as concurrent SMARTERS processes.",
+    )
+    parser.add_argument("spec", help="JSON spec file, see SetUp.cli")
+    parser.add_argument(
+        "--set", dest="overrides", action="append", default=[], metavar="SECTION.KEY=VALUE",
+        help="set or override a spec value, e.g. --set simulator.repetitions=20",
+    )
+    parser.add_argument("--shards", type=int, help="maximum number of shards (default: available cores)")
+    parser.add_argument("--smarters", default="../smarters/main.py", help="simulator entry point")
+    parser.add_argument("--output-dir", default="shards", help="directory for the shards and results")
+    parser.add_argument("--workers", type=int, help="concurrent runs (default: available cores)")
+    parser.add_argument("--retries", type=int, default=1, help="extra attempts per failed run")
+    parser.add_argument("--timeout", type=float, help="seconds before a run is killed")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="json", help="export format")
+    parser.add_argument("--seed", type=int, default=0, help="base seed of the random maps")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only write the configuration of every shard"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        spec = apply_overrides(load_spec(args.spec), args.overrides)
+        shards = run_shards(
+            spec, None if args.dry_run else args.smarters, args.output_dir,
+            shards=args.shards, workers=args.workers, retries=args.retries,
+            export_format=args.format, timeout=args.timeout, seed=args.seed,
+        )
+    except (KeyError, TypeError, ValueError, OSError) as e:
+        parser.error(repr(e))
+
+    for shard in shards:
+        print(f"{shard.run_dir}: {describe_range('map', shard.first_map, shard.num_maps)}, "
+              f"{describe_range('repetition', shard.first_repetition, shard.repetitions)}: {shard.status} "
+              f"({shard.attempts} attempts, {shard.elapsed:.1f} s)")
+    return 0 if all(shard.status in ("done", "configured") for shard in shards) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License."""
+
+import math
+from dataclasses import dataclass
+
+# Layers whose shapes must not overlap each other; an opening is meant to overlap its
+# isolated area, and obstacles may overlap each other
+CONFLICTING_LAYERS = {
+    frozenset(("squares", "isolated_area")),
+    frozenset(("squares", "opening")),
+    frozenset(("circles", "isolated_area")),
+    frozenset(("circles", "opening")),
+    frozenset(("isolated_area",)),
+}
+# Buckets per side of the field used when no bucket size is given
+DEFAULT_BUCKETS = 64
+# Shapes covering more buckets than this are kept in a list checked by every query
+LARGE_SHAPE_BUCKETS = 64
+
+
+@dataclass(frozen=True)
+class IndexedShape:
+    """
+    A shape placed on the field.
+
+    ``kind`` is ``"rectangle"`` with ``params`` ``(x, y, width, height)`` from the
+    bottom-left corner, or ``"circle"`` with ``params`` ``(x_center, y_center, radius)``.
+    """
+    id: int
+    layer: str
+    kind: str
+    params: tuple
+    bbox: tuple
+
+
+def bounding_box(kind, params):
+    """Return the ``(x0, y0, x1, y1)`` bounding box of a shape."""
+    if kind == "rectangle":
+        x, y, width, height = params
+        return min(x, x + width), min(y, y + height), max(x, x + width), max(y, y + height)
+    if kind == "circle":
+        x, y, radius = params
+        return x - radius, y - radius, x + radius, y + radius
+    raise ValueError(f"Unknown shape kind '{kind}'.")
+
+
+def rectangle_distance(bbox, x, y):
+    """Return the distance from point ``(x, y)`` to the rectangle ``bbox``."""
+    x0, y0, x1, y1 = bbox
+    return math.hypot(max(x0 - x, 0, x - x1), max(y0 - y, 0, y - y1))
+
+
+def intersects(a, b):
+    """
+    Return True if the interiors of two IndexedShape intersect; shapes that only touch
+    along their border do not.
+    """
+    ax0, ay0, ax1, ay1 = a.bbox
+    bx0, by0, bx1, by1 = b.bbox
+    if not (ax0 < bx1 and bx0 < ax1 and ay0 < by1 and by0 < ay1):
+        return False
+    if a.kind == "rectangle" and b.kind == "rectangle":
+        return True
+    if a.kind == "circle" and b.kind == "circle":
+        return math.hypot(a.params[0] - b.params[0], a.params[1] - b.params[1]) < a.params[2] + b.params[2]
+    circle, rectangle = (a, b) if a.kind == "circle" else (b, a)
+    x, y, radius = circle.params
+    return rectangle_distance(rectangle.bbox, x, y) < radius
+
+
+def contains_point(shape, x, y):
+    """Return True if ``(x, y)`` lies inside or on the border of ``shape``."""
+    if shape.kind == "circle":
+        return math.hypot(x - shape.params[0], y - shape.params[1]) <= shape.params[2]
+    x0, y0, x1, y1 = shape.bbox
+    return x0 <= x <= x1 and y0 <= y <= y1
+
+
+def layers_conflict(layer, other):
+    return frozenset((layer, other)) in CONFLICTING_LAYERS
+
+
+class ShapeIndex:
+    """
+    Uniform-grid spatial index of the shapes placed on a field.
+
+    Every shape is registered in the square buckets its bounding box covers, so an
+    overlap or point query only tests the shapes sharing a bucket with it, whatever
+    the number of shapes on the field. The few shapes spanning many buckets are kept
+    apart and tested by every query instead.
+    """
+
+    def __init__(self, bucket_size, max_bucket=None):
+        """
+        Initialize the ShapeIndex.
+
+        :param bucket_size: Side of a bucket, in metres.
+        :param max_bucket: Largest bucket index along each axis; shapes reaching past
+            it, or below zero, are registered in the border buckets. No limit by default.
+        """
+        if bucket_size <= 0:
+            raise ValueError("The bucket size must be positive.")
+        self.bucket_size = bucket_size
+        self.max_bucket = max_bucket
+        self._shapes = {}
+        self._next_id = 0
+        self._buckets = {}
+        self._large = set()
+
+    @classmethod
+    def for_field(cls, length, width, buckets=DEFAULT_BUCKETS):
+        """Return an index with ``buckets`` buckets along the longer side of the field."""
+        return cls(max(length, width, 1e-9) / buckets, max_bucket=buckets - 1)
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __iter__(self):
+        return iter(self._shapes.values())
+
+    def _bucket(self, coordinate):
+        bucket = math.floor(coordinate / self.bucket_size)
+        if self.max_bucket is not None:
+            bucket = min(max(bucket, 0), self.max_bucket)
+        return bucket
+
+    def _bucket_range(self, bbox):
+        x0, y0, x1, y1 = bbox
+        return (
+            range(self._bucket(x0), self._bucket(x1) + 1),
+            range(self._bucket(y0), self._bucket(y1) + 1),
+        )
+
+    def _candidates(self, bbox):
+        """Return the shapes sharing a bucket with ``bbox``, in insertion order."""
+        columns, rows = self._bucket_range(bbox)
+        if len(columns) * len(rows) > len(self._shapes):
+            # Visiting the buckets would cost more than testing every shape
+            return list(self._shapes.values())
+        found = set(self._large)
+        for bx in columns:
+            for by in rows:
+                found.update(self._buckets.get((bx, by), ()))
+        return [self._shapes[shape_id] for shape_id in sorted(found)]
+
+    def insert(self, layer, kind, params):
+        """
+        Add a shape to the index.
+
+        :param layer: Occupancy layer the shape is drawn on.
+        :return: The IndexedShape added.
+        """
+        params = tuple(float(value) for value in params)
+        shape = IndexedShape(self._next_id, layer, kind, params, bounding_box(kind, params))
+        self.add(shape)
+        return shape
+
+    def add(self, shape):
+        """Add an IndexedShape, e.g. one taken out by ``remove``, back to the index."""
+        self._shapes[shape.id] = shape
+        self._next_id = max(self._next_id, shape.id + 1)
+        columns, rows = self._bucket_range(shape.bbox)
+        if len(columns) * len(rows) > LARGE_SHAPE_BUCKETS:
+            self._large.add(shape.id)
+            return
+        for bx in columns:
+            for by in rows:
+                self._buckets.setdefault((bx, by), set()).add(shape.id)
+
+    def remove(self, shape):
+        """Take an IndexedShape out of the index."""
+        del self._shapes[shape.id]
+        if shape.id in self._large:
+            self._large.discard(shape.id)
+            return
+        columns, rows = self._bucket_range(shape.bbox)
+        for bx in columns:
+            for by in rows:
+                bucket = self._buckets[(bx, by)]
+                bucket.discard(shape.id)
+                if not bucket:
+                    del self._buckets[(bx, by)]
+
+    def records(self):
+        """Return the indexed shapes as ``layer``, ``kind`` and ``params`` dicts, in insertion order."""
+        return [{"layer": shape.layer, "kind": shape.kind, "params": list(shape.params)} for shape in self]
+
+    def insert_records(self, records):
+        """Add the shapes of dicts with a ``layer``, ``kind`` and ``params``, e.g. from ``records``."""
+        for record in records:
+            self.insert(record["layer"], record["kind"], record["params"])
+
+    def query(self, kind, params):
+        """Return the indexed shapes whose interior intersects the given shape."""
+        probe = IndexedShape(-1, "", kind, tuple(params), bounding_box(kind, params))
+        return [shape for shape in self._candidates(probe.bbox) if intersects(probe, shape)]
+
+    def at(self, x, y):
+        """Return the indexed shapes containing the point ``(x, y)``."""
+        return [shape for shape in self._candidates((x, y, x, y)) if contains_point(shape, x, y)]
+
+    def conflicting(self, layer, kind, params):
+        """Return the indexed shapes a new shape on ``layer`` would illegally overlap."""
+        return [shape for shape in self.query(kind, params) if layers_conflict(layer, shape.layer)]
+
+    def conflicts(self):
+        """Return every pair of indexed shapes that illegally overlap, each pair once."""
+        pairs = []
+        for shape in self._shapes.values():
+            for other in self._candidates(shape.bbox):
+                if other.id > shape.id and layers_conflict(shape.layer, other.layer) \
+                        and intersects(shape, other):
+                    pairs.append((shape, other))
+        return pairs
+
+
+def describe(shape):
+    """Return a short human-readable description of an IndexedShape."""
+    name = shape.layer.replace("_", " ")
+    if shape.kind == "circle":
+        x, y, radius = shape.params
+        return f"{name} circle at ({x:g}, {y:g}) of radius {radius:g}"
+    x, y, width, height = shape.params
+    return f"{name} rectangle at ({x:g}, {y:g}) of size {width:g} x {height:g}"
@@ -0,0 +1,385 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Parameter sweeps: run SMARTERS over the grid of several configuration values.
+
+Each run gets its own directory under the output directory, with its own ``data_file``
+and ``smarters.log``, and runs are spread over a bounded process pool. Axes are given as
+``section.key`` targets, either in a ``sweep`` section of the spec file::
+
+    "sweep": {
+      "robot.speed": [0.35, 0.46, 0.62],
+      "simulator.dim_tassel": {"start": 0.1, "stop": 0.3, "step": 0.1}
+    }
+
+or on the command line, e.g. ``--axis robot.speed=0.35,0.46 --axis simulator.cycle=30:90:30``.
+
+The ``robot.type`` axis can also select predefined robots from the catalog by range,
+e.g. ``{"catalog": {"speed": [0.4, null], "autonomy": [100, 300]}}``; leave speed, cutting
+diameter and autonomy out of the base spec so they are taken from each robot.
+
+Before launching, every run is scored by ``SetUp.estimator``; with ``--skip-infeasible``
+the runs whose robot cannot cover the field in the simulated cycle are not launched.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, fields, asdict
+
+from SetUp.cli import build_env, build_robot, build_simulator, copy_spec, generate_config, load_spec, set_value
+from SetUp.data_classes import RobotConfig, EnvConfig, SimulatorConfig
+from SetUp.export import DATA_FILES, EXPORT_FORMATS
+from SetUp.launcher import available_cores, run_second_program
+from SetUp.result_store import make_run_dir
+from SetUp.robot_catalog import get_catalog
+from SetUp.worker_pool import pool_settings
+
+# Spec keys that can be swept, per section
+SWEEP_FIELDS = {
+    "robot": {f.name for f in fields(RobotConfig)},
+    "simulator": {f.name for f in fields(SimulatorConfig)},
+    "env": {f.name for f in fields(EnvConfig)},
+}
+MANIFEST = "sweep.json"
+LOG_FILE = "smarters.log"
+
+
+@dataclass
+class SweepJob:
+    """
+    One run of a sweep.
+    """
+    index: int
+    overrides: dict
+    run_dir: str
+    status: str = "pending"
+    attempts: int = 0
+    elapsed: float = 0.0
+    error: str = ""
+    estimate: str = ""
+
+
+def axis_values(axis):
+    """
+    Expand an axis definition into its list of values.
+
+    :param axis: A list of values, ``{"start", "stop", "step"}`` with an inclusive stop,
+        ``{"start", "stop", "num"}`` for evenly spaced values, or ``{"catalog": ranges}``
+        for the ids of the predefined robots matching ``RobotCatalog.query(**ranges)``.
+    :raises ValueError: If the definition is malformed or empty.
+    """
+    if isinstance(axis, dict) and "catalog" in axis:
+        ranges = {name: tuple(bounds) for name, bounds in axis["catalog"].items()}
+        values = [robot["id"] for robot in get_catalog().query(**ranges)]
+    elif isinstance(axis, dict):
+        start, stop = axis["start"], axis["stop"]
+        if "num" in axis:
+            num = int(axis["num"])
+            if num == 1:
+                values = [start]
+            else:
+                values = [start + (stop - start) * k / (num - 1) for k in range(num)]
+        else:
+            step = axis["step"]
+            if step <= 0:
+                raise ValueError(f"Axis step must be positive, got {step}.")
+            count = math.floor((stop - start) / step + 1e-9) + 1
+            values = [start + k * step for k in range(count)]
+        if all(isinstance(v, int) for v in (start, stop, axis.get("step", 0))):
+            values = [int(v) for v in values]
+        else:
+            values = [round(v, 10) for v in values]
+    else:
+        values = list(axis)
+    if not values:
+        raise ValueError("Axis has no values.")
+    return values
+
+
+def parse_axis(text):
+    """
+    Parse a command-line axis: ``section.key=v1,v2,...`` or ``section.key=start:stop:step``.
+
+    :return: ``(target, values)``.
+    """
+    target, sep, raw = text.partition("=")
+    if not sep:
+        raise ValueError(f"Invalid axis '{text}', expected section.key=values.")
+    if ":" in raw:
+        start, stop, step = (json.loads(part) for part in raw.split(":"))
+        return target, axis_values({"start": start, "stop": stop, "step": step})
+
+    def decode(value):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+
+    return target, [decode(value) for value in raw.split(",")]
+
+
+def check_target(target):
+    """
+    :raises ValueError: If ``target`` is not a sweepable ``section.key``.
+    """
+    section, _, key = target.partition(".")
+    if key not in SWEEP_FIELDS.get(section, ()):
+        raise ValueError(f"'{target}' cannot be swept.")
+
+
+def expand_grid(axes):
+    """
+    Return the cartesian product of the axes.
+
+    :param axes: Dict mapping ``section.key`` targets to axis definitions.
+    :return: List of dicts mapping each target to one value.
+    """
+    for target in axes:
+        check_target(target)
+    targets = list(axes)
+    value_lists = [axis_values(axes[target]) for target in targets]
+    return [dict(zip(targets, combo)) for combo in itertools.product(*value_lists)]
+
+
+def plan_jobs(axes, output_dir):
+    """Create one SweepJob per point of the grid, each in its own run directory."""
+    return [
+        SweepJob(index, overrides, os.path.join(output_dir, f"run_{index:05d}"))
+        for index, overrides in enumerate(expand_grid(axes))
+    ]
+
+
+def job_spec(spec, job):
+    """Return the spec of a job: the base spec with its overrides."""
+    spec = copy_spec(spec)
+    for target, value in job.overrides.items():
+        set_value(spec, target, value)
+    return spec
+
+
+def screen_jobs(spec, jobs, skip_infeasible=False):
+    """
+    Estimate the coverage time of every job, in one vectorized pass.
+
+    Each distinct robot and environment is built once. Jobs whose configuration is invalid are
+    left to ``execute_job`` to report.
+
+    :param skip_infeasible: Mark the jobs that cannot cover the field in the simulated
+        cycle ``"infeasible"``, so that they are not launched.
+    :return: Dict mapping each status of ``SetUp.estimator.STATUSES`` to its number of jobs.
+    """
+    from SetUp.estimator import STATUSES, Estimate, estimate_many, free_cells
+
+    def override_key(job, *targets):
+        return repr(sorted(
+            (target, value) for target, value in job.overrides.items()
+            if target.startswith(targets)
+        ))
+
+    screened, robots, simulators, cells, built_robots, environments = [], [], [], [], {}, {}
+    for job in jobs:
+        try:
+            sections = job_spec(spec, job)
+            robot_key = override_key(job, "robot.")
+            if robot_key not in built_robots:
+                built_robots[robot_key] = build_robot(sections.get("robot", {}))
+            robot = built_robots[robot_key]
+            simulator = build_simulator(sections["simulator"])
+            env_key = override_key(job, "env.", "simulator.dim_tassel")
+            if env_key not in environments:
+                env = build_env(sections["env"], simulator.dim_tassel)
+                environments[env_key] = free_cells(env, simulator.dim_tassel)
+        except (KeyError, TypeError, ValueError, OSError):
+            continue
+        screened.append(job)
+        robots.append(robot)
+        simulators.append(simulator)
+        cells.append(environments[env_key])
+
+    counts = dict.fromkeys(STATUSES, 0)
+    if not screened:
+        return counts
+    result = estimate_many(robots, simulators, cells)
+    for k, job in enumerate(screened):
+        status = STATUSES[result["status"][k]]
+        counts[status] += 1
+        job.estimate = Estimate(
+            float(result["lower"][k]), float(result["upper"][k]), float(result["min_recharges"][k]),
+            float(result["max_recharges"][k]), status, simulators[k].cycle,
+        ).describe()
+        if skip_infeasible and status == "infeasible":
+            job.status = "infeasible"
+    return counts
+
+
+def execute_job(spec, job, path_smarters, export_format="json", retries=1, timeout=None):
+    """
+    Write the configuration of a job in its run directory and run SMARTERS there.
+
+    Runs in a pool worker. Configuration errors are not retried and I/O errors writing
+    the configuration fail the job; failed or timed out runs are retried up to
+    ``retries`` more times.
+
+    :param path_smarters: Simulator entry point, or None to only write the config.
+    :return: The job, with its status, attempts, elapsed time and last error.
+    """
+    start = time.perf_counter()
+    try:
+        make_run_dir(job.run_dir)
+        generate_config(job_spec(spec, job), export_format, os.path.join(job.run_dir, DATA_FILES[export_format]))
+    except (KeyError, TypeError, ValueError) as e:
+        job.status, job.error = "invalid", repr(e)
+        return job
+    except OSError as e:
+        # E.g. a full disk or an unreadable map input: fail this job, not the sweep
+        job.status, job.error = "failed", repr(e)
+        job.elapsed = time.perf_counter() - start
+        return job
+
+    if path_smarters is None:
+        job.status = "configured"
+    else:
+        job.status = "failed"
+        for attempt in range(1, retries + 2):
+            job.attempts = attempt
+            with open(os.path.join(job.run_dir, LOG_FILE), "a") as log:
+                try:
+                    run_second_program(
+                        path_smarters, cwd=job.run_dir,
+                        stdout=log, stderr=subprocess.STDOUT, timeout=timeout,
+                    )
+                except FileNotFoundError as e:
+                    job.error = str(e)
+                    continue
+            job.status, job.error = "done", ""
+            break
+    job.elapsed = time.perf_counter() - start
+    return job
+
+
+def write_manifest(output_dir, jobs):
+    """Record the state of every job in ``sweep.json``."""
+    with open(os.path.join(output_dir, MANIFEST), "w") as manifest:
+        json.dump([asdict(job) for job in jobs], manifest, indent=2)
+
+
+def run_sweep(spec, axes, path_smarters, output_dir, workers=None, retries=1,
+              export_format="json", timeout=None, skip_infeasible=False, jobs=None):
+    """
+    Run SMARTERS over every combination of the axes.
+
+    :param spec: Base spec, see ``SetUp.cli``.
+    :param axes: Dict mapping ``section.key`` targets to axis definitions.
+    :param path_smarters: Simulator entry point, or None to only write the configs.
+    :param output_dir: Directory receiving one run directory per job and ``sweep.json``.
+    :param workers: Maximum concurrent runs, by default the number of available cores.
+    :param retries: Extra attempts for a failed run.
+    :param timeout: Seconds after which a run is killed and counted as failed.
+    :param skip_infeasible: Do not launch the runs ``screen_jobs`` finds infeasible.
+    :param jobs: The jobs, already planned in ``output_dir`` and screened; by default
+        they are planned from the axes here.
+    :return: The list of SweepJob, in grid order.
+    :raises ValueError: If the worker pool settings are invalid.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if path_smarters is not None:
+        if not os.path.exists(path_smarters):
+            raise FileNotFoundError(f"The file '{path_smarters}' does not exist.")
+        path_smarters = os.path.abspath(path_smarters)
+        # Reject invalid worker pool settings once, before any run is attempted
+        pool_settings()
+    if jobs is None:
+        jobs = plan_jobs(axes, os.path.abspath(output_dir))
+        screen_jobs(spec, jobs, skip_infeasible)
+    pending = [job for job in jobs if job.status == "pending"]
+    write_manifest(output_dir, jobs)
+    if not pending:
+        return jobs
+
+    workers = max(1, min(workers or available_cores(), len(pending)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(execute_job, spec, job, path_smarters, export_format, retries, timeout): job
+            for job in pending
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                jobs[job.index] = future.result()
+            except BrokenProcessPool as e:
+                job.status, job.error = "failed", repr(e)
+            write_manifest(output_dir, jobs)
+    return jobs
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m SetUp.sweep",
+        description="Run SMARTERS over a grid of configuration values.",
+    )
+    parser.add_argument("spec", help="base JSON spec file, optionally with a 'sweep' section")
+    parser.add_argument(
+        "--axis", dest="axes", action="append", default=[], metavar="SECTION.KEY=VALUES",
+        help="values to sweep: v1,v2,... or start:stop:step",
+    )
+    parser.add_argument("--smarters", default="../smarters/main.py", help="simulator entry point")
+    parser.add_argument("--output-dir", default="sweep", help="directory for the runs")
+    parser.add_argument("--workers", type=int, help="concurrent runs (default: available cores)")
+    parser.add_argument("--retries", type=int, default=1, help="extra attempts per failed run")
+    parser.add_argument("--timeout", type=float, help="seconds before a run is killed")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="json", help="export format")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only write the configuration of every run"
+    )
+    parser.add_argument(
+        "--skip-infeasible", action="store_true",
+        help="do not launch the runs that cannot cover the field in the simulated cycle",
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        spec = load_spec(args.spec)
+        axes = dict(spec.pop("sweep", {}))
+        axes.update(parse_axis(axis) for axis in args.axes)
+        jobs = plan_jobs(axes, os.path.abspath(args.output_dir))
+        counts = screen_jobs(spec, jobs, args.skip_infeasible)
+        print("Estimate: " + ", ".join(f"{count} {status}" for status, count in counts.items()),
+              file=sys.stderr)
+        jobs = run_sweep(
+            spec, axes, None if args.dry_run else args.smarters, args.output_dir,
+            workers=args.workers, retries=args.retries,
+            export_format=args.format, timeout=args.timeout, jobs=jobs,
+        )
+    except (KeyError, TypeError, ValueError, OSError) as e:
+        parser.error(repr(e))
+
+    for job in jobs:
+        print(f"{job.run_dir}: {job.status} ({job.attempts} attempts, {job.elapsed:.1f} s)")
+    return 0 if all(job.status in ("done", "configured", "infeasible") for job in jobs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
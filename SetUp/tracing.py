@@ -0,0 +1,223 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Opt-in tracing of the setup tool.
+
+Set ``SETUP_TRACE`` to a file name (or pass ``--trace`` to ``SetUp.cli``) to record a
+timed span around every wizard stage, rasterization, map drawing, export and simulator
+run. On exit the spans are written to that file as Chrome trace events, to be opened in
+``chrome://tracing`` or Perfetto, and a summary table is printed on standard error.
+
+While tracing is disabled, ``span`` returns a shared no-op object and ``traced``
+functions only test a flag before calling through.
+"""
+
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "SETUP_TRACE"
+
+_enabled = False
+_path = None
+_origin = time.perf_counter_ns()
+_events = []
+_counters = {}
+_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed region of the program, recorded when it ends.
+    """
+    __slots__ = ("name", "args", "start")
+    active = True
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        event = {
+            "name": self.name,
+            "ph": "X",
+            "ts": (self.start - _origin) / 1000,
+            "dur": (end - self.start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": self.args,
+        }
+        with _lock:
+            _events.append(event)
+        return False
+
+    def count(self, counter, value):
+        """Add ``value`` to ``counter``, both on this span and in the process totals."""
+        self.args[counter] = self.args.get(counter, 0) + value
+        with _lock:
+            _counters[counter] = _counters.get(counter, 0) + value
+
+
+class NullSpan:
+    """
+    The span returned while tracing is disabled; it records nothing.
+
+    Callers computing a counter value that is costly can test ``active`` first.
+    """
+    __slots__ = ()
+    active = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, counter, value):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def enabled():
+    return _enabled
+
+
+def span(name, **args):
+    """
+    Time a block: ``with span("produce_json", format="npz") as s: ...``.
+
+    :param args: Values shown with the span in the trace.
+    """
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def traced(name=None):
+    """
+    Decorator timing every call of a function in a span.
+
+    :param name: Span name, the qualified name of the function by default.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enable(path=None):
+    """
+    Start recording spans.
+
+    :param path: File receiving the Chrome trace at exit, where the summary is also
+        printed; when None, nothing is written automatically.
+    """
+    global _enabled, _path
+    if path is not None and _path is None:
+        atexit.register(_write_at_exit)
+    _path = path or _path
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    """Forget the spans and counters recorded so far."""
+    with _lock:
+        _events.clear()
+        _counters.clear()
+
+
+def chrome_trace():
+    """Return the recorded spans and counter totals as a Chrome trace-event document."""
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    if events:
+        end = max(event["ts"] + event["dur"] for event in events)
+        events.append({
+            "name": "counters", "ph": "C", "ts": end,
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": counters,
+        })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def write_chrome_trace(path):
+    with open(path, "w") as trace_file:
+        json.dump(chrome_trace(), trace_file)
+
+
+def summary():
+    """
+    Return a plain-text table with the number of calls and the total, mean and maximum
+    time of every span name, slowest total first, followed by the counter totals.
+    """
+    with _lock:
+        events = list(_events)
+        counters = dict(_counters)
+    rows = {}
+    for event in events:
+        calls, total, longest = rows.get(event["name"], (0, 0.0, 0.0))
+        rows[event["name"]] = (calls + 1, total + event["dur"], max(longest, event["dur"]))
+
+    width = max([len(name) for name in rows] + [len(name) for name in counters] + [7])
+    lines = [f"{'span':<{width}}{'calls':>8}{'total ms':>12}{'mean ms':>12}{'max ms':>12}"]
+    for name, (calls, total, longest) in sorted(rows.items(), key=lambda row: -row[1][1]):
+        lines.append(
+            f"{name:<{width}}{calls:>8}{total / 1000:>12.2f}{total / calls / 1000:>12.2f}{longest / 1000:>12.2f}"
+        )
+    if counters:
+        lines.append("")
+        lines.append(f"{'counter':<{width}}{'total':>16}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<{width}}{value:>16}")
+    return "\n".join(lines)
+
+
+def _write_at_exit():
+    if _path is None or not _events:
+        return
+    try:
+        write_chrome_trace(_path)
+    except OSError as e:
+        print(f"Could not write the trace to '{_path}': {e}", file=sys.stderr)
+    print(summary(), file=sys.stderr)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,236 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Vector export of drawn maps: the shapes themselves instead of the tiles they cover.
+
+The ``env`` object written by the ``json-vector`` export format is::
+
+    {
+      "length": 50, "width": 30, "tile_size": 0.2, "rows": 250, "cols": 150,
+      "shapes": [
+        {"layer": "squares", "kind": "rectangle", "params": [x, y, width, height],
+         "tiles": [start_i, end_i, start_j, end_j]},
+        {"layer": "circles", "kind": "circle", "params": [x_center, y_center, radius],
+         "tiles": [center_i, center_j, radius]}
+      ],
+      "cells": {"squares": [i0, j0, i1, j1, ...]}
+    }
+
+Tile ``(i, j)`` covers ``[i * tile_size, (i + 1) * tile_size)`` along the length and
+``[j * tile_size, (j + 1) * tile_size)`` along the width. ``params`` is the geometry in
+metres, for analytic collision checks, and ``tiles`` the same primitive on the tile grid:
+a rectangle covers the index ranges with exclusive ends, a circle the tiles ``(i, j)``
+with ``(i - center_i) ** 2 + (j - center_j) ** 2 <= radius ** 2``, both clipped to the
+grid. ``cells`` lists the tiles of each layer that no shape covers, e.g. those of an
+imported image, flattened. Each shape costs a few numbers whatever its area;
+``layer_rows`` rebuilds the tiles one row at a time.
+"""
+
+import heapq
+import math
+
+import numpy as np
+
+from SetUp.rasterize import rectangle_bounds, rectangle_spans, circle_spans
+from SetUp.spatial_index import ShapeIndex
+
+# Tiles rasterized at once when comparing the shapes with a grid or rebuilding it
+BAND_TILES = 2 ** 22
+
+
+def tile_primitive(kind, params, d_tassel):
+    """
+    Return a shape on the tile grid, rounded as the rasterizer does.
+
+    :return: ``[start_i, end_i, start_j, end_j]`` for a rectangle, ``[center_i,
+        center_j, radius]`` for a circle.
+    """
+    if kind == "rectangle":
+        return list(rectangle_bounds(*params, d_tassel))
+    x_center, y_center, radius = params
+    return [math.floor(x_center / d_tassel), math.floor(y_center / d_tassel), round(radius / d_tassel)]
+
+
+def shape_record(shape, d_tassel):
+    """Return the vector record of an IndexedShape."""
+    return {
+        "layer": shape.layer,
+        "kind": shape.kind,
+        "params": list(shape.params),
+        "tiles": tile_primitive(shape.kind, shape.params, d_tassel),
+    }
+
+
+def shape_spans(record, rows, cols):
+    """Return the scanline generator of ``(i, start_j, end_j)`` spans of a vector record."""
+    if record["kind"] == "rectangle":
+        return rectangle_spans(*record["tiles"], rows, cols)
+    return circle_spans(*record["tiles"], rows, cols)
+
+
+def layer_rows(records, layer, rows, cols):
+    """
+    Rasterize the shapes of one layer row by row.
+
+    The shapes are merged as they are scanned, so only one span per shape is held at a
+    time.
+
+    :return: Generator of ``(i, spans)`` for the rows with tiles, in increasing order,
+        with ``spans`` the sorted, disjoint ``(start_j, end_j)`` ranges of the row.
+    """
+    scanlines = [shape_spans(record, rows, cols) for record in records if record["layer"] == layer]
+    row, spans = None, []
+    for i, start_j, end_j in heapq.merge(*scanlines):
+        if i != row:
+            if spans:
+                yield row, spans
+            row, spans = i, []
+        if spans and start_j <= spans[-1][1]:
+            spans[-1] = (spans[-1][0], max(spans[-1][1], end_j))
+        else:
+            spans.append((start_j, end_j))
+    if spans:
+        yield row, spans
+
+
+def row_ranges(records):
+    """Return the first and last-plus-one rows of every record, as two arrays."""
+    first, last = np.zeros(len(records), dtype=np.int64), np.zeros(len(records), dtype=np.int64)
+    for k, record in enumerate(records):
+        if record["kind"] == "rectangle":
+            first[k], last[k] = record["tiles"][0], record["tiles"][1]
+        else:
+            center_i, _, radius = record["tiles"]
+            first[k], last[k] = center_i - radius, center_i + radius + 1
+    return first, last
+
+
+def layer_band(records, ranges, start_i, end_i, cols):
+    """
+    Return the tiles ``records`` cover in rows ``[start_i, end_i)``, as a mask.
+
+    :param ranges: The ``row_ranges`` of the records.
+    """
+    band = np.zeros((end_i - start_i, cols + 1), dtype=np.int32)
+    first, last = ranges
+    for k in np.flatnonzero((first < end_i) & (last > start_i)):
+        record = records[k]
+        if record["kind"] == "rectangle":
+            row_start, row_end, start_j, end_j = record["tiles"]
+            start_j, end_j = max(start_j, 0), min(end_j, cols)
+            if end_j > start_j:
+                band[max(row_start, start_i) - start_i:min(row_end, end_i) - start_i, start_j] += 1
+                band[max(row_start, start_i) - start_i:min(row_end, end_i) - start_i, end_j] -= 1
+            continue
+        center_i, center_j, radius = record["tiles"]
+        i = np.arange(max(center_i - radius, start_i), min(center_i + radius + 1, end_i))
+        remaining = radius * radius - (i - center_i) ** 2
+        # Largest half-width h with h * h <= remaining, corrected for float rounding
+        half = np.floor(np.sqrt(remaining)).astype(np.int64)
+        half += (half + 1) ** 2 <= remaining
+        half -= half ** 2 > remaining
+        row_start, row_end = np.clip(center_j - half, 0, cols), np.clip(center_j + half + 1, 0, cols)
+        keep = row_end > row_start
+        band[i[keep] - start_i, row_start[keep]] += 1
+        band[i[keep] - start_i, row_end[keep]] -= 1
+    return np.cumsum(band, axis=1)[:, :cols] > 0
+
+
+def bands(rows, cols):
+    """Yield the ``(start_i, end_i)`` bands of about ``BAND_TILES`` tiles covering the rows."""
+    step = max(1, BAND_TILES // max(cols, 1))
+    for start in range(0, rows, step):
+        yield start, min(start + step, rows)
+
+
+def residual_cells(grid, records):
+    """
+    Return the tiles of each layer of ``grid`` that none of ``records`` covers.
+
+    :return: Dict mapping the layers with such tiles to ``(n, 2)`` cell arrays.
+    """
+    rows, cols = grid.shape
+    residual = {}
+    for layer in grid.layers:
+        layer_records = [record for record in records if record["layer"] == layer]
+        ranges = row_ranges(layer_records)
+        chunks = []
+        for start, end in bands(rows, cols):
+            block = grid.block(layer, start, end, 0, cols)
+            if not block.any():
+                continue
+            cells = np.argwhere(block & ~layer_band(layer_records, ranges, start, end, cols))
+            cells[:, 0] += start
+            chunks.append(cells)
+        if any(len(cells) for cells in chunks):
+            residual[layer] = np.concatenate(chunks)
+    return residual
+
+
+def vector_env(grid):
+    """
+    Return the vector ``env`` object of a grid, see the module docstring.
+
+    :param grid: An OccupancyGrid or a QuadGrid; its shape index gives the shapes.
+    """
+    records = [shape_record(shape, grid.d_tassel) for shape in grid.shapes]
+    return {
+        "length": grid.length,
+        "width": grid.width,
+        "tile_size": grid.d_tassel,
+        "rows": grid.shape[0],
+        "cols": grid.shape[1],
+        "shapes": records,
+        "cells": {
+            layer: cells.ravel().tolist() for layer, cells in residual_cells(grid, records).items()
+        },
+    }
+
+
+def grid_from_vector(env, quadtree=None):
+    """
+    Rebuild the grid of a vector ``env`` object, with its shapes in the shape index.
+
+    :param quadtree: Force a QuadGrid or an OccupancyGrid, see ``SetUp.quadtree.make_grid``.
+    """
+    from SetUp.quadtree import make_grid
+
+    grid = make_grid(env["length"], env["width"], env["tile_size"], quadtree)
+    rows, cols = grid.shape
+    grid.shapes = shape_index(env)
+    residual = {
+        layer: np.asarray(flat, dtype=np.int64).reshape(-1, 2) for layer, flat in env.get("cells", {}).items()
+    }
+    for layer in grid.layers:
+        layer_records = [record for record in env["shapes"] if record["layer"] == layer]
+        ranges = row_ranges(layer_records)
+        cells = residual.get(layer, np.zeros((0, 2), dtype=np.int64))
+        cells = cells[np.argsort(cells[:, 0], kind="stable")]
+        for start, end in bands(rows, cols):
+            mask = layer_band(layer_records, ranges, start, end, cols)
+            band_cells = cells[np.searchsorted(cells[:, 0], start):np.searchsorted(cells[:, 0], end)]
+            mask[band_cells[:, 0] - start, band_cells[:, 1]] = True
+            if mask.any():
+                grid.write_mask(layer, start, 0, mask)
+    return grid
+
+
+def shape_index(env):
+    """
+    Return a ShapeIndex of the shapes of a vector ``env`` object, for analytic overlap
+    and point queries without rasterizing anything.
+    """
+    index = ShapeIndex.for_field(env["length"], env["width"])
+    index.insert_records(env["shapes"])
+    return index
@@ -0,0 +1,136 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Warm simulator worker, started by ``SetUp.worker_pool``.
+
+The worker is run as a script, ``python worker.py FD [MODULE ...]``, with ``FD`` the
+Unix socket connected to the pool; it imports the listed modules, then serves requests,
+one JSON object per line:
+
+- ``{"op": "ping"}`` is answered ``{"op": "pong", "rss_mb": ...}``.
+- ``{"op": "run", "path": ..., "cwd": ...}`` runs the script ``path`` as ``__main__``
+  in ``cwd``, with the standard output and error sent along with the message as file
+  descriptors, if any, and is answered ``{"op": "done", "returncode": ..., "rss_mb": ...}``.
+
+Modules imported by a run stay loaded for the next ones, except those of the
+simulator's own directory, which may read their configuration when imported. The
+worker only uses the standard library, so that it starts without the SetUp package.
+"""
+
+import json
+import os
+import runpy
+import socket
+import sys
+import traceback
+
+# Largest request accepted
+MAX_MESSAGE = 2 ** 16
+
+
+def rss_mb():
+    """Return the resident memory of the worker, in MB."""
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_script(path, cwd, fds):
+    """
+    Run ``path`` as ``__main__`` in ``cwd``, its output going to ``fds``.
+
+    :return: The exit code of the script.
+    """
+    script_dir = os.path.dirname(path)
+    saved = [os.dup(1), os.dup(2)]
+    saved_cwd, saved_argv, saved_path = os.getcwd(), sys.argv, list(sys.path)
+    loaded = set(sys.modules)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for target, fd in zip((1, 2), fds):
+        os.dup2(fd, target)
+    returncode = 0
+    try:
+        os.chdir(cwd)
+        sys.argv = [path]
+        sys.path.insert(0, script_dir)
+        runpy.run_path(path, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException as e:
+        # Leave out the frames of the worker and runpy, as an interpreter would
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb or e.__traceback__)
+        returncode = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in zip((1, 2), saved):
+            os.dup2(fd, target)
+            os.close(fd)
+        for fd in fds:
+            os.close(fd)
+        os.chdir(saved_cwd)
+        sys.argv, sys.path[:] = saved_argv, saved_path
+        for name in set(sys.modules) - loaded:
+            module_file = getattr(sys.modules[name], "__file__", None) or ""
+            if os.path.abspath(module_file).startswith(script_dir + os.sep):
+                del sys.modules[name]
+    return returncode
+
+
+def serve(connection):
+    """Answer the requests of the pool until it closes the connection."""
+    while True:
+        message, fds, _, _ = socket.recv_fds(connection, MAX_MESSAGE, 2)
+        while message and not message.endswith(b"\n"):
+            more = connection.recv(MAX_MESSAGE)
+            if not more:
+                return
+            message += more
+        if not message:
+            return
+        request = json.loads(message)
+        if request["op"] == "ping":
+            reply = {"op": "pong", "rss_mb": rss_mb()}
+        else:
+            path = os.path.abspath(request["path"])
+            # Without descriptors the output goes where the worker's does
+            fds = fds or [os.dup(1), os.dup(2)]
+            returncode = run_script(path, request["cwd"], fds)
+            reply = {"op": "done", "returncode": returncode, "rss_mb": rss_mb()}
+        connection.sendall(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+def main():
+    connection = socket.socket(fileno=int(sys.argv[1]))
+    for module in sys.argv[2:]:
+        __import__(module)
+    serve(connection)
+
+
+if __name__ == "__main__":
+    main()
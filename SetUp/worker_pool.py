@@ -0,0 +1,307 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Pool of warm simulator workers, instead of a fresh interpreter for every run.
+
+Set ``$SETUP_WORKER_POOL`` to ``on`` for up to one worker per available core, or to the
+maximum number of workers; ``run_second_program`` then hands its runs to the pool of
+the current process. Workers (``SetUp/worker.py``) are started on first use and keep the
+modules a run imports for the next runs, so that interpreter startup and imports are
+paid once. A worker is replaced after ``$SETUP_WORKER_JOBS`` runs (50 by default), when
+it uses more than ``$SETUP_WORKER_MB`` megabytes (1024 by default), when it does not
+answer a health check before a run, and when a run times out or kills it.
+``$SETUP_WORKER_PRELOAD`` lists modules, separated by commas, imported by every worker
+when it starts.
+
+Runs are sent over a Unix socket along with their output files, so the pool is only
+available on POSIX systems.
+"""
+
+import atexit
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from SetUp.launcher import available_cores
+
+ENV_VAR = "SETUP_WORKER_POOL"
+DEFAULT_MAX_JOBS = 50
+DEFAULT_MAX_MB = 1024
+# Seconds a worker may stay idle before it is checked ahead of its next run
+PING_AFTER = 1.0
+# Seconds a worker has to answer a health check or to exit when closed
+PING_TIMEOUT = 5.0
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+
+class Worker:
+    """
+    One warm interpreter running ``SetUp/worker.py``.
+    """
+
+    def __init__(self, preload=()):
+        """
+        Start the worker.
+
+        :param preload: Modules the worker imports when it starts.
+        """
+        self.connection, child = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, str(child.fileno()), *preload],
+                pass_fds=(child.fileno(),), stdin=subprocess.DEVNULL, start_new_session=True,
+            )
+        finally:
+            child.close()
+        self.jobs = 0
+        self.rss_mb = 0.0
+        self.last_used = time.monotonic()
+        self._buffer = b""
+
+    def request(self, message, fds=(), timeout=None):
+        """
+        Send a request with file descriptors and wait for the reply.
+
+        :raises TimeoutError: If there is no reply within ``timeout`` seconds.
+        :raises ConnectionError: If the worker exited.
+        """
+        self.connection.settimeout(timeout)
+        socket.send_fds(self.connection, [json.dumps(message).encode("utf-8") + b"\n"], list(fds))
+        while b"\n" not in self._buffer:
+            chunk = self.connection.recv(2 ** 16)
+            if not chunk:
+                raise ConnectionError("The worker exited.")
+            self._buffer += chunk
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        self.last_used = time.monotonic()
+        return json.loads(line)
+
+    def healthy(self):
+        """Return True if the worker is running and, when it has been idle, answers a ping."""
+        if self.process.poll() is not None:
+            return False
+        if time.monotonic() - self.last_used < PING_AFTER:
+            return True
+        try:
+            return self.request({"op": "ping"}, timeout=PING_TIMEOUT)["op"] == "pong"
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def close(self):
+        """Let the worker exit, killing it if it does not."""
+        self.connection.close()
+        try:
+            self.process.wait(PING_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.kill()
+
+    def kill(self):
+        """Stop the worker and anything its run started."""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.connection.close()
+        self.process.wait()
+
+
+def output_fds(stdout, stderr):
+    """
+    Return new descriptors for the outputs of a run, as ``subprocess.run`` takes them:
+    None for this process's own, ``subprocess.DEVNULL``, a file or a descriptor, and
+    ``subprocess.STDOUT`` for the standard error.
+    """
+    def duplicate(stream, default):
+        if stream is None:
+            return os.dup(default)
+        if stream == subprocess.DEVNULL:
+            return os.open(os.devnull, os.O_WRONLY)
+        if isinstance(stream, int):
+            return os.dup(stream)
+        stream.flush()
+        return os.dup(stream.fileno())
+
+    out_fd = duplicate(stdout, 1)
+    err_fd = os.dup(out_fd) if stderr == subprocess.STDOUT else duplicate(stderr, 2)
+    return [out_fd, err_fd]
+
+
+class WorkerPool:
+    """
+    Warm workers shared by the threads of one process.
+    """
+
+    def __init__(self, size=None, max_jobs=DEFAULT_MAX_JOBS, max_mb=DEFAULT_MAX_MB, preload=()):
+        """
+        Initialize the WorkerPool; workers are started when runs need them.
+
+        :param size: Maximum number of workers, by default the number of available cores.
+        :param max_jobs: Runs after which a worker is replaced.
+        :param max_mb: Resident memory, in MB, above which a worker is replaced.
+        :param preload: Modules every worker imports when it starts.
+        """
+        self.size = max(1, size or available_cores())
+        self.max_jobs = max_jobs
+        self.max_mb = max_mb
+        self.preload = tuple(preload)
+        self.pid = os.getpid()
+        self.stats = {"started": 0, "recycled": 0, "runs": 0}
+        self._idle = []
+        self._live = 0
+        self._condition = threading.Condition()
+
+    def _start(self):
+        with self._condition:
+            self.stats["started"] += 1
+        return Worker(self.preload)
+
+    def _acquire(self):
+        """Return a healthy idle worker, starting one if there is room, or wait for one."""
+        with self._condition:
+            while not self._idle and self._live >= self.size:
+                self._condition.wait()
+            if self._idle:
+                worker = self._idle.pop()
+            else:
+                self._live += 1
+                worker = None
+        try:
+            if worker is not None and not worker.healthy():
+                worker.kill()
+                worker = None
+            return worker or self._start()
+        except BaseException:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        """Give a worker back, or retire it once it has done its share; None frees its slot."""
+        if worker is not None and (worker.jobs >= self.max_jobs or worker.rss_mb > self.max_mb):
+            worker.close()
+            with self._condition:
+                self.stats["recycled"] += 1
+            worker = None
+        with self._condition:
+            if worker is None:
+                self._live -= 1
+            else:
+                self._idle.append(worker)
+            self._condition.notify()
+
+    def run(self, path, cwd=None, stdout=None, stderr=None, timeout=None):
+        """
+        Run a Python script in a warm worker, as ``subprocess.run`` would run it in a new
+        interpreter.
+
+        :param path: The script, run as ``__main__``.
+        :param cwd: Working directory of the run, by default the current one.
+        :param stdout: Standard output of the run, see ``output_fds``.
+        :param stderr: Standard error of the run, see ``output_fds``.
+        :param timeout: Seconds after which the run is killed, no limit by default.
+        :return: The exit code of the script.
+        :raises subprocess.TimeoutExpired: If the run timed out.
+        """
+        fds = output_fds(stdout, stderr)
+        request = {"op": "run", "path": os.path.abspath(path), "cwd": os.path.abspath(cwd or os.getcwd())}
+        try:
+            worker = self._acquire()
+            try:
+                reply = worker.request(request, fds, timeout)
+            except TimeoutError:
+                worker.kill()
+                self._release(None)
+                raise subprocess.TimeoutExpired([sys.executable, path], timeout) from None
+            except (OSError, ValueError):
+                # The run ended the worker, e.g. through os._exit
+                worker.kill()
+                self._release(None)
+                return worker.process.returncode
+        finally:
+            for fd in fds:
+                os.close(fd)
+        worker.jobs += 1
+        worker.rss_mb = reply["rss_mb"]
+        with self._condition:
+            self.stats["runs"] += 1
+        self._release(worker)
+        return reply["returncode"]
+
+    def close(self):
+        """Stop the idle workers; busy ones stop when their run is done."""
+        if os.getpid() != self.pid:
+            # Forked copy of another process's pool
+            return
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._live -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool_settings():
+    """
+    Return the ``(size, max_jobs, max_mb, preload)`` of the pool configured by the
+    environment, with ``size`` None for one worker per available core, or None when
+    the pool is disabled.
+
+    :raises ValueError: If a setting is invalid.
+    """
+    setting = os.environ.get(ENV_VAR, "off").strip().lower()
+    if setting in ("", "0", "off", "false", "no") or not hasattr(socket, "send_fds"):
+        return None
+
+    def number(name, value, kind, expected="a positive number"):
+        try:
+            parsed = kind(value)
+        except ValueError:
+            parsed = 0
+        if not parsed > 0:
+            raise ValueError(f"Invalid ${name} '{value}', expected {expected}.")
+        return parsed
+
+    if setting in ("on", "true", "yes"):
+        size = None
+    else:
+        size = number(ENV_VAR, setting, int, "on, off or a number of workers")
+    max_jobs = number("SETUP_WORKER_JOBS", os.environ.get("SETUP_WORKER_JOBS", DEFAULT_MAX_JOBS), int)
+    max_mb = number("SETUP_WORKER_MB", os.environ.get("SETUP_WORKER_MB", DEFAULT_MAX_MB), float)
+    preload = [name for name in os.environ.get("SETUP_WORKER_PRELOAD", "").split(",") if name]
+    return size, max_jobs, max_mb, preload
+
+
+def get_pool():
+    """
+    Return the WorkerPool of this process configured by ``$SETUP_WORKER_POOL``, or None
+    when it is disabled.
+
+    :raises ValueError: If the configuration is invalid, see ``pool_settings``.
+    """
+    global _pool
+    settings = pool_settings()
+    if settings is None:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = WorkerPool(*settings)
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,117 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Compare the streaming JSON writer with the original ``json.dump(..., indent=2)`` path,
+and the vector export, whose shapes and layers are checked to read back unchanged.
+
+Run from the repository root with ``python -m benchmarks.bench_export``.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from SetUp.data_classes import RobotConfig, SimulatorConfig, ConfigEncoder
+from SetUp.json_stream import write_config
+from SetUp.occupancy import OccupancyGrid
+from SetUp.vector_format import grid_from_vector, shape_index, vector_env
+
+
+def legacy_export(data_config, path):
+    """Build the whole document in memory and dump it, as ``produce_json`` used to."""
+    data_config = dict(data_config, env=data_config["env"].to_dict())
+    with open(path, "w") as data_file:
+        json.dump(data_config, data_file, cls=ConfigEncoder, indent=2)
+
+
+def stream_export(data_config, path, compact=False):
+    with open(path, "w") as data_file:
+        write_config(data_file, data_config, compact=compact)
+
+
+def vector_export(data_config, path):
+    data_config = dict(data_config, env=vector_env(data_config["env"]))
+    with open(path, "w") as data_file:
+        write_config(data_file, data_config, compact=True)
+
+
+def check_vector(grid, path):
+    """Return the differences between ``grid`` and the vector ``data_file`` at ``path``."""
+    with open(path, "r") as data_file:
+        env = json.load(data_file)["env"]
+    problems = []
+    copy = grid_from_vector(env, quadtree=False)
+    for name in grid.layers:
+        if not np.array_equal(grid.block(name, 0, grid.shape[0], 0, grid.shape[1]),
+                              copy.block(name, 0, copy.shape[0], 0, copy.shape[1])):
+            problems.append(f"layer {name} differs")
+    if copy.shapes.records() != grid.shapes.records():
+        problems.append("shapes differ")
+    if len(shape_index(env).conflicts()) != len(grid.shapes.conflicts()):
+        problems.append("overlaps differ")
+    return problems
+
+
+def measure(function, *args, **kwargs):
+    """
+    Return wall time in seconds and peak traced memory in MB of ``function``.
+
+    The call is made twice, since tracing allocations slows it down too much to time.
+    """
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 1e6
+
+
+def main():
+    robot = RobotConfig("450X", "random - random", 0.62, 0.24, 270, 2, "")
+    print(f"{'field':<14}{'writer':<10}{'time (s)':>10}{'peak (MB)':>11}{'MB/s':>9}")
+    failures = 0
+    for side in (20.0, 40.0, 80.0):
+        grid = OccupancyGrid(side, side, 0.1)
+        grid.fill_circle("circles", side / 2, side / 2, side / 3)
+        grid.fill_rectangle("squares", 0, 0, side / 2, side / 4)
+        # Tiles no shape covers, as an imported image leaves
+        grid.layers["opening"][3, 5:9] = True
+        data_config = {"robot": robot, "env": grid, "simulator": SimulatorConfig(0.1, 1, 1, 10)}
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "data_file")
+            runs = [
+                ("legacy", legacy_export, {}),
+                ("stream", stream_export, {}),
+                ("compact", stream_export, {"compact": True}),
+                ("vector", vector_export, {}),
+            ]
+            for name, function, kwargs in runs:
+                elapsed, peak = measure(function, data_config, path, **kwargs)
+                size = os.path.getsize(path) / 1e6
+                print(f"{side:>5.0f} m @0.1  {name:<10}{elapsed:>10.3f}{peak:>11.1f}{size / elapsed:>9.1f}")
+            for problem in check_vector(grid, path):
+                print(f"MISMATCH {side:.0f} m: {problem}")
+                failures += 1
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Compare launching every run in a fresh interpreter with the warm worker pool, on the
+stand-in simulator of ``benchmarks/stand_in_smarters.py``.
+
+Run from the repository root with ``python -m benchmarks.bench_launch``.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from SetUp.data_classes import RobotConfig, SimulatorConfig, ConfigEncoder
+from SetUp.worker_pool import WorkerPool
+
+STAND_IN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stand_in_smarters.py")
+RUNS = 20
+
+
+def write_runs(directory, runs):
+    """Write the ``data_file`` of ``runs`` runs, each in its own directory."""
+    run_dirs = []
+    robot = RobotConfig("450X", "random - random", 0.62, 0.24, 270, 2, "")
+    for index in range(runs):
+        run_dir = os.path.join(directory, f"run_{index:03d}")
+        os.makedirs(run_dir)
+        config = {"robot": robot, "env": None, "simulator": SimulatorConfig(0.2, index, 1, 10)}
+        with open(os.path.join(run_dir, "data_file"), "w") as data_file:
+            json.dump(config, data_file, cls=ConfigEncoder)
+        run_dirs.append(run_dir)
+    return run_dirs
+
+
+def read_results(run_dirs):
+    results = []
+    for run_dir in run_dirs:
+        with open(os.path.join(run_dir, "result.json"), "r") as result_file:
+            results.append(json.load(result_file))
+    return results
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        run_dirs = write_runs(directory, RUNS)
+
+        start = time.perf_counter()
+        for run_dir in run_dirs:
+            subprocess.run([sys.executable, STAND_IN], cwd=run_dir, check=True, stdout=subprocess.DEVNULL)
+        cold = time.perf_counter() - start
+        cold_results = read_results(run_dirs)
+
+        pool = WorkerPool(size=1)
+        start = time.perf_counter()
+        for run_dir in run_dirs:
+            pool.run(STAND_IN, run_dir, subprocess.DEVNULL)
+        warm = time.perf_counter() - start
+        pool.close()
+        same = read_results(run_dirs) == cold_results
+
+    print(f"{'launcher':<14}{'runs':>6}{'total (s)':>11}{'per run (ms)':>14}")
+    for name, elapsed in (("interpreter", cold), ("worker pool", warm)):
+        print(f"{name:<14}{RUNS:>6}{elapsed:>11.3f}{elapsed / RUNS * 1000:>14.1f}")
+    print(f"same results: {same}")
+
+
+if __name__ == "__main__":
+    main()
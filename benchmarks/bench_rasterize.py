@@ -0,0 +1,73 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Compare the vectorized rasterizer with the original nested-loop implementation.
+
+Run from the repository root with ``python -m benchmarks.bench_rasterize``.
+"""
+
+import math
+import time
+
+from SetUp.rasterize import rasterize_rectangle, rasterize_circle, cells_to_tuples
+
+
+def legacy_rectangle(x, y, width, height, d_tassel):
+    """Nested-loop rectangle rasterization as originally written in ``gui.py``."""
+    cells = []
+    x, y = round(x / d_tassel), round(y / d_tassel)
+    end_x, end_y = x + round(width / d_tassel), y + round(height / d_tassel)
+    for i in range(x, end_x):
+        for j in range(y, end_y):
+            cells.append((i, j))
+    return cells
+
+
+def legacy_circle(x_center, y_center, radius, d_tassel, length, width):
+    """Full-grid circle rasterization as originally written in ``gui.py``."""
+    cells = []
+    x_center, y_center = math.floor(x_center / d_tassel), math.floor(y_center / d_tassel)
+    radius = round(radius / d_tassel)
+    for i in range(int(length / d_tassel)):
+        for j in range(int(width / d_tassel)):
+            if math.hypot(i - x_center, j - y_center) <= radius:
+                cells.append((i, j))
+    return cells
+
+
+def timed(function, *args):
+    """Return the result of ``function(*args)`` and the elapsed wall time in seconds."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    cases = [
+        ("circle 50x50 m @0.20", legacy_circle, rasterize_circle, (20.3, 31.7, 4.0, 0.2, 50.0, 50.0)),
+        ("circle 200x200 m @0.10", legacy_circle, rasterize_circle, (120.0, 80.0, 3.0, 0.1, 200.0, 200.0)),
+        ("circle on border", legacy_circle, rasterize_circle, (0.5, 99.9, 6.0, 0.2, 100.0, 100.0)),
+        ("square 10x10 m @0.05", legacy_rectangle, rasterize_rectangle, (3.0, 4.0, 10.0, 10.0, 0.05)),
+    ]
+    print(f"{'case':<26}{'legacy (s)':>12}{'numpy (s)':>12}{'speedup':>10}")
+    for name, legacy, vectorized, args in cases:
+        expected, legacy_time = timed(legacy, *args)
+        cells, new_time = timed(vectorized, *args)
+        if cells_to_tuples(cells) != expected:
+            raise AssertionError(f"{name}: vectorized cells differ from the legacy result")
+        print(f"{name:<26}{legacy_time:>12.4f}{new_time:>12.4f}{legacy_time / new_time:>9.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Check the import time of the GUI entry point and of the headless path.
+
+Each module is imported in a fresh interpreter with ``python -X importtime``; the check
+fails if its cumulative import time exceeds the budget or if it pulls in a module that
+must only be loaded on first use (matplotlib and numpy, and tkinter for the headless path).
+
+Run from the repository root with ``python -m benchmarks.importtime``; the exit status
+is nonzero when a budget is exceeded. ``tests/test_importtime.py`` checks the same
+budgets under ``python -m pytest tests``.
+"""
+
+import os
+import subprocess
+import sys
+
+# Entry points, their budget in milliseconds and the modules they must not import
+BUDGETS = {
+    "SetUp.gui": (250, ("matplotlib", "numpy")),
+    "SetUp.cli": (150, ("matplotlib", "numpy", "tkinter")),
+}
+REPEATS = 3
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module):
+    """
+    Import ``module`` in a fresh interpreter.
+
+    :return: Dict mapping every module imported to its cumulative import time in ms.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative) / 1000
+        except ValueError:
+            # Header line
+            continue
+    return times
+
+
+def forbidden_imports(times, forbidden):
+    """Return the modules of ``times`` in one of the ``forbidden`` packages, sorted."""
+    return sorted(
+        name for name in times
+        if name.split(".")[0] in forbidden or name.split(".")[0].lstrip("_") in forbidden
+    )
+
+
+def measure(module, repeats=REPEATS):
+    """
+    Import ``module`` in ``repeats`` fresh interpreters.
+
+    :return: The fastest cumulative import time of ``module`` in ms, leaving out the
+        first run's cold caches, and the times of every module of the first run.
+    """
+    runs = [import_times(module) for _ in range(repeats)]
+    return min(times[module] for times in runs), runs[0]
+
+
+def check(module, budget, forbidden):
+    """
+    Measure ``module`` and report on its budget.
+
+    :return: True if the module is within its budget.
+    """
+    elapsed, times = measure(module)
+    loaded = forbidden_imports(times, forbidden)
+    ok = elapsed <= budget and not loaded
+    print(f"{module:<12} {elapsed:8.1f} ms (budget {budget} ms)  {'ok' if ok else 'FAIL'}")
+    if loaded:
+        print(f"    imports {', '.join(loaded)}")
+    return ok
+
+
+def main():
+    results = [check(module, budget, forbidden) for module, (budget, forbidden) in BUDGETS.items()]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Stand-in for the SMARTERS entry point, for exercising the launcher without the simulator.
+
+Like a short simulator run, it imports numpy, reads the ``data_file`` of its working
+directory and writes ``result.json`` there: the robot type, the number of maps and
+repetitions, and a pseudo coverage derived from the configuration. It exits with the
+status given by ``$STAND_IN_EXIT``, 0 by default, after sleeping ``$STAND_IN_SLEEP``
+seconds, none by default.
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def main():
+    with open("data_file", "r") as data_file:
+        config = json.load(data_file)
+    simulator = config["simulator"]
+    rng = np.random.default_rng(simulator["num_maps"] * 1000 + simulator["repetitions"])
+    result = {
+        "robot": config["robot"]["type"],
+        "num_maps": simulator["num_maps"],
+        "repetitions": simulator["repetitions"],
+        "coverage": float(rng.uniform(0.8, 1.0)),
+    }
+    with open("result.json", "w") as result_file:
+        json.dump(result, result_file)
+    print(f"Covered {result['coverage']:.1%} of the field")
+    time.sleep(float(os.environ.get("STAND_IN_SLEEP", 0)))
+    return int(os.environ.get("STAND_IN_EXIT", 0))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
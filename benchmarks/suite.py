@@ -0,0 +1,278 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Benchmark suite of the hot paths of the setup tool.
+
+Measures wall time and peak traced memory of the map editor rasterization
+(``update_area_coordinates`` and ``update_area_coordinates_for_circle``), of
+``draw_map`` and of adding a shape on an Agg canvas, of ``produce_json`` in every
+export format and of the robot lookup, on fields from a few thousand to several
+million tiles.
+
+Run from the repository root::
+
+    python -m benchmarks.suite run --output results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.2
+
+``compare`` exits with status 1 when a case got slower or used more memory than the
+threshold allows.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import matplotlib
+
+# No display is needed: draw_map is measured on an Agg canvas
+matplotlib.use("Agg")
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from SetUp import gui
+from SetUp.data_classes import RobotConfig, SimulatorConfig
+from SetUp.export import EXPORT_FORMATS, produce_json
+from SetUp.occupancy import OccupancyGrid
+from SetUp.robot_catalog import get_catalog
+
+RESULTS_VERSION = 1
+# Square fields as (side in metres, tile size): 10k, 250k, 1M and 4M tiles
+SIZES = [(50.0, 0.5), (100.0, 0.2), (100.0, 0.1), (200.0, 0.1)]
+QUICK_SIZES = SIZES[:2]
+REPEATS = 5
+# Relative slowdown or memory growth reported as a regression by compare
+THRESHOLD = 0.2
+# Differences below these are noise whatever their ratio
+MIN_TIME = 1e-3
+MIN_PEAK_MB = 0.5
+
+ROBOT = RobotConfig("450X", "random - random", 0.62, 0.24, 270, 2, "")
+
+
+def measure(function, repeats=REPEATS):
+    """
+    Return the best wall time in seconds and the peak traced memory in MB of ``function``.
+
+    The peak is taken on an extra call, since tracing allocations slows it down too
+    much to time.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak / 1e6
+
+
+def editor_grid(side, d_tassel):
+    """Set up the map editor state of ``gui`` for a square field and return its grid."""
+    gui.objects_data["length"] = gui.objects_data["width"] = side
+    gui.objects_data["grid"] = OccupancyGrid(side, side, d_tassel)
+    gui.python_objects[:] = [ROBOT, SimulatorConfig(d_tassel, 0, 1, 10)]
+    return gui.objects_data["grid"]
+
+
+def sample_grid(side, d_tassel):
+    """Return a field with a large square, a large circle and an isolated area drawn on it."""
+    grid = OccupancyGrid(side, side, d_tassel)
+    grid.fill_rectangle("squares", 0, 0, side / 2, side / 4)
+    grid.fill_circle("circles", side / 2, side / 2, side / 3)
+    grid.fill_rectangle("isolated_area", side * 0.7, side * 0.7, side / 5, side / 5)
+    grid.fill_rectangle("opening", side * 0.75, side * 0.7, side / 20, d_tassel)
+    return grid
+
+
+def rectangle_case(side, d_tassel, directory):
+    editor_grid(side, d_tassel)
+    return lambda: gui.update_area_coordinates(side / 8, side / 8, side * 0.75, side / 2, "squares")
+
+
+def circle_case(side, d_tassel, directory):
+    editor_grid(side, d_tassel)
+    return lambda: gui.update_area_coordinates_for_circle(side / 2, side / 2, side * 0.4, "circles")
+
+
+def draw_map_case(side, d_tassel, directory):
+    editor_grid(side, d_tassel)
+    figure = Figure(figsize=(10, 10))
+    gui.canv = FigureCanvasAgg(figure)
+    gui.ax = figure.add_subplot()
+    return gui.draw_map
+
+
+def draw_shape_case(side, d_tassel, directory):
+    """Add one more obstacle to a map that already shows many, as the editor does."""
+    draw_map_case(side, d_tassel, directory)()
+    for k in range(100):
+        gui.draw_rectangle(k % 10 * side / 10, k // 10 * side / 10, side / 40, side / 40, "black")
+    gui.shape_blitter.flush()
+
+    def draw_shape():
+        gui.draw_circle(side / 2, side / 2, side / 20, "red")
+        gui.shape_blitter.flush()
+
+    return draw_shape
+
+
+def export_case(export_format):
+    def case(side, d_tassel, directory):
+        data = [ROBOT, SimulatorConfig(d_tassel, 0, 1, 10), sample_grid(side, d_tassel)]
+        path = os.path.join(directory, "data_file")
+        return lambda: produce_json(data, export_format, path)
+
+    return case
+
+
+def robot_lookup_case(side, d_tassel, directory):
+    catalog = get_catalog()
+    ids = catalog.ids()
+
+    def lookup():
+        for robot_id in ids:
+            catalog.robot_config(robot_id)
+        catalog.query(speed=(0.3, 0.6), autonomy=(100, None))
+
+    return lookup
+
+
+# Case name, setup function returning the callable to measure (given the field and a
+# scratch directory), and whether the case depends on the field size
+CASES = [
+    ("update_area_coordinates", rectangle_case, True),
+    ("update_area_coordinates_for_circle", circle_case, True),
+    ("draw_map", draw_map_case, True),
+    ("draw_shape", draw_shape_case, True),
+] + [
+    (f"produce_json[{export_format}]", export_case(export_format), True)
+    for export_format in EXPORT_FORMATS
+] + [
+    ("robot_lookup", robot_lookup_case, False),
+]
+
+
+def size_label(side, d_tassel):
+    return f"{side:g}x{side:g}@{d_tassel:g}"
+
+
+def run(sizes=SIZES, repeats=REPEATS, selected=None):
+    """
+    Run the benchmarks.
+
+    :param sizes: Fields to run the size dependent cases on, as ``(side, d_tassel)``.
+    :param selected: Names of the cases to run, all of them by default.
+    :return: The results document, as written by ``main``.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, setup, sized in CASES:
+            if selected and name not in selected:
+                continue
+            for side, d_tassel in (sizes if sized else sizes[:1]):
+                elapsed, peak = measure(setup(side, d_tassel, directory), repeats)
+                result = {
+                    "case": name,
+                    "size": size_label(side, d_tassel) if sized else "",
+                    "tiles": int(side / d_tassel) ** 2 if sized else 0,
+                    "time": elapsed,
+                    "peak_mb": peak,
+                }
+                results.append(result)
+                print(
+                    f"{name:<36}{result['size']:<14}{elapsed * 1000:>11.3f} ms{peak:>10.1f} MB",
+                    flush=True,
+                )
+    return {
+        "version": RESULTS_VERSION,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "results": results,
+    }
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    Compare two results documents.
+
+    :return: List of ``(case, size, metric, before, after)`` for every measurement that
+        grew by more than ``threshold``, relatively, and by more than the noise floor.
+    """
+    before = {(r["case"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["case"], result["size"])
+        if key not in before:
+            continue
+        for metric, floor in (("time", MIN_TIME), ("peak_mb", MIN_PEAK_MB)):
+            old, new = before[key][metric], result[metric]
+            if new - old > floor and new > old * (1 + threshold):
+                regressions.append(key + (metric, old, new))
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.suite",
+        description="Benchmark rasterization, map rendering, export and robot lookup.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", help="write the results to this JSON file")
+    run_parser.add_argument("--quick", action="store_true", help="only the smaller fields")
+    run_parser.add_argument("--repeats", type=int, default=REPEATS, help="timed calls per case")
+    run_parser.add_argument(
+        "--case", dest="cases", action="append", choices=[name for name, _, _ in CASES],
+        help="run only this case (repeatable)",
+    )
+    compare_parser = commands.add_parser("compare", help="flag regressions between two runs")
+    compare_parser.add_argument("baseline", help="results of the reference run")
+    compare_parser.add_argument("current", help="results of the run to check")
+    compare_parser.add_argument(
+        "--threshold", type=float, default=THRESHOLD, help="tolerated relative growth"
+    )
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        document = run(QUICK_SIZES if args.quick else SIZES, args.repeats, args.cases)
+        if args.output:
+            with open(args.output, "w") as results_file:
+                json.dump(document, results_file, indent=2)
+        return 0
+
+    with open(args.baseline, "r") as baseline_file, open(args.current, "r") as current_file:
+        regressions = compare(json.load(baseline_file), json.load(current_file), args.threshold)
+    for case, size, metric, old, new in regressions:
+        print(f"REGRESSION {case} {size} {metric}: {old:.4g} -> {new:.4g} ({new / old - 1:+.0%})")
+    if not regressions:
+        print("No regressions.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
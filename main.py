@@ -11,8 +11,16 @@
  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
  See the License for the specific language governing permissions and
  limitations under the License."""
-from SetUp.gui import RobotWindow
+import sys
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # Headless generation, without loading Tk or matplotlib
+        from SetUp.cli import main
+
+        sys.exit(main())
+
+    from SetUp.gui import RobotWindow
+
     RobotWindow().mainloop()
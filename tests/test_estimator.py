@@ -0,0 +1,43 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Coverage estimates, and the recharges counted against the cycle.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+from SetUp.data_classes import RobotConfig, SimulatorConfig
+from SetUp.estimator import CHARGE_TIME, STATUSES, estimate, estimate_arrays
+
+
+def test_recharges_take_time():
+    assert CHARGE_TIME > 0
+    # 10000 m² at 6 m² per minute: 1667 to 2500 minutes of systematic cutting
+    result = estimate_arrays(10000., .5, .2, [0.001, 100., 1000., 100000.], 2000, True)
+    assert list(result["min_recharges"]) == [1666666, 16, 1, 0]
+    assert [STATUSES[status] for status in result["status"]] == [
+        "infeasible", "infeasible", "uncertain", "uncertain",
+    ]
+
+
+def test_lowering_autonomy_makes_a_run_infeasible():
+    simulator = SimulatorConfig(dim_tassel=0.5, num_maps=1, repetitions=1, cycle=600)
+    # 1600 tiles of 0.25 m²: 400 m² at 0.5 * 0.24 * 60 = 7.2 m² per minute
+    long_lasting = RobotConfig("450X", "systematic - ping-pong", 0.5, 0.24, 270, 2, "")
+    assert estimate(long_lasting, simulator, 1600).status == "feasible"
+
+    short_lived = RobotConfig("450X", "systematic - ping-pong", 0.5, 0.24, 5, 2, "")
+    result = estimate(short_lived, simulator, 1600)
+    assert result.min_recharges == 11
+    assert result.status == "infeasible"
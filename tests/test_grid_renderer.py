@@ -0,0 +1,67 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Axes of the map editor grid and of the image of the marked tiles, on a non-square field,
+and shapes added on a canvas that cannot blit.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+from matplotlib.figure import Figure  # noqa: E402
+
+from matplotlib.backends.backend_svg import FigureCanvasSVG  # noqa: E402
+from matplotlib.patches import Rectangle  # noqa: E402
+
+from SetUp.grid_renderer import GridRenderer, ShapeBlitter, occupancy_image  # noqa: E402
+from SetUp.occupancy import OccupancyGrid  # noqa: E402
+
+BLACK = (0, 0, 0, 255)
+
+
+def test_grid_image_and_shapes_share_the_field_axes():
+    grid = OccupancyGrid(100, 30, 1)
+    # Inside the field: 50 m along its length, x, and 10 m along its width, y
+    grid.fill_rectangle("squares", 50, 10, 5, 5)
+    assert grid["squares"].sum() == 25
+
+    ax = Figure().add_subplot()
+    renderer = GridRenderer(ax, grid.length, grid.width, grid.d_tassel)
+    renderer.draw()
+    assert ax.get_xlim() == (0, 100) and ax.get_ylim() == (0, 30)
+    assert (renderer.border.get_width(), renderer.border.get_height()) == (100, 30)
+
+    image = occupancy_image(ax, grid, {"squares": BLACK})
+    assert tuple(image.get_extent()) == (0, 100, 0, 30)
+    pixels = image.get_array()
+    # Image rows go up the y axis, image columns along x
+    assert pixels.shape[:2] == (30, 100)
+    assert tuple(pixels[12, 52]) == BLACK
+    assert not pixels[:10].any() and not pixels[:, :50].any()
+
+
+def test_shapes_are_drawn_on_canvases_without_blitting():
+    figure = Figure()
+    canvas = FigureCanvasSVG(figure)
+    assert not canvas.supports_blit
+    blitter = ShapeBlitter(figure.add_subplot())
+    patches = []
+    for corner in (0, 1):
+        patches.append(blitter.add(Rectangle((corner, corner), 1, 1)))
+        canvas.draw()
+    assert not blitter.pending and not blitter._scheduled
+    assert not any(patch.get_animated() for patch in patches)
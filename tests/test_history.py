@@ -0,0 +1,56 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Undo and redo of the map editor's edits.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+import pytest
+
+from SetUp.history import EditHistory
+from SetUp.occupancy import OccupancyGrid
+
+
+def add_squares(history, count):
+    for k in range(count):
+        with history.record("Add square"):
+            history.grid.fill_rectangle("squares", 2 * k, 0, 1, 1)
+
+
+def test_failed_edit_is_reverted_and_not_recorded():
+    grid = OccupancyGrid(20, 10, 1)
+    history = EditHistory(grid)
+    with pytest.raises(TypeError):
+        with history.record("Add isolated area"):
+            grid.fill_rectangle("isolated_area", 0, 0, 4, 4)
+            # A cancelled dialog gives None
+            grid.fill_rectangle("opening", None, 0, 1, 1)
+    assert grid.count("isolated_area") == 0 and len(grid.shapes) == 0
+    assert not history.can_undo()
+
+
+def test_redo_keeps_the_history_within_its_limits():
+    grid = OccupancyGrid(20, 10, 1)
+    history = EditHistory(grid, max_edits=3)
+    add_squares(history, 3)
+    for _ in range(3):
+        history.undo()
+    assert grid.count("squares") == 0
+    history.max_edits = 2
+    for _ in range(3):
+        history.redo()
+    assert grid.count("squares") == 3
+    assert history.undo() is not None and history.undo() is not None
+    assert history.undo() is None and grid.count("squares") == 1
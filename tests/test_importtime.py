@@ -0,0 +1,30 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Import time budgets of the GUI and headless entry points, see ``benchmarks.importtime``.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+import pytest
+
+from benchmarks.importtime import BUDGETS, forbidden_imports, measure
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_entry_point_imports_within_budget(module):
+    budget, forbidden = BUDGETS[module]
+    elapsed, times = measure(module)
+    assert forbidden_imports(times, forbidden) == []
+    assert elapsed <= budget, f"{module} takes {elapsed:.1f} ms to import, over its {budget} ms budget"
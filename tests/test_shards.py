@@ -0,0 +1,110 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Merging of the files the simulator writes in the shard directories.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+import csv
+import json
+import os
+
+from SetUp.shards import LOG_FILE, RESULTS_DIR, merge_results, plan_shards
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", newline="") as output:
+        output.write(text)
+
+
+def read_csv(path):
+    with open(path, "r", newline="") as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def sharded_run(tmp_path):
+    """Return three shards of 6 maps, the first two with the same CSV header."""
+    shards = plan_shards(6, 1, str(tmp_path), shards=3)
+    for shard in shards:
+        write(os.path.join(shard.run_dir, "data_file"), "{}")
+        write(os.path.join(shard.run_dir, LOG_FILE), "log\n")
+    return shards
+
+
+def test_merges_csv_rows_with_their_origin(tmp_path):
+    shards = sharded_run(tmp_path)
+    for shard in shards:
+        rows = "".join(f"{shard.first_map + k},0.9{k}\n" for k in range(shard.num_maps))
+        write(os.path.join(shard.run_dir, "out", "coverage.csv"), "map,coverage\n" + rows)
+
+    merged = merge_results(str(tmp_path), shards)
+
+    assert merged == {os.path.join("out", "coverage.csv"): "concatenated"}
+    rows = read_csv(os.path.join(tmp_path, RESULTS_DIR, "out", "coverage.csv"))
+    assert rows[0] == ["shard", "first_map", "first_repetition", "map", "coverage"]
+    assert rows[1:] == [
+        ["0", "0", "0", "0", "0.90"], ["0", "0", "0", "1", "0.91"],
+        ["1", "2", "0", "2", "0.90"], ["1", "2", "0", "3", "0.91"],
+        ["2", "4", "0", "4", "0.90"], ["2", "4", "0", "5", "0.91"],
+    ]
+
+
+def test_merges_json_lists_and_tags_records(tmp_path):
+    shards = sharded_run(tmp_path)
+    for shard in shards:
+        records = [{"map": shard.first_map, "coverage": 0.5}, shard.index]
+        write(os.path.join(shard.run_dir, "result.json"), json.dumps(records))
+
+    merge_results(str(tmp_path), shards)
+
+    with open(os.path.join(tmp_path, RESULTS_DIR, "result.json"), "r") as merged:
+        records = json.load(merged)
+    assert records == [
+        {"shard": 0, "first_map": 0, "first_repetition": 0, "map": 0, "coverage": 0.5}, 0,
+        {"shard": 1, "first_map": 2, "first_repetition": 0, "map": 2, "coverage": 0.5}, 1,
+        {"shard": 2, "first_map": 4, "first_repetition": 0, "map": 4, "coverage": 0.5}, 2,
+    ]
+
+
+def test_copies_files_that_cannot_be_concatenated(tmp_path):
+    shards = sharded_run(tmp_path)
+    for shard in shards:
+        header = "map,coverage\n" if shard.index < 2 else "map,time\n"
+        write(os.path.join(shard.run_dir, "coverage.csv"), header + "0,1\n")
+        write(os.path.join(shard.run_dir, "summary.json"), json.dumps({"shard": shard.index}))
+    # Only some shards wrote this one
+    write(os.path.join(shards[1].run_dir, "notes.txt"), "shard 1")
+
+    merged = merge_results(str(tmp_path), shards)
+
+    assert merged == {"coverage.csv": "copied", "notes.txt": "copied", "summary.json": "copied"}
+    results = os.path.join(tmp_path, RESULTS_DIR)
+    assert not os.path.exists(os.path.join(results, "coverage.csv"))
+    for shard in shards:
+        copies = os.path.join(results, f"shard_{shard.index:04d}")
+        assert read_csv(os.path.join(copies, "coverage.csv"))[1] == ["0", "1"]
+        with open(os.path.join(copies, "summary.json"), "r") as summary:
+            assert json.load(summary) == {"shard": shard.index}
+    assert os.listdir(os.path.join(results, "shard_0001")).count("notes.txt") == 1
+    assert not os.path.exists(os.path.join(results, "shard_0000", "notes.txt"))
+
+    with open(os.path.join(results, "index.json"), "r") as index_file:
+        index = json.load(index_file)
+    assert index["merged"] == merged
+    assert [entry["index"] for entry in index["shards"]] == [0, 1, 2]
+    assert [entry["first_map"] for entry in index["shards"]] == [0, 2, 4]
+    assert sorted(index["shards"][1]["outputs"]) == ["coverage.csv", "notes.txt", "summary.json"]
+    assert sorted(index["shards"][0]["outputs"]) == ["coverage.csv", "summary.json"]
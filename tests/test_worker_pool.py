@@ -0,0 +1,138 @@
+""" Copyright 2024 Sara Grecu
+
+ Licensed under the Apache License, Version 2.0 (the "License");
+ you may not use this file except in compliance with the License.
+ You may obtain a copy of the License at
+
+     https://www.apache.org/licenses/LICENSE-2.0
+
+ Unless required by applicable law or agreed to in writing, software
+ distributed under the License is distributed on an "AS IS" BASIS,
+ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ See the License for the specific language governing permissions and
+ limitations under the License.
+
+Runs of ``benchmarks/stand_in_smarters.py`` in the warm worker pool.
+
+Workers inherit the environment when they start, so the ``$STAND_IN_EXIT`` and
+``$STAND_IN_SLEEP`` of the stand-in are set before the first run of a pool.
+
+Run from the repository root with ``python -m pytest tests``.
+"""
+
+import json
+import os
+import socket
+import subprocess
+
+import pytest
+
+from SetUp.worker_pool import WorkerPool, pool_settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAND_IN = os.path.join(ROOT, "benchmarks", "stand_in_smarters.py")
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "send_fds"), reason="the worker pool needs a POSIX system")
+
+
+@pytest.fixture
+def run_dir(tmp_path):
+    config = {"robot": {"type": "450X"}, "simulator": {"num_maps": 1, "repetitions": 2}}
+    with open(tmp_path / "data_file", "w") as data_file:
+        json.dump(config, data_file)
+    return tmp_path
+
+
+@pytest.fixture
+def make_pool():
+    pools = []
+
+    def make(**settings):
+        pools.append(WorkerPool(**settings))
+        return pools[-1]
+
+    yield make
+    for pool in pools:
+        pool.close()
+
+
+def run(pool, run_dir, timeout=None):
+    """Run the stand-in, returning its exit code and what it wrote to each output."""
+    with open(run_dir / "out.log", "w+") as out, open(run_dir / "err.log", "w+") as err:
+        returncode = pool.run(STAND_IN, run_dir, out, err, timeout)
+        out.seek(0)
+        err.seek(0)
+        return returncode, out.read(), err.read()
+
+
+def test_runs_in_a_warm_worker_with_the_given_outputs(make_pool, run_dir):
+    pool = make_pool(size=1)
+    for _ in range(3):
+        returncode, out, err = run(pool, run_dir)
+        assert returncode == 0
+        assert out.startswith("Covered ") and out.endswith("% of the field\n")
+        assert err == ""
+    with open(run_dir / "result.json", "r") as result_file:
+        assert json.load(result_file)["repetitions"] == 2
+    assert pool.stats == {"started": 1, "recycled": 0, "runs": 3}
+
+
+def test_returns_the_exit_code(make_pool, run_dir, monkeypatch):
+    monkeypatch.setenv("STAND_IN_EXIT", "3")
+    pool = make_pool(size=1)
+    assert run(pool, run_dir)[0] == 3
+    # A failed run does not cost the worker
+    assert run(pool, run_dir)[0] == 3
+    assert pool.stats["started"] == 1
+
+
+def test_replaces_workers_after_max_jobs(make_pool, run_dir):
+    pool = make_pool(size=1, max_jobs=2)
+    for _ in range(5):
+        assert run(pool, run_dir)[0] == 0
+    assert pool.stats == {"started": 3, "recycled": 2, "runs": 5}
+
+
+def test_replaces_workers_above_the_memory_ceiling(make_pool, run_dir):
+    # Any interpreter that imported numpy uses more than a megabyte
+    pool = make_pool(size=1, max_mb=1)
+    for _ in range(2):
+        assert run(pool, run_dir)[0] == 0
+    assert pool.stats == {"started": 2, "recycled": 2, "runs": 2}
+
+
+def test_kills_and_replaces_a_worker_that_times_out(make_pool, run_dir, monkeypatch):
+    monkeypatch.setenv("STAND_IN_SLEEP", "30")
+    pool = make_pool(size=1)
+    with pytest.raises(subprocess.TimeoutExpired):
+        run(pool, run_dir, timeout=2)
+    assert pool.stats == {"started": 1, "recycled": 0, "runs": 0}
+
+    monkeypatch.delenv("STAND_IN_SLEEP")
+    returncode, out, _ = run(pool, run_dir, timeout=30)
+    assert returncode == 0 and out.startswith("Covered ")
+    assert pool.stats["started"] == 2
+
+
+@pytest.mark.parametrize("variable, value", [
+    ("SETUP_WORKER_POOL", "bogus"),
+    ("SETUP_WORKER_POOL", "-2"),
+    ("SETUP_WORKER_JOBS", "0"),
+    ("SETUP_WORKER_JOBS", "many"),
+    ("SETUP_WORKER_MB", "-1"),
+])
+def test_pool_settings_reject_invalid_values(monkeypatch, variable, value):
+    monkeypatch.setenv("SETUP_WORKER_POOL", "on")
+    monkeypatch.setenv(variable, value)
+    with pytest.raises(ValueError, match=f"Invalid \\${variable} '{value}'"):
+        pool_settings()
+
+
+def test_pool_settings(monkeypatch):
+    monkeypatch.setenv("SETUP_WORKER_POOL", "off")
+    assert pool_settings() is None
+    monkeypatch.setenv("SETUP_WORKER_POOL", "2")
+    monkeypatch.setenv("SETUP_WORKER_JOBS", "10")
+    monkeypatch.setenv("SETUP_WORKER_MB", "256")
+    monkeypatch.setenv("SETUP_WORKER_PRELOAD", "json,numpy")
+    assert pool_settings() == (2, 10, 256.0, ["json", "numpy"])